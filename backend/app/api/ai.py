@@ -1,12 +1,15 @@
 """
 AI Chat endpoint - handles LLM interactions
 """
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import List
 from pydantic import BaseModel
-from app.database.database import get_db
+from app.database.database import session_scope
 from app.services.llm_service import llm_service
+from app.services.llm_exceptions import LLMUnavailableError
+from app.services.llm_admission import Priority
 from app import crud, schemas
 
 router = APIRouter()
@@ -26,7 +29,7 @@ class ChatResponse(BaseModel):
     data: dict = None
 
 @router.post("/chat", response_model=ChatResponse)
-async def chat_with_ai(request: ChatRequest, db: Session = Depends(get_db)):
+async def chat_with_ai(request: ChatRequest):
     """
     Main AI chat endpoint
     LLM can trigger actions like creating goals, milestones, etc.
@@ -39,27 +42,35 @@ async def chat_with_ai(request: ChatRequest, db: Session = Depends(get_db)):
         ]
         
         # Add system prompt with context
-        system_prompt = _build_system_prompt(request.goal_id, request.context, db)
+        # Short-lived session in the threadpool: no connection is held during the LLM call
+        system_prompt = await run_in_threadpool(_load_system_prompt, request.goal_id, request.context)
         llm_messages.insert(0, {"role": "system", "content": system_prompt})
         
         # Get AI response
         response_text = await llm_service.chat_completion(
             messages=llm_messages,
             temperature=0.7,
-            max_tokens=500
+            max_tokens=500,
+            priority=Priority.INTERACTIVE
         )
         
         # Parse response for actions (simple implementation)
-        action, data = _parse_ai_response(response_text, request.goal_id, db)
+        action, data = _parse_ai_response(response_text, request.goal_id)
         
         return ChatResponse(
             message=response_text,
             action=action,
             data=data
         )
+    except LLMUnavailableError as e:
+        raise HTTPException(status_code=503, detail=f"AI service unavailable: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"AI service error: {str(e)}")
 
+def _load_system_prompt(goal_id: int = None, context: dict = None) -> str:
+    with session_scope() as db:
+        return _build_system_prompt(goal_id, context, db)
+
 def _build_system_prompt(goal_id: int = None, context: dict = None, db: Session = None) -> str:
     """Build system prompt with context about goals and milestones"""
     prompt = """You are an AI assistant for goal tracking. You help users:
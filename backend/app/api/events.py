@@ -0,0 +1,171 @@
+"""Realtime channel for new chat messages — replaces polling GET /chats/{id}/new-messages/.
+
+- WebSocket: /api/events/ws?token=<JWT>[&chat_id=][&after_id=]
+- SSE fallback: GET /api/events/stream?token=<JWT>[&chat_id=][&after_id=] (Last-Event-ID is honoured)
+
+One connection carries the messages of all the user's chats (or of chat_id only).
+Frames: {"type": "message", "message": {...}} for every new Message,
+{"type": "resync"} when the connection fell behind (re-fetch via new-messages),
+and a keep-alive every MESSAGE_HUB_HEARTBEAT seconds. after_id first replays the
+messages the client missed while it was disconnected.
+
+The token goes in the query string because browsers can't set headers on
+WebSocket / EventSource. DB work runs in the threadpool; an open connection holds
+no DB connection.
+"""
+import asyncio
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+
+from app import crud
+from app.core.auth import get_user_from_token
+from app.core.config import settings
+from app.database.database import session_scope
+from app.services.message_hub import message_hub, message_payload
+
+router = APIRouter()
+
+CATCH_UP_LIMIT = 200
+
+
+def _open_channel(token: str, chat_id: Optional[int]) -> Tuple[Optional[int], bool]:
+    """(user id or None if the token is invalid, whether chat_id is the user's)."""
+    with session_scope() as db:
+        user = get_user_from_token(db, token)
+        if user is None:
+            return None, False
+        if chat_id is None:
+            return user.id, True
+        chat = crud.chat.get_chat(db, chat_id)
+        goal = crud.goal.get_goal(db, chat.goal_id) if chat else None
+        return user.id, bool(goal and goal.user_id == user.id)
+
+
+def _missed_messages(user_id: int, after_id: Optional[int], chat_id: Optional[int]) -> List[Dict[str, Any]]:
+    if not after_id:
+        return []
+    with session_scope() as db:
+        rows = crud.chat.get_user_messages_after(db, user_id, after_id, chat_id=chat_id, limit=CATCH_UP_LIMIT)
+        return [message_payload(m) for m in rows]
+
+
+def _wanted(event: Dict[str, Any], chat_id: Optional[int], replayed: set) -> bool:
+    if event.get("type") != "message":
+        return True
+    message = event["message"]
+    if chat_id is not None and message["chat_id"] != chat_id:
+        return False
+    return message["id"] not in replayed
+
+
+@router.websocket("/ws")
+async def events_websocket(
+    websocket: WebSocket,
+    token: str = Query(""),
+    chat_id: Optional[int] = Query(None),
+    after_id: Optional[int] = Query(None),
+):
+    user_id, allowed = await run_in_threadpool(_open_channel, token, chat_id)
+    if user_id is None or not allowed:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+
+    # Subscribe before the catch-up query so nothing written in between is missed.
+    queue = message_hub.subscribe(user_id)
+
+    async def pump():
+        missed = await run_in_threadpool(_missed_messages, user_id, after_id, chat_id)
+        replayed = {m["id"] for m in missed}
+        for message in missed:
+            await websocket.send_json({"type": "message", "message": message})
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=settings.MESSAGE_HUB_HEARTBEAT)
+            except asyncio.TimeoutError:
+                await websocket.send_json({"type": "ping"})
+                continue
+            if event is None:
+                await websocket.close()
+                return
+            if _wanted(event, chat_id, replayed):
+                await websocket.send_json({k: v for k, v in event.items() if k != "user_id"})
+
+    async def drain():
+        # Client frames are ignored; reading is how a disconnect is noticed.
+        while True:
+            await websocket.receive_text()
+
+    tasks = [asyncio.create_task(pump()), asyncio.create_task(drain())]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            error = task.exception()
+            if error is not None and not isinstance(error, WebSocketDisconnect):
+                print(f"⚠️ Events WebSocket error for user {user_id}: {error}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        message_hub.unsubscribe(user_id, queue)
+
+
+def _sse_frame(event: Dict[str, Any]) -> str:
+    if event["type"] == "message":
+        message = event["message"]
+        return f"id: {message['id']}\nevent: message\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
+    return f"event: {event['type']}\ndata: {{}}\n\n"
+
+
+@router.get("/stream")
+async def events_stream(
+    request: Request,
+    token: str = Query(""),
+    chat_id: Optional[int] = Query(None),
+    after_id: Optional[int] = Query(None),
+):
+    """Server-Sent Events fallback of /ws (events: `message` with the message as data, `resync`)."""
+    user_id, allowed = await run_in_threadpool(_open_channel, token, chat_id)
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Could not validate credentials")
+    if not allowed:
+        raise HTTPException(status_code=404, detail="Chat not found")
+
+    # EventSource resends the id of the last event it saw when it reconnects.
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        after_id = max(after_id or 0, int(last_event_id))
+
+    async def event_generator():
+        # Subscribe before the catch-up query so nothing written in between is missed.
+        queue = message_hub.subscribe(user_id)
+        try:
+            yield "retry: 3000\n\n"
+            missed = await run_in_threadpool(_missed_messages, user_id, after_id, chat_id)
+            replayed = {m["id"] for m in missed}
+            for message in missed:
+                yield _sse_frame({"type": "message", "message": message})
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=settings.MESSAGE_HUB_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if event is None:
+                    return
+                if _wanted(event, chat_id, replayed):
+                    yield _sse_frame(event)
+        finally:
+            message_hub.unsubscribe(user_id, queue)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -40,4 +40,23 @@ async def get_current_user(db: Session = Depends(get_db), token: str = Depends(o
     if user is None:
         print(f"⚠️  User not found: {username}")
         raise credentials_exception
-    return user
\ No newline at end of file
+    return user
+
+
+def get_user_from_token(db: Session, token: str):
+    """User for a JWT access token, or None.
+
+    For channels that can't use the OAuth2 header dependency (WebSocket, EventSource),
+    where the token comes as a query parameter.
+    """
+    if not token:
+        return None
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError as e:
+        print(f"⚠️  JWT Error: {e}")
+        return None
+    username = payload.get("sub")
+    if username is None:
+        return None
+    return crud.user.get_user_by_username(db, username=username)
@@ -25,6 +25,108 @@ class Settings(BaseSettings):
     LLM_MODEL: str = "qwen2.5:7b"  # Qwen 2.5 - great at instruction following and JSON
     OLLAMA_URL: Optional[str] = "http://localhost:11434"  # Ollama server URL
 
+    # LLM HTTP connection pool (one long-lived pool per provider)
+    LLM_HTTP2: bool = True  # needs httpx[http2]; silently falls back to HTTP/1.1
+    LLM_HTTP_MAX_CONNECTIONS: int = 20
+    LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    LLM_HTTP_KEEPALIVE_EXPIRY: float = 120.0  # seconds an idle connection is kept open
+    LLM_HTTP_CONNECT_TIMEOUT: float = 10.0
+
+    # LLM provider failover: ordered chain tried on every call, e.g.
+    # "deepseek,openrouter,ollama:qwen2.5:7b" (optional ":model" per entry).
+    # Empty = only LLM_PROVIDER.
+    LLM_PROVIDER_CHAIN: str = ""
+    # Per-provider keys for fallback providers (the primary may keep using LLM_API_KEY)
+    DEEPSEEK_API_KEY: Optional[str] = None
+    OPENROUTER_API_KEY: Optional[str] = None
+    GROQ_API_KEY: Optional[str] = None
+    TOGETHER_API_KEY: Optional[str] = None
+    OPENAI_API_KEY: Optional[str] = None
+    GITHUB_API_KEY: Optional[str] = None
+    HUGGINGFACE_API_KEY: Optional[str] = None
+    # Circuit breaker per provider: trips when the failure rate over the last
+    # LLM_BREAKER_WINDOW calls (at least LLM_BREAKER_MIN_CALLS) reaches the threshold
+    LLM_BREAKER_WINDOW: int = 20
+    LLM_BREAKER_MIN_CALLS: int = 4
+    LLM_BREAKER_FAILURE_RATE: float = 0.5
+    LLM_BREAKER_OPEN_SECONDS: float = 30.0  # cool-down before half-open probes
+    LLM_BREAKER_HALF_OPEN_PROBES: int = 1
+
+    # Request hedging for latency-sensitive calls (chat_completion(hedge=True)):
+    # if no reply after the LLM_HEDGE_PERCENTILE of recent (full-response)
+    # latencies, a second request is raced against the first. The backup takes
+    # its own admission slot and is skipped when none is free. Costs extra
+    # tokens, hence opt-in.
+    LLM_HEDGE_ENABLED: bool = False
+    LLM_HEDGE_PERCENTILE: float = 0.95
+    LLM_HEDGE_MIN_SAMPLES: int = 20  # below this, LLM_HEDGE_DEFAULT_DELAY is used
+    LLM_HEDGE_DEFAULT_DELAY: float = 8.0  # seconds
+    LLM_HEDGE_MIN_DELAY: float = 1.0  # seconds
+
+    # Admission control for outbound LLM calls: global concurrency limit with a
+    # bounded priority queue (interactive > normal > background)
+    LLM_MAX_CONCURRENCY: int = 8
+    LLM_QUEUE_SIZE: int = 100
+    # Max seconds a request may wait for a slot / rate-limit budget, per priority
+    LLM_QUEUE_TIMEOUT_INTERACTIVE: float = 15.0
+    LLM_QUEUE_TIMEOUT_NORMAL: float = 30.0
+    LLM_QUEUE_TIMEOUT_BACKGROUND: float = 120.0
+    # Per-provider rate limits "provider=RPM/TPM", e.g. "deepseek=60/100000,openrouter=20"
+    LLM_RATE_LIMITS: str = ""
+
+    # Exact-match completion cache (only calls with temperature <= LLM_CACHE_MAX_TEMPERATURE)
+    LLM_CACHE_BACKEND: str = "memory"  # memory, sqlite (survives restarts) or none
+    LLM_CACHE_PATH: str = "llm_cache.sqlite3"  # sqlite backend file
+    LLM_CACHE_TTL: float = 3600.0  # seconds
+    LLM_CACHE_MAX_ENTRIES: int = 1000
+    LLM_CACHE_MAX_TEMPERATURE: float = 0.3
+
+    # Coach prompt layout for provider-side prompt caching: trainer overlay + static
+    # instructions first (byte-identical across turns), per-goal context appended last
+    LLM_PROMPT_CACHE_LAYOUT: bool = False
+
+    # Chat history sent with each coach turn: latest messages within a token budget
+    CHAT_HISTORY_MAX_MESSAGES: int = 20
+    CHAT_HISTORY_TOKEN_BUDGET: int = 3000  # approximate tokens
+
+    # Rolling chat summaries: once more than TRIGGER messages are not covered by the
+    # summary, all but the latest KEEP_RECENT are folded into it in the background
+    CHAT_SUMMARY_ENABLED: bool = True
+    CHAT_SUMMARY_TRIGGER_MESSAGES: int = 20  # keep <= CHAT_HISTORY_MAX_MESSAGES
+    CHAT_SUMMARY_KEEP_RECENT: int = 8
+    CHAT_SUMMARY_BATCH_MESSAGES: int = 100  # max messages folded per LLM call
+    CHAT_SUMMARY_MAX_WORDS: int = 250
+    CHAT_SUMMARY_MAX_TOKENS: int = 600
+
+    # Background chat turns (POST .../messages/?async=true): DB-backed job queue
+    CHAT_JOB_WORKERS: int = 4  # concurrent turns per process; 0 = don't process jobs here
+    CHAT_JOB_POLL_INTERVAL: float = 2.0  # seconds; jobs enqueued by other processes
+    CHAT_JOB_LEASE_SECONDS: float = 600.0  # running longer than this = worker died, requeue (or fail on the last attempt)
+    CHAT_JOB_MAX_ATTEMPTS: int = 3
+    CHAT_JOB_RETRY_BACKOFF: float = 10.0  # seconds, doubled per attempt
+    CHAT_JOB_PUSH: bool = True  # push the reply if the user is no longer in the chat
+
+    # Realtime delivery of new chat messages (WebSocket / SSE at /api/events/)
+    MESSAGE_HUB_BACKEND: str = "memory"  # memory (one process) or postgres (LISTEN/NOTIFY across processes)
+    MESSAGE_HUB_CHANNEL: str = "chat_messages"  # postgres NOTIFY channel
+    MESSAGE_HUB_HEARTBEAT: float = 25.0  # seconds between keep-alive frames on idle connections
+    MESSAGE_HUB_QUEUE_SIZE: int = 100  # buffered events per connection; the oldest are dropped
+    CHAT_LONG_POLL_MAX_WAIT: float = 30.0  # seconds, upper bound of new-messages ?wait=
+
+    # Agreement reminders / checklists: planned per agreement, sent at their exact time
+    AGREEMENT_SCHEDULER_ENABLED: bool = True  # false = this process doesn't send them
+    AGREEMENT_SCHEDULER_LOOKAHEAD: float = 3600.0  # seconds of upcoming reminders held in memory
+    AGREEMENT_SCHEDULER_RESCAN: float = 300.0  # seconds; picks up reminders planned by other processes
+
+    # Singleton background loops (proactive_check_loop) run in the process holding their lease row
+    SERVICE_LEASE_TTL: float = 60.0  # seconds; renewed every TTL/3, taken over this long after the holder dies
+
+    # Chat presence (heartbeats) and the proactive throttle: chat_presence table behind an in-process cache
+    PRESENCE_FLUSH_INTERVAL: float = 5.0  # seconds between writes of changed entries
+    PRESENCE_CACHE_SECONDS: float = 10.0  # a cached entry is re-read from the table after this
+    PRESENCE_TTL: float = 86400.0  # seconds; idle rows are evicted (keep above the throttle intervals)
+    PROACTIVE_PUSH_CONCURRENCY: int = 20  # FCM requests in flight while a proactive batch fans out its pushes
+
     class Config:
         case_sensitive = True
         env_file = ".env"
@@ -6,5 +6,8 @@ from . import crud_chat as chat
 from . import crud_report as report
 from . import crud_agreement as agreement
 from . import crud_device_token as device_token
+from . import crud_chat_job as chat_job
+from . import crud_service_lease as service_lease
+from . import crud_chat_presence as chat_presence
 
-__all__ = ["user", "goal", "milestone", "task", "chat", "report", "agreement", "device_token"]
+__all__ = ["user", "goal", "milestone", "task", "chat", "report", "agreement", "device_token", "chat_job", "service_lease", "chat_presence"]
@@ -1,8 +1,8 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
-from datetime import datetime, timedelta
-from typing import List, Optional
-from app.models.agreement import Agreement, AgreementStatus
+from sqlalchemy import and_, exists
+from datetime import datetime
+from typing import List, Optional, Tuple
+from app.models.agreement import Agreement, AgreementReminder, AgreementStatus
 from app.schemas import agreement as schemas
 
 def create_agreement(db: Session, agreement: schemas.AgreementCreate) -> Agreement:
@@ -14,8 +14,10 @@ def create_agreement(db: Session, agreement: schemas.AgreementCreate) -> Agreeme
         status=AgreementStatus.PENDING
     )
     db.add(db_agreement)
+    plan_reminders(db, db_agreement)
     db.commit()
     db.refresh(db_agreement)
+    _notify_scheduler()
     return db_agreement
 
 def get_agreement(db: Session, agreement_id: int) -> Optional[Agreement]:
@@ -32,30 +34,6 @@ def get_pending_agreements(db: Session, goal_id: int) -> List[Agreement]:
         )
     ).all()
 
-def get_due_agreements(db: Session) -> List[Agreement]:
-    """Get agreements that are due (deadline passed) and still pending"""
-    now = datetime.utcnow()
-    return db.query(Agreement).filter(
-        and_(
-            Agreement.status == AgreementStatus.PENDING,
-            Agreement.deadline <= now,
-            Agreement.checklist_sent == False
-        )
-    ).all()
-
-def get_upcoming_agreements(db: Session, hours_ahead: int = 24) -> List[Agreement]:
-    """Get agreements with deadline coming up in the next N hours"""
-    now = datetime.utcnow()
-    future = now + timedelta(hours=hours_ahead)
-    return db.query(Agreement).filter(
-        and_(
-            Agreement.status == AgreementStatus.PENDING,
-            Agreement.deadline > now,
-            Agreement.deadline <= future,
-            Agreement.reminder_sent == False
-        )
-    ).all()
-
 def update_agreement(db: Session, agreement_id: int, update: schemas.AgreementUpdate) -> Optional[Agreement]:
     db_agreement = get_agreement(db, agreement_id)
     if db_agreement:
@@ -64,8 +42,12 @@ def update_agreement(db: Session, agreement_id: int, update: schemas.AgreementUp
             update_data["completed_at"] = datetime.utcnow()
         for key, value in update_data.items():
             setattr(db_agreement, key, value)
+        if "deadline" in update_data:
+            plan_reminders(db, db_agreement)
         db.commit()
         db.refresh(db_agreement)
+        if "deadline" in update_data:
+            _notify_scheduler()
     return db_agreement
 
 def mark_reminder_sent(db: Session, agreement_id: int) -> Optional[Agreement]:
@@ -80,3 +62,65 @@ def complete_agreement(db: Session, agreement_id: int) -> Optional[Agreement]:
 def miss_agreement(db: Session, agreement_id: int) -> Optional[Agreement]:
     return update_agreement(db, agreement_id, schemas.AgreementUpdate(status=AgreementStatus.MISSED))
 
+
+def plan_reminders(db: Session, agreement: Agreement):
+    """(Re)plan the agreement's reminders from its deadline; the caller commits, then wakes the scheduler."""
+    from app.services.deadline_scheduler import reminder_plan
+
+    plan = reminder_plan(agreement.deadline, reminder_sent=bool(agreement.reminder_sent),
+                         checklist_sent=bool(agreement.checklist_sent))
+    if agreement.id is None:
+        agreement.reminders = [AgreementReminder(kind=kind, fire_at=fire_at) for kind, fire_at in plan]
+        return
+    db.query(AgreementReminder).filter(AgreementReminder.agreement_id == agreement.id).delete(
+        synchronize_session=False
+    )
+    db.expire(agreement, ["reminders"])
+    db.add_all([AgreementReminder(agreement_id=agreement.id, kind=kind, fire_at=fire_at) for kind, fire_at in plan])
+
+def plan_unscheduled_agreements(db: Session, limit: int = 500) -> int:
+    """Plan reminders of pending agreements that have none (created before the scheduler existed)."""
+    planned = exists().where(AgreementReminder.agreement_id == Agreement.id)
+    agreements = db.query(Agreement).filter(
+        Agreement.status == AgreementStatus.PENDING, ~planned
+    ).order_by(Agreement.id.asc()).limit(limit).all()
+    for agreement in agreements:
+        plan_reminders(db, agreement)
+    db.commit()
+    return len(agreements)
+
+def get_upcoming_reminders(db: Session, until: datetime, limit: int = 1000) -> List[Tuple[int, datetime]]:
+    """(id, fire_at) of unsent reminders due by `until`, earliest first."""
+    return [tuple(row) for row in db.query(AgreementReminder.id, AgreementReminder.fire_at).filter(
+        AgreementReminder.sent_at.is_(None), AgreementReminder.fire_at <= until
+    ).order_by(AgreementReminder.fire_at.asc()).limit(limit).all()]
+
+def get_reminder(db: Session, reminder_id: int) -> Optional[AgreementReminder]:
+    return db.query(AgreementReminder).filter(AgreementReminder.id == reminder_id).first()
+
+def claim_reminder(db: Session, reminder_id: int) -> Optional[AgreementReminder]:
+    """Take a due reminder for sending (conditional UPDATE: one process wins), or None.
+
+    None also when the reminder was replanned (deleted) or is not due yet.
+    """
+    now = datetime.utcnow()
+    claimed = db.query(AgreementReminder).filter(
+        AgreementReminder.id == reminder_id,
+        AgreementReminder.sent_at.is_(None),
+        AgreementReminder.fire_at <= now,
+    ).update({AgreementReminder.sent_at: now}, synchronize_session=False)
+    db.commit()
+    if not claimed:
+        return None
+    return get_reminder(db, reminder_id)
+
+def defer_reminder(db: Session, reminder_id: int, fire_at: datetime):
+    """Put a claimed reminder back to be sent at fire_at."""
+    db.query(AgreementReminder).filter(AgreementReminder.id == reminder_id).update(
+        {AgreementReminder.sent_at: None, AgreementReminder.fire_at: fire_at}, synchronize_session=False
+    )
+    db.commit()
+
+def _notify_scheduler():
+    from app.services.deadline_scheduler import deadline_scheduler
+    deadline_scheduler.notify()
@@ -1,5 +1,6 @@
+from typing import Any, Dict, Optional
 from sqlalchemy.orm import Session
-from app.models.chat import Chat, Message
+from app.models.chat import Chat, Message, ChatSummary
 from app.schemas.chat import ChatCreate, ChatUpdate
 from app.schemas.message import MessageCreate
 
@@ -33,12 +34,96 @@ def delete_chat(db: Session, chat_id: int):
         db.commit()
     return db_chat
 
-def create_message(db: Session, message: MessageCreate):
-    db_message = Message(**message.dict())
+def create_message(db: Session, message: MessageCreate, payload: Optional[Dict[str, Any]] = None):
+    """Save a message; payload: its checklist / suggestions / pending actions (server-side writers only)."""
+    from app.services.message_hub import message_hub
+
+    db_message = Message(**message.dict(), payload=payload)
     db.add(db_message)
     db.commit()
     db.refresh(db_message)
+    message_hub.publish_message(db, db_message)
     return db_message
 
+def get_message(db: Session, message_id: int):
+    return db.query(Message).filter(Message.id == message_id).first()
+
 def get_messages(db: Session, chat_id: int, skip: int = 0, limit: int = 100):
-    return db.query(Message).filter(Message.chat_id == chat_id).order_by(Message.id.asc()).offset(skip).limit(limit).all()
\ No newline at end of file
+    return db.query(Message).filter(Message.chat_id == chat_id).order_by(Message.id.asc()).offset(skip).limit(limit).all()
+
+def get_recent_messages(db: Session, chat_id: int, limit: int = 20, before_id: int = None, after_id: int = None):
+    """Newest-first page of a chat (keyset on Message.id, served by ix_messages_chat_id_id).
+
+    before_id / after_id are exclusive bounds, e.g. the id of a message that is
+    already part of the prompt, or the last message covered by a summary.
+    """
+    query = db.query(Message).filter(Message.chat_id == chat_id)
+    if before_id is not None:
+        query = query.filter(Message.id < before_id)
+    if after_id is not None:
+        query = query.filter(Message.id > after_id)
+    return query.order_by(Message.id.desc()).limit(limit).all()
+
+def count_messages(db: Session, chat_id: int, after_id: int = None):
+    query = db.query(Message).filter(Message.chat_id == chat_id)
+    if after_id is not None:
+        query = query.filter(Message.id > after_id)
+    return query.count()
+
+def get_messages_after(db: Session, chat_id: int, after_id: int = None, limit: int = 100):
+    """Oldest-first page of messages with id > after_id (keyset, for incremental summaries)."""
+    query = db.query(Message).filter(Message.chat_id == chat_id)
+    if after_id is not None:
+        query = query.filter(Message.id > after_id)
+    return query.order_by(Message.id.asc()).limit(limit).all()
+
+def get_user_messages_after(db: Session, user_id: int, after_id: int, chat_id: int = None, limit: int = 200):
+    """Oldest-first messages of all the user's chats (or one chat) with id > after_id — catch-up on reconnect."""
+    from app.models.goal import Goal
+
+    query = (
+        db.query(Message)
+        .join(Chat, Chat.id == Message.chat_id)
+        .join(Goal, Goal.id == Chat.goal_id)
+        .filter(Goal.user_id == user_id, Message.id > after_id)
+    )
+    if chat_id is not None:
+        query = query.filter(Message.chat_id == chat_id)
+    return query.order_by(Message.id.asc()).limit(limit).all()
+
+def backfill_derived_fields(db: Session, limit: int = 500) -> int:
+    """Fill Message.llm_content / payload for up to `limit` rows written before those columns existed."""
+    from app.services.chat_history import split_message_content
+
+    rows = (
+        db.query(Message.id, Message.content)
+        .filter(Message.llm_content.is_(None))
+        .order_by(Message.id.asc())
+        .limit(limit)
+        .all()
+    )
+    if rows:
+        values = []
+        for message_id, content in rows:
+            text, payload = split_message_content(content)
+            values.append({"id": message_id, "llm_content": text, "payload": payload})
+        db.bulk_update_mappings(Message, values)  # executemany by primary key (SQLAlchemy 1.4 and 2.x)
+        db.commit()
+    return len(rows)
+
+def get_summary(db: Session, chat_id: int):
+    return db.query(ChatSummary).filter(ChatSummary.chat_id == chat_id).first()
+
+def upsert_summary(db: Session, chat_id: int, summary: str, last_message_id: int,
+                   message_count: int, source_tokens: int):
+    db_summary = get_summary(db, chat_id)
+    if db_summary is None:
+        db_summary = ChatSummary(chat_id=chat_id)
+        db.add(db_summary)
+    db_summary.summary = summary
+    db_summary.last_message_id = last_message_id
+    db_summary.message_count = message_count
+    db_summary.source_tokens = source_tokens
+    db.commit()
+    db.refresh(db_summary)
+    return db_summary
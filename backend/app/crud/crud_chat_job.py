@@ -0,0 +1,162 @@
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+from sqlalchemy import and_, exists
+from sqlalchemy.orm import Session, aliased
+from app.models.chat_job import ChatJob, ChatJobStatus
+from app.models.chat import Message
+
+def enqueue_job(db: Session, chat_id: int, user_message_id: int, payload: Optional[Dict[str, Any]] = None,
+                kind: str = "coach_turn", commit: bool = True) -> ChatJob:
+    db_job = ChatJob(
+        chat_id=chat_id,
+        user_message_id=user_message_id,
+        kind=kind,
+        payload=json.dumps(payload or {}, ensure_ascii=False),
+        status=ChatJobStatus.QUEUED,
+        attempts=0,
+        run_after=datetime.utcnow(),
+    )
+    db.add(db_job)
+    if commit:
+        db.commit()
+        db.refresh(db_job)
+    else:
+        db.flush()
+    return db_job
+
+def get_job(db: Session, job_id: int) -> Optional[ChatJob]:
+    return db.query(ChatJob).filter(ChatJob.id == job_id).first()
+
+def claim_next_job(db: Session, worker_id: str, scan: int = 10) -> Optional[ChatJob]:
+    """Atomically take the oldest runnable job, or return None.
+
+    A job is runnable when it is queued, its run_after has passed and no other job
+    of the same chat is running (turns of one chat are answered in order). The
+    claim itself is a conditional UPDATE (status still 'queued'), so concurrent
+    workers — in this or other processes — never take the same job.
+    """
+    now = datetime.utcnow()
+    other = aliased(ChatJob)
+    busy_chat = exists().where(and_(other.chat_id == ChatJob.chat_id, other.status == ChatJobStatus.RUNNING))
+    earlier_in_chat = exists().where(and_(
+        other.chat_id == ChatJob.chat_id, other.status == ChatJobStatus.QUEUED, other.id < ChatJob.id
+    ))
+    candidates = (
+        db.query(ChatJob.id)
+        .filter(ChatJob.status == ChatJobStatus.QUEUED, ChatJob.run_after <= now, ~busy_chat, ~earlier_in_chat)
+        .order_by(ChatJob.id.asc())
+        .limit(scan)
+        .all()
+    )
+    for (job_id,) in candidates:
+        claimed = db.query(ChatJob).filter(
+            ChatJob.id == job_id, ChatJob.status == ChatJobStatus.QUEUED
+        ).update(
+            {
+                ChatJob.status: ChatJobStatus.RUNNING,
+                ChatJob.locked_by: worker_id,
+                ChatJob.locked_at: now,
+                ChatJob.attempts: ChatJob.attempts + 1,
+            },
+            synchronize_session=False,
+        )
+        db.commit()
+        if claimed:
+            return get_job(db, job_id)
+    return None
+
+def _held_claim(job: ChatJob):
+    """Filter matching the job only while the claim `job` was loaded from still holds.
+
+    A turn that outlives the lease is requeued and may be claimed again (by this
+    process too, so locked_by alone doesn't tell the claims apart); attempts, bumped
+    by every claim, does. The stale worker's writes then match nothing.
+    """
+    return and_(
+        ChatJob.id == job.id,
+        ChatJob.status == ChatJobStatus.RUNNING,
+        ChatJob.locked_by == job.locked_by,
+        ChatJob.attempts == job.attempts,
+    )
+
+def complete_job(db: Session, job: ChatJob, content: str,
+                 payload: Optional[Dict[str, Any]] = None) -> Optional[Message]:
+    """Save the coach reply and mark the job done in one transaction (a retried job never answers twice).
+
+    Returns None, saving nothing, when the claim was lost (the job was requeued
+    and claimed again meanwhile).
+    """
+    from app.services.message_hub import message_hub
+
+    ai_message = Message(chat_id=job.chat_id, sender="ai", content=content, payload=payload)
+    db.add(ai_message)
+    db.flush()
+    updated = db.query(ChatJob).filter(_held_claim(job)).update(
+        {
+            ChatJob.status: ChatJobStatus.DONE,
+            ChatJob.ai_message_id: ai_message.id,
+            ChatJob.error: None,
+            ChatJob.finished_at: datetime.utcnow(),
+        },
+        synchronize_session=False,
+    )
+    if not updated:
+        db.rollback()
+        return None
+    db.commit()
+    db.refresh(ai_message)
+    message_hub.publish_message(db, ai_message)
+    return ai_message
+
+def finish_job(db: Session, job: ChatJob) -> bool:
+    """Mark a job done without a reply (e.g. the chat has no goal). False if the claim was lost."""
+    updated = db.query(ChatJob).filter(_held_claim(job)).update(
+        {ChatJob.status: ChatJobStatus.DONE, ChatJob.finished_at: datetime.utcnow()},
+        synchronize_session=False,
+    )
+    db.commit()
+    return bool(updated)
+
+def fail_job(db: Session, job: ChatJob, error: str, retry_in: Optional[float] = None) -> bool:
+    """Put the job back in the queue after retry_in seconds, or mark it failed when retry_in is None.
+
+    False if the claim was lost: the job then belongs to whoever claimed it since.
+    """
+    values = {ChatJob.error: error[:2000], ChatJob.locked_by: None, ChatJob.locked_at: None}
+    if retry_in is None:
+        values.update({ChatJob.status: ChatJobStatus.FAILED, ChatJob.finished_at: datetime.utcnow()})
+    else:
+        values.update({
+            ChatJob.status: ChatJobStatus.QUEUED,
+            ChatJob.run_after: datetime.utcnow() + timedelta(seconds=retry_in),
+        })
+    updated = db.query(ChatJob).filter(_held_claim(job)).update(values, synchronize_session=False)
+    db.commit()
+    return bool(updated)
+
+def requeue_stale_jobs(db: Session, lease_seconds: float, max_attempts: int) -> Tuple[int, int]:
+    """Return jobs whose worker died mid-turn (running longer than the lease) to the queue.
+
+    Jobs that already used max_attempts are marked failed instead, so a turn that
+    keeps killing or outliving its worker stops blocking its chat.
+    Returns (requeued, failed).
+    """
+    now = datetime.utcnow()
+    stale = and_(ChatJob.status == ChatJobStatus.RUNNING, ChatJob.locked_at < now - timedelta(seconds=lease_seconds))
+    failed = db.query(ChatJob).filter(stale, ChatJob.attempts >= max_attempts).update(
+        {
+            ChatJob.status: ChatJobStatus.FAILED,
+            ChatJob.finished_at: now,
+            ChatJob.error: "lease expired on the last attempt",
+            ChatJob.locked_by: None,
+            ChatJob.locked_at: None,
+        },
+        synchronize_session=False,
+    )
+    requeued = db.query(ChatJob).filter(stale).update(
+        {ChatJob.status: ChatJobStatus.QUEUED, ChatJob.locked_by: None, ChatJob.locked_at: None},
+        synchronize_session=False,
+    )
+    db.commit()
+    return requeued, failed
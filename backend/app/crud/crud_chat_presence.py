@@ -0,0 +1,55 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy import case, or_
+from sqlalchemy.orm import Session
+from app.models.chat_presence import ChatPresence
+
+def _later(column, excluded):
+    """The later of the stored and the new timestamp (NULL counts as unknown)."""
+    return case(
+        (excluded.is_(None), column),
+        (column.is_(None), excluded),
+        (excluded > column, excluded),
+        else_=column,
+    )
+
+def upsert_presence(db: Session, rows: List[Dict[str, Any]]):
+    """Write presence rows (chat_id, last_active_at, last_proactive_at); timestamps never move back.
+
+    One INSERT .. ON CONFLICT for the batch (PostgreSQL and SQLite share the syntax),
+    so workers flushing the same chat don't race.
+    """
+    if not rows:
+        return
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    statement = insert(ChatPresence).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=[ChatPresence.chat_id],
+        set_={
+            "last_active_at": _later(ChatPresence.last_active_at, statement.excluded.last_active_at),
+            "last_proactive_at": _later(ChatPresence.last_proactive_at, statement.excluded.last_proactive_at),
+        },
+    )
+    db.execute(statement)
+    db.commit()
+
+def get_presence(db: Session, chat_id: int) -> Optional[ChatPresence]:
+    return db.query(ChatPresence).filter(ChatPresence.chat_id == chat_id).first()
+
+def get_recent_presence(db: Session, since: datetime) -> List[ChatPresence]:
+    """Rows with any activity or proactive message after `since`."""
+    return db.query(ChatPresence).filter(
+        or_(ChatPresence.last_active_at >= since, ChatPresence.last_proactive_at >= since)
+    ).all()
+
+def delete_idle_presence(db: Session, before: datetime) -> int:
+    """Evict rows with nothing after `before`."""
+    deleted = db.query(ChatPresence).filter(
+        or_(ChatPresence.last_active_at.is_(None), ChatPresence.last_active_at < before),
+        or_(ChatPresence.last_proactive_at.is_(None), ChatPresence.last_proactive_at < before),
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
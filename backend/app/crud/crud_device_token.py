@@ -1,5 +1,5 @@
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional
 from app.models.device_token import DeviceToken
 from app.schemas import device_token as schemas
 from datetime import datetime
@@ -42,6 +42,17 @@ def get_tokens_by_user(db: Session, user_id: int, active_only: bool = True) -> L
         query = query.filter(DeviceToken.is_active == True)
     return query.all()
 
+def get_tokens_by_users(db: Session, user_ids: Iterable[int]) -> Dict[int, List[DeviceToken]]:
+    """Active tokens of many users in one query, grouped by user id."""
+    user_ids = list(set(user_ids))
+    grouped: Dict[int, List[DeviceToken]] = {}
+    for start in range(0, len(user_ids), 500):
+        for token in db.query(DeviceToken).filter(
+            DeviceToken.user_id.in_(user_ids[start:start + 500]), DeviceToken.is_active == True
+        ).all():
+            grouped.setdefault(token.user_id, []).append(token)
+    return grouped
+
 def get_all_active_tokens(db: Session) -> List[DeviceToken]:
     return db.query(DeviceToken).filter(DeviceToken.is_active == True).all()
 
@@ -64,6 +75,25 @@ def deactivate_token(db: Session, token: str) -> Optional[DeviceToken]:
         db.refresh(db_token)
     return db_token
 
+def mark_tokens_used(db: Session, token_ids: Iterable[int]):
+    token_ids = list(token_ids)
+    if token_ids:
+        db.query(DeviceToken).filter(DeviceToken.id.in_(token_ids)).update(
+            {DeviceToken.last_used_at: datetime.utcnow()}, synchronize_session=False
+        )
+        db.commit()
+
+def deactivate_tokens(db: Session, tokens: Iterable[str]) -> int:
+    """Deactivate many tokens by token string in one statement"""
+    tokens = list(tokens)
+    if not tokens:
+        return 0
+    count = db.query(DeviceToken).filter(DeviceToken.token.in_(tokens)).update(
+        {DeviceToken.is_active: False}, synchronize_session=False
+    )
+    db.commit()
+    return count
+
 def delete_device_token(db: Session, token_id: int) -> bool:
     db_token = get_device_token(db, token_id)
     if db_token:
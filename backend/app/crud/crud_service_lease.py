@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.models.service_lease import ServiceLease
+
+def acquire_lease(db: Session, name: str, holder: str, ttl_seconds: float) -> bool:
+    """Take or renew the lease; False while another holder's lease has not expired.
+
+    A conditional UPDATE (ours, or expired) — concurrent processes can't both win;
+    the first process ever creates the row and a racing INSERT fails on the primary key.
+    """
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=ttl_seconds)
+    current = db.query(ServiceLease.holder).filter(ServiceLease.name == name).scalar()
+    if current == holder:
+        values = {ServiceLease.expires_at: expires_at}
+    else:
+        values = {ServiceLease.holder: holder, ServiceLease.expires_at: expires_at, ServiceLease.acquired_at: now}
+    updated = db.query(ServiceLease).filter(
+        ServiceLease.name == name,
+        or_(ServiceLease.holder == holder, ServiceLease.expires_at < now),
+    ).update(values, synchronize_session=False)
+    if updated:
+        db.commit()
+        return True
+    if current is not None:
+        db.rollback()
+        return False
+    db.add(ServiceLease(name=name, holder=holder, expires_at=expires_at, acquired_at=now))
+    try:
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback()
+        return False
+
+def release_lease(db: Session, name: str, holder: str):
+    """Let another process take the lease right away (on shutdown)."""
+    db.query(ServiceLease).filter(ServiceLease.name == name, ServiceLease.holder == holder).update(
+        {ServiceLease.expires_at: datetime.utcnow()}, synchronize_session=False
+    )
+    db.commit()
+
+def get_lease(db: Session, name: str):
+    return db.query(ServiceLease).filter(ServiceLease.name == name).first()
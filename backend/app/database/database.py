@@ -1,3 +1,4 @@
+from contextlib import contextmanager
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -38,18 +39,42 @@ def get_db():
         db.close()
 
 
+@contextmanager
+def session_scope():
+    """Short-lived session for one phase of a request: commit on success,
+    rollback on error, always close (the pooled connection goes back right away).
+
+    expire_on_commit=False keeps the loaded attributes of returned objects readable
+    after the block, so they can be used while no connection is held — e.g. across
+    an LLM await. Relationships that were not loaded are not available then.
+    """
+    db = SessionLocal(expire_on_commit=False)
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
 def ensure_additive_columns():
     """Lightweight, DB-agnostic safety net for additive columns when there is no
     migration tool. Adds missing nullable columns so deploys don't require manual SQL.
 
     Only ever ADDs nullable columns — never drops or alters existing data.
+    Returns the (table, column) pairs it added.
     """
     from sqlalchemy import inspect, text
 
     # (table, column, SQL type) — keep types simple/portable.
     required = [
         ("goals", "coach_trainer_id", "VARCHAR"),
+        ("messages", "llm_content", "TEXT"),
+        ("messages", "payload", "JSON"),
     ]
+    added = []
     try:
         inspector = inspect(engine)
         existing_tables = set(inspector.get_table_names())
@@ -61,6 +86,58 @@ def ensure_additive_columns():
                 if column in cols:
                     continue
                 conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {col_type}'))
+                added.append((table, column))
                 print(f"🧩 Added missing column {table}.{column}")
     except Exception as exc:  # never block startup on this best-effort helper
-        print(f"⚠️  ensure_additive_columns skipped: {exc}")
\ No newline at end of file
+        print(f"⚠️  ensure_additive_columns skipped: {exc}")
+    return added
+
+
+def ensure_additive_indexes():
+    """Create indexes added after a table already existed (create_all skips those).
+
+    CREATE INDEX IF NOT EXISTS works on both PostgreSQL and SQLite.
+    """
+    from sqlalchemy import inspect, text
+
+    # (index name, table, columns)
+    required = [
+        ("ix_messages_chat_id_id", "messages", "chat_id, id"),
+        ("ix_messages_chat_sender_created", "messages", "chat_id, sender, created_at"),
+        ("ix_chats_goal_id", "chats", "goal_id"),
+    ]
+    try:
+        existing_tables = set(inspect(engine).get_table_names())
+        with engine.begin() as conn:
+            for name, table, columns in required:
+                if table in existing_tables:
+                    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+    except Exception as exc:  # never block startup on this best-effort helper
+        print(f"⚠️  ensure_additive_indexes skipped: {exc}")
+
+
+def backfill_message_derived_fields(reparse_markers: bool = False, batch_size: int = 500):
+    """Compute Message.llm_content / payload for rows older than those columns (new rows get them on write).
+
+    reparse_markers: the payload column was just added — rows with markers are
+    queued again (llm_content reset to NULL), which also makes an interrupted
+    backfill resume on the next start.
+    """
+    from sqlalchemy import text
+    from app import crud
+
+    total = 0
+    try:
+        if reparse_markers:
+            with engine.begin() as conn:
+                conn.execute(text("UPDATE messages SET llm_content = NULL WHERE content LIKE '%<!--%'"))
+        while True:
+            with session_scope() as db:
+                done = crud.chat.backfill_derived_fields(db, limit=batch_size)
+            total += done
+            if done < batch_size:
+                break
+        if total:
+            print(f"🧩 Backfilled messages.llm_content/payload for {total} messages")
+    except Exception as exc:  # rows left NULL are picked up on the next start
+        print(f"⚠️  backfill_message_derived_fields stopped after {total} messages: {exc}")
@@ -42,12 +42,18 @@ async def startup_event():
     """Create database tables and initialize services on startup."""
     # 1) Database initialization
     try:
-        from app.database.database import engine, Base, ensure_additive_columns
-        from app.models import goal, milestone, task, user, chat, report, agreement, device_token
+        from app.database.database import (
+            engine, Base, ensure_additive_columns, ensure_additive_indexes, backfill_message_derived_fields
+        )
+        from app.models import (
+            goal, milestone, task, user, chat, report, agreement, device_token, chat_job, service_lease, chat_presence
+        )
         # Create all tables
         Base.metadata.create_all(bind=engine)
         # Add any new additive columns on already-existing tables (no migration tool here)
-        ensure_additive_columns()
+        added_columns = ensure_additive_columns()
+        ensure_additive_indexes()
+        backfill_message_derived_fields(reparse_markers=("messages", "payload") in added_columns)
         print("✅ Database tables created/verified successfully")
     except Exception as e:
         import traceback
@@ -75,13 +81,58 @@ async def startup_event():
         print(f"⚠️  Warning: Telegram runtime is not configured: {e}")
         print(traceback.format_exc())
 
+    # 4) Pooled HTTP client for LLM providers (keep-alive / HTTP/2)
+    try:
+        from app.services.llm_service import llm_service
+        await llm_service.startup()
+    except Exception as e:
+        import traceback
+        print(f"⚠️  Warning: Could not open LLM connection pool: {e}")
+        print(traceback.format_exc())
+
+    # 5) Realtime message hub (WebSocket / SSE delivery of new chat messages)
+    try:
+        from app.services.message_hub import message_hub
+        await message_hub.start()
+    except Exception as e:
+        import traceback
+        print(f"⚠️  Warning: Could not start message hub: {e}")
+        print(traceback.format_exc())
+
+    # 6) Background chat turn workers (DB-backed job queue)
+    try:
+        from app.services.chat_jobs import chat_job_worker
+        chat_job_worker.start()
+    except Exception as e:
+        import traceback
+        print(f"⚠️  Warning: Could not start chat job workers: {e}")
+        print(traceback.format_exc())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release long-lived resources on shutdown."""
+    from app.services.chat_jobs import chat_job_worker
+    from app.services.chat_summarizer import chat_summarizer
+    from app.services.deadline_scheduler import deadline_scheduler
+    from app.services.llm_service import llm_service
+    from app.services.message_hub import message_hub
+    from app.services.presence_store import presence_store
+    from app.services.proactive_service import proactive_lease
+    await chat_job_worker.stop()
+    await deadline_scheduler.stop()
+    await proactive_lease.stop()
+    await presence_store.stop()
+    await message_hub.stop()
+    await chat_summarizer.shutdown()
+    await llm_service.shutdown()
+
 @app.get("/")
 async def root():
     return {"message": "AI Goal Tracker API"}
 
 @app.get("/health")
-async def health_check(db: Session = Depends(get_db)):
-    """Health check endpoint to verify API and database status"""
+def health_check(db: Session = Depends(get_db)):
+    """Health check endpoint to verify API and database status (sync: runs in the threadpool)"""
     from sqlalchemy import text
     try:
         # Test database connection
@@ -100,8 +151,15 @@ async def health_check(db: Session = Depends(get_db)):
 @app.get("/test-llm")
 async def test_llm():
     """Test endpoint for LLM configuration"""
+    from app.services.chat_jobs import chat_job_worker
+    from app.services.chat_summarizer import chat_summarizer
+    from app.services.deadline_scheduler import deadline_scheduler
     from app.services.llm_service import llm_service
+    from app.services.message_hub import message_hub
+    from app.services.presence_store import presence_store
+    from app.services.proactive_service import proactive_lease
     from app.core.config import settings
+    from fastapi.concurrency import run_in_threadpool
     import os
     
     config_info = {
@@ -110,7 +168,20 @@ async def test_llm():
         "api_key_set": bool(settings.LLM_API_KEY),
         "api_key_length": len(settings.LLM_API_KEY) if settings.LLM_API_KEY else 0,
         "provider_from_service": llm_service.provider,
-        "model_from_service": llm_service.model
+        "model_from_service": llm_service.model,
+        "provider_chain": llm_service.provider_status(),
+        "llm_metrics": dict(llm_service.metrics),
+        "llm_admission": llm_service.admission.snapshot(),
+        "llm_cache": {
+            "backend": llm_service.cache.name if llm_service.cache is not None else None,
+            "entries": await run_in_threadpool(len, llm_service.cache) if llm_service.cache is not None else 0,
+        },
+        "chat_summaries": chat_summarizer.snapshot(),
+        "chat_jobs": chat_job_worker.snapshot(),
+        "message_hub": message_hub.snapshot(),
+        "deadline_scheduler": deadline_scheduler.snapshot(),
+        "proactive_lease": proactive_lease.snapshot(),
+        "chat_presence": presence_store.snapshot(),
     }
     
     # Test connection if DeepSeek
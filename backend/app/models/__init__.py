@@ -2,9 +2,12 @@ from .user import User
 from .goal import Goal
 from .milestone import Milestone
 from .task import Task
-from .chat import Chat, Message
+from .chat import Chat, Message, ChatSummary
 from .report import Report
-from .agreement import Agreement
+from .agreement import Agreement, AgreementReminder
 from .device_token import DeviceToken
+from .chat_job import ChatJob
+from .service_lease import ServiceLease
+from .chat_presence import ChatPresence
 
-__all__ = ["User", "Goal", "Milestone", "Task", "Chat", "Message", "Report", "Agreement", "DeviceToken"]
+__all__ = ["User", "Goal", "Milestone", "Task", "Chat", "Message", "ChatSummary", "Report", "Agreement", "AgreementReminder", "DeviceToken", "ChatJob", "ServiceLease", "ChatPresence"]
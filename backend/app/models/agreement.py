@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Enum
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Enum, Index, UniqueConstraint
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.database.database import Base
@@ -40,4 +40,32 @@ class Agreement(Base):
     
     # Relationships
     goal = relationship("Goal")
+    reminders = relationship("AgreementReminder", back_populates="agreement",
+                             cascade="all, delete-orphan", passive_deletes=True)
+
+
+class AgreementReminder(Base):
+    """Запланированное напоминание по договорённости (app/services/deadline_scheduler.py)"""
+    __tablename__ = "agreement_reminders"
+
+    id = Column(Integer, primary_key=True, index=True)
+    agreement_id = Column(Integer, ForeignKey("agreements.id", ondelete="CASCADE"), nullable=False)
+
+    # remind_24h / remind_12h / remind_6h / remind_2h / checklist / missed
+    kind = Column(String, nullable=False)
+
+    # Когда отправить (UTC)
+    fire_at = Column(DateTime(timezone=True), nullable=False)
+
+    # Когда процесс взял напоминание на отправку (NULL — ещё не отправлено)
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Relationships
+    agreement = relationship("Agreement", back_populates="reminders")
+
+    __table_args__ = (
+        UniqueConstraint("agreement_id", "kind", name="uq_agreement_reminders_kind"),
+        # Scheduler reload: WHERE sent_at IS NULL AND fire_at <= :until ORDER BY fire_at
+        Index("ix_agreement_reminders_due", "sent_at", "fire_at"),
+    )
 
@@ -1,13 +1,13 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index, JSON
 from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
 from app.database.database import Base
 
 class Chat(Base):
     __tablename__ = "chats"
 
     id = Column(Integer, primary_key=True, index=True)
-    goal_id = Column(Integer, ForeignKey("goals.id"), nullable=False)
+    goal_id = Column(Integer, ForeignKey("goals.id"), nullable=False, index=True)
     title = Column(String, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -15,6 +15,8 @@ class Chat(Base):
     # Relationships
     goal = relationship("Goal", back_populates="chats")
     messages = relationship("Message", back_populates="chat", cascade="all, delete-orphan")
+    summary = relationship("ChatSummary", back_populates="chat", uselist=False, cascade="all, delete-orphan")
+    jobs = relationship("ChatJob", back_populates="chat", cascade="all, delete-orphan")
 
 class Message(Base):
     __tablename__ = "messages"
@@ -22,8 +24,64 @@ class Message(Base):
     id = Column(Integer, primary_key=True, index=True)
     chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
     content = Column(Text, nullable=False)
+    # What the LLM sees of the message, and the data the frontend renders with it:
+    # {"pending_actions": [...], "checklist": {...}, "suggestions": [...]}, set by the
+    # writer. Older rows carry that data as <!--CHECKLIST:...--> style markers in
+    # content; the startup backfill moves it here (llm_content NULL until then).
+    llm_content = Column(Text, nullable=True)
+    payload = Column(JSON, nullable=True)
     sender = Column(String, nullable=False)  # user or ai
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
-    chat = relationship("Chat", back_populates="messages")
\ No newline at end of file
+    chat = relationship("Chat", back_populates="messages")
+
+    @validates("content")
+    def _set_llm_content(self, key, content):
+        self.llm_content = (content or "").strip()
+        return content
+
+    def _payload(self) -> dict:
+        return self.payload or {}
+
+    # Structured fields of the API (schemas.Message)
+    @property
+    def text(self) -> str:
+        from app.services.chat_history import llm_content
+        return llm_content(self)
+
+    @property
+    def pending_actions(self):
+        return self._payload().get("pending_actions")
+
+    @property
+    def checklist(self):
+        return self._payload().get("checklist")
+
+    @property
+    def suggestions(self):
+        return self._payload().get("suggestions")
+
+    __table_args__ = (
+        # Recent-history keyset scans: WHERE chat_id = ? [AND id < ?] ORDER BY id DESC
+        Index("ix_messages_chat_id_id", "chat_id", "id"),
+        # Last user / AI message time of a chat (proactive scans): MAX(created_at) WHERE chat_id = ? AND sender = ?
+        Index("ix_messages_chat_sender_created", "chat_id", "sender", "created_at"),
+    )
+
+
+class ChatSummary(Base):
+    """Rolling summary of a chat's older messages (ids <= last_message_id)."""
+    __tablename__ = "chat_summaries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False, unique=True)
+    summary = Column(Text, nullable=False)
+    last_message_id = Column(Integer, nullable=False)
+    message_count = Column(Integer, nullable=False, default=0)  # messages covered so far
+    source_tokens = Column(Integer, nullable=False, default=0)  # approx. tokens of those messages
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    # Relationships
+    chat = relationship("Chat", back_populates="summary")
@@ -0,0 +1,42 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index
+from sqlalchemy.sql import func
+from sqlalchemy.orm import relationship
+from app.database.database import Base
+import enum
+
+class ChatJobStatus(str, enum.Enum):
+    QUEUED = "queued"    # Ждёт свободного воркера
+    RUNNING = "running"  # Взят воркером (locked_at — начало аренды)
+    DONE = "done"        # Ответ коуча сохранён (ai_message_id)
+    FAILED = "failed"    # Попытки исчерпаны
+
+class ChatJob(Base):
+    """Задача фоновой обработки хода чата (ответ коуча на сообщение пользователя)"""
+    __tablename__ = "chat_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
+    user_message_id = Column(Integer, nullable=False)  # messages.id (no FK: jobs are deleted with the chat)
+    kind = Column(String, nullable=False, default="coach_turn")
+    payload = Column(Text, nullable=True)  # JSON: trainer_id, gender, debug_mode
+
+    status = Column(String, nullable=False, default=ChatJobStatus.QUEUED)
+    attempts = Column(Integer, nullable=False, default=0)
+    run_after = Column(DateTime(timezone=True), nullable=False)  # UTC; pushed forward on retry (backoff)
+    locked_by = Column(String, nullable=True)
+    locked_at = Column(DateTime(timezone=True), nullable=True)
+    error = Column(Text, nullable=True)
+    ai_message_id = Column(Integer, nullable=True)
+
+    # Timestamps
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Relationships
+    chat = relationship("Chat", back_populates="jobs")
+
+    __table_args__ = (
+        # Claim query: WHERE status = 'queued' AND run_after <= now ORDER BY id
+        Index("ix_chat_jobs_status_run_after", "status", "run_after"),
+    )
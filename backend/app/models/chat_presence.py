@@ -0,0 +1,10 @@
+from sqlalchemy import Column, Integer, DateTime
+from app.database.database import Base
+
+class ChatPresence(Base):
+    """Активность пользователя в чате и время последнего проактивного сообщения (app/services/presence_store.py)"""
+    __tablename__ = "chat_presence"
+
+    chat_id = Column(Integer, primary_key=True)  # chats.id (no FK: idle rows are evicted, deleted chats included)
+    last_active_at = Column(DateTime(timezone=True), nullable=True)  # UTC, последний heartbeat
+    last_proactive_at = Column(DateTime(timezone=True), nullable=True)  # UTC, для антиспама
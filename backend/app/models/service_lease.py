@@ -0,0 +1,14 @@
+from sqlalchemy import Column, String, DateTime
+from sqlalchemy.sql import func
+from app.database.database import Base
+
+class ServiceLease(Base):
+    """Аренда фоновой службы: её циклы выполняет только процесс-владелец (app/services/service_lease.py)"""
+    __tablename__ = "service_leases"
+
+    name = Column(String, primary_key=True)  # 'proactive', ...
+    holder = Column(String, nullable=False)  # host:pid
+    expires_at = Column(DateTime(timezone=True), nullable=False)  # UTC; после этого аренду может взять другой процесс
+
+    # Timestamps
+    acquired_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 
 class MessageBase(BaseModel):
@@ -21,7 +21,11 @@ class MessageInDBBase(MessageBase):
         from_attributes = True
 
 class Message(MessageInDBBase):
-    pass
+    # text as the LLM sees it and the parts of Message.payload (see models.chat.Message)
+    text: Optional[str] = None
+    pending_actions: Optional[List[Dict[str, Any]]] = None
+    checklist: Optional[Dict[str, Any]] = None
+    suggestions: Optional[List[Any]] = None
 
 class MessageInDB(MessageInDBBase):
     pass
\ No newline at end of file
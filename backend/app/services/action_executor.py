@@ -0,0 +1,482 @@
+"""
+Batched execution of coach actions (create_milestone, set_deadline, ...).
+
+Each action used to go through its own CRUD helper with commit + refresh (and a
+flush on top), and delete_milestone with count deleted row by row — a
+5-milestone plan cost ~15 round trips. The executor works in three passes:
+
+1. validate — every action is checked and normalised up front without touching
+   the DB (titles trimmed, dates parsed) by the action registry below; invalid
+   ones get their ❌ result and are skipped, the rest still run;
+2. prefetch — milestones referenced by id (and, when needed, all milestones of
+   the goal) are loaded with one query each;
+3. apply — in action order, on the session: new rows are added and flushed
+   together (one multi-row INSERT per table), completions and deletions are
+   collected into set-based UPDATE / DELETE statements, and the whole batch is
+   committed once. If that transaction fails nothing is applied.
+
+The result is one ActionResult per input action, in input order.
+
+Action types are declared once in the registry below (schema of `data` + the
+handler), and the schemas are compiled into one validator that validate_response
+in api/chats.py uses for LLM output as well.
+"""
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Literal, NamedTuple, Optional, Set, Tuple, Union
+
+from pydantic import AfterValidator, BeforeValidator, Field, PositiveInt, StringConstraints, TypeAdapter, ValidationError
+from pydantic_core import PydanticCustomError
+from sqlalchemy.orm import Session
+from typing_extensions import Annotated, NotRequired, TypedDict
+
+from app import crud
+from app.models.agreement import Agreement, AgreementStatus
+from app.models.goal import Goal
+from app.models.milestone import Milestone
+from app.models.task import Task
+
+DATETIME_FORMATS = ["%Y-%m-%d %H:%M", "%Y-%m-%d", "%d.%m.%Y %H:%M", "%d.%m.%Y"]
+
+
+class ActionResult(NamedTuple):
+    index: int
+    type: Optional[str]
+    ok: bool
+    message: str
+
+
+class ActionError(ValueError):
+    """An action that can't be executed; the text is shown to the user as is."""
+
+
+def parse_datetime(value: Any) -> Optional[datetime]:
+    """ISO 8601 first, then the formats the coach tends to use; None if unparseable."""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        pass
+    for fmt in DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+class _Batch:
+    """State shared by the handlers of one execute_batch call."""
+
+    def __init__(self, db: Session, goal_id: Optional[int], user_id: Optional[int]):
+        self.db = db
+        self.goal_id = goal_id
+        self.user_id = user_id
+        self.new_goal: Optional[Goal] = None
+        self.milestones: Dict[int, Milestone] = {}   # prefetched by id
+        self.goal_milestones: Optional[List[Milestone]] = None
+        self.to_complete: Set[int] = set()
+        self.to_delete: Set[int] = set()
+        self.after_flush: List[Callable[[], str]] = []  # log lines that need generated ids
+        self.reminders_planned = False  # wake the deadline scheduler after the commit
+
+    @property
+    def target_goal_id(self) -> Optional[int]:
+        # Milestones / tasks of a batch that created a goal go to the new goal
+        return self.new_goal.id if self.new_goal is not None else self.goal_id
+
+    def live_goal_milestones(self) -> List[Milestone]:
+        """Milestones of the goal as the batch sees them so far (created ones included, deleted ones not)."""
+        if self.goal_milestones is None:
+            self.goal_milestones = _load_goal_milestones(self.db, self.goal_id)
+        if any(obj.id is None for obj in self.db.new if isinstance(obj, Milestone)):
+            self.db.flush()
+        created = [obj for obj in self.db.identity_map.values()
+                   if isinstance(obj, Milestone) and obj.goal_id == self.goal_id]
+        merged = {m.id: m for m in self.goal_milestones + created}
+        return [m for m in merged.values() if m.id not in self.to_delete]
+
+
+def _load_goal_milestones(db: Session, goal_id: Optional[int]) -> List[Milestone]:
+    if not goal_id:
+        return []
+    return db.query(Milestone).filter(Milestone.goal_id == goal_id).order_by(Milestone.id.asc()).all()
+
+
+# --- action registry ----------------------------------------------------------
+#
+# Each action type is declared once: the schema of its `data` (a TypedDict) and
+# the handler that applies it to the batch. All schemas are compiled into one
+# discriminated-union validator (ACTIONS_ADAPTER) that validate_response uses for
+# LLM output and execute_batch for the actions it runs. TypedDict schemas are
+# validated by pydantic-core without building model instances; only the few
+# cross-field rules below run Python.
+
+class ActionSpec(NamedTuple):
+    data: type  # TypedDict: the schema of action["data"]
+    rule: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]]  # cross-field check of data
+    apply: Optional[Callable[["_Batch", Dict[str, Any]], str]]  # None: rendered only, nothing to execute
+
+
+ACTIONS: Dict[str, ActionSpec] = {}
+
+
+def action(action_type: str, data: type, rule: Callable[[Dict[str, Any]], Dict[str, Any]] = None):
+    """Register the handler of an action type together with the schema of its data."""
+    def register(apply):
+        ACTIONS[action_type] = ActionSpec(data, rule, apply)
+        return apply
+    return register
+
+
+def _rule(message: str):
+    return PydanticCustomError("action_rule", message)
+
+
+Text = Annotated[str, StringConstraints(min_length=1)]
+
+
+def _coach_date(value: Any) -> Any:
+    # "10.12.2025" and the other DATETIME_FORMATS too, not only ISO; unparseable strings fail as before
+    if value == "":
+        return None
+    if isinstance(value, str):
+        parsed = parse_datetime(value)
+        return parsed.date() if parsed is not None else value
+    return value
+
+
+CoachDate = Annotated[Optional[date], BeforeValidator(_coach_date)]
+
+
+class CreateGoalData(TypedDict):
+    title: Text
+    description: NotRequired[Optional[str]]
+
+
+@action("create_goal", CreateGoalData)
+def _apply_create_goal(batch: _Batch, data: Dict[str, Any]) -> str:
+    if not batch.user_id:
+        raise ActionError("❌ Не могу создать цель: не указан user_id")
+    description = data.get("description")
+    goal = Goal(title=data["title"][:200], description=description[:1000] if description else None,
+                user_id=batch.user_id)
+    batch.db.add(goal)
+    batch.db.flush()  # the id is part of the result text and the target of later actions
+    batch.new_goal = goal
+    print(f"✅ Created goal: {goal.id} - {goal.title}")
+    return f"✅ Создана новая цель: {goal.title} (ID: {goal.id})"
+
+
+class CreateMilestoneData(TypedDict):
+    title: Text
+    description: NotRequired[Optional[str]]
+    target_date: NotRequired[CoachDate]
+
+
+@action("create_milestone", CreateMilestoneData)
+def _apply_create_milestone(batch: _Batch, data: Dict[str, Any]) -> str:
+    goal_id = batch.target_goal_id
+    if not goal_id:
+        raise ActionError("❌ Не могу создать подцель: не найден goal_id")
+    milestone = Milestone(goal_id=goal_id, title=data["title"][:80], description=data.get("description", ""),
+                          target_date=data.get("target_date"))
+    batch.db.add(milestone)
+    batch.after_flush.append(lambda: f"✅ Created milestone: {milestone.id} - {milestone.title} for goal {goal_id}")
+    return f"✅ Создана подцель: {milestone.title}"
+
+
+class MilestoneRefData(TypedDict):
+    milestone_id: int
+
+
+@action("complete_milestone", MilestoneRefData)
+def _apply_complete_milestone(batch: _Batch, data: Dict[str, Any]) -> str:
+    milestone_id = data["milestone_id"]
+    if milestone_id not in batch.milestones or milestone_id in batch.to_delete:
+        raise ActionError(f"❌ Подцель #{milestone_id} не найдена")
+    batch.to_complete.add(milestone_id)
+    print(f"✅ Completed milestone: {milestone_id}")
+    return f"✅ Подцель #{milestone_id} выполнена"
+
+
+class DeleteMilestoneData(TypedDict):
+    milestone_id: NotRequired[Optional[int]]
+    count: NotRequired[Optional[PositiveInt]]
+
+
+def _milestone_or_count(data: Dict[str, Any]) -> Dict[str, Any]:
+    if not data.get("milestone_id") and not data.get("count"):
+        raise _rule("requires either 'data.milestone_id' or 'data.count'")
+    return data
+
+
+@action("delete_milestone", DeleteMilestoneData, _milestone_or_count)
+def _apply_delete_milestone(batch: _Batch, data: Dict[str, Any]) -> str:
+    milestone_id = data.get("milestone_id")
+    if milestone_id:
+        if milestone_id not in batch.milestones or milestone_id in batch.to_delete:
+            raise ActionError(f"❌ Подцель #{milestone_id} не найдена")
+        batch.to_delete.add(milestone_id)
+        print(f"🗑 Deleted milestone: {milestone_id}")
+        return f"🗑 Подцель #{milestone_id} удалена"
+
+    # Delete the last N milestones of the goal
+    last = sorted(batch.live_goal_milestones(), key=lambda m: m.id, reverse=True)[:data["count"]]
+    if not last:
+        raise ActionError("❌ Не найдено подцелей для удаления")
+    batch.to_delete.update(m.id for m in last)
+    print(f"🗑 Deleted last {len(last)} milestones")
+    return f"🗑 Удалено последних {len(last)} подцелей"
+
+
+class UpdateGoalData(TypedDict):
+    title: NotRequired[Text]
+    description: NotRequired[Optional[str]]
+
+
+def _something_to_update(data: Dict[str, Any]) -> Dict[str, Any]:
+    if "title" not in data and "description" not in data:
+        raise _rule("requires 'data.title' or 'data.description'")
+    return data
+
+
+@action("update_goal", UpdateGoalData, _something_to_update)
+def _apply_update_goal(batch: _Batch, data: Dict[str, Any]) -> str:
+    goal = batch.db.get(Goal, batch.goal_id) if batch.goal_id else None
+    if goal is None:
+        raise ActionError("❌ Цель не найдена")
+    for key, value in data.items():
+        setattr(goal, key, value)
+    print(f"✅ Updated goal: {batch.goal_id}")
+    return "✅ Цель обновлена"
+
+
+class CreateAgreementData(TypedDict):
+    description: Text
+    deadline: Text
+
+
+@action("create_agreement", CreateAgreementData)
+def _apply_create_agreement(batch: _Batch, data: Dict[str, Any]) -> str:
+    description, deadline = data["description"], parse_datetime(data["deadline"])
+    if deadline is None:
+        raise ActionError(f"❌ Не удалось распознать дату: {data['deadline']}")
+    agreement = Agreement(goal_id=batch.goal_id, description=description, deadline=deadline,
+                          status=AgreementStatus.PENDING)
+    crud.agreement.plan_reminders(batch.db, agreement)
+    batch.db.add(agreement)
+    batch.reminders_planned = True
+    batch.after_flush.append(lambda: f"📝 Created agreement: {agreement.id} - {description[:30]}...")
+    return f"📝 Договорённость зафиксирована: {description[:50]}... (до {deadline.strftime('%d.%m.%Y %H:%M')})"
+
+
+class SetDeadlineData(TypedDict):
+    milestone_id: NotRequired[Optional[int]]
+    milestone_title: NotRequired[Optional[str]]
+    deadline: Text
+
+
+def _milestone_ref(data: Dict[str, Any]) -> Dict[str, Any]:
+    if not data.get("milestone_id") and not data.get("milestone_title"):
+        raise _rule("requires either 'data.milestone_id' or 'data.milestone_title'")
+    return data
+
+
+@action("set_deadline", SetDeadlineData, _milestone_ref)
+def _apply_set_deadline(batch: _Batch, data: Dict[str, Any]) -> str:
+    parsed = parse_datetime(data["deadline"])
+    if parsed is None:
+        raise ActionError(f"❌ Не удалось распознать дату дедлайна: {data['deadline']}")
+    deadline = parsed.date()
+    milestone_id, milestone_title = data.get("milestone_id"), data.get("milestone_title")
+    if milestone_id:
+        target = batch.milestones.get(milestone_id)
+    else:
+        # Search by title in current goal's milestones
+        needle = milestone_title.lower()
+        target = next((m for m in batch.live_goal_milestones() if needle in m.title.lower()), None)
+    if target is None or target.id in batch.to_delete:
+        raise ActionError(f"❌ Подцель не найдена: {milestone_id or milestone_title}")
+    target.target_date = deadline
+    print(f"📅 Set deadline for milestone {target.id}: {deadline}")
+    return f"📅 Дедлайн установлен: «{target.title}» — до {deadline.strftime('%d.%m.%Y')}"
+
+
+class CreateTaskData(TypedDict):
+    title: Text
+    description: NotRequired[Optional[str]]
+    milestone_id: NotRequired[Optional[int]]
+    due_date: NotRequired[Optional[str]]
+    deadline: NotRequired[Optional[str]]  # the coach's other name for due_date
+    priority: NotRequired[Optional[str]]
+
+
+@action("create_task", CreateTaskData)
+def _apply_create_task(batch: _Batch, data: Dict[str, Any]) -> str:
+    goal_id = batch.target_goal_id
+    if not goal_id:
+        raise ActionError("❌ Не могу создать задачу: не найден goal_id")
+    task = Task(goal_id=goal_id, title=data["title"][:200], description=data.get("description", ""),
+                milestone_id=data.get("milestone_id"),
+                due_date=parse_datetime(data.get("due_date") or data.get("deadline")),
+                priority=data.get("priority") or "medium", is_completed=False)
+    batch.db.add(task)
+    batch.after_flush.append(
+        lambda: f"✅ Created task: ID={task.id}, title={task.title}, goal_id={task.goal_id}, due_date={task.due_date}"
+    )
+    return f"✅ Создана задача: {task.title}"
+
+
+class ChecklistItem(TypedDict):
+    id: Union[int, str]
+    label: str
+    type: Literal["boolean", "number", "text"]
+
+
+class ChecklistData(TypedDict):
+    title: Text
+    items: Annotated[List[ChecklistItem], Field(min_length=1)]
+
+
+class SuggestionsData(TypedDict):
+    items: NotRequired[List[Any]]
+
+
+# Shown with the message by the chat (Message.payload checklist / suggestions)
+action("checklist", ChecklistData)(None)
+action("suggestions", SuggestionsData)(None)
+
+
+def _compile_actions() -> TypeAdapter:
+    variants = []
+    for action_type, spec in ACTIONS.items():
+        data = spec.data
+        if spec.rule is not None:
+            data = Annotated[data, AfterValidator(spec.rule)]
+        if not spec.data.__required_keys__:
+            data = NotRequired[data]  # {"type": "suggestions"} without data is fine
+        variants.append(TypedDict(f"{action_type}_action", {"type": Literal[action_type], "data": data}))
+    return Annotated[Union[tuple(variants)], Field(discriminator="type")]
+
+
+ACTION_TYPES = list(ACTIONS)
+_AnyAction = _compile_actions()
+ACTION_ADAPTER = TypeAdapter(_AnyAction)
+ACTIONS_ADAPTER = TypeAdapter(List[_AnyAction])
+
+
+def describe_validation_error(error: ValidationError, index: Optional[int] = None) -> str:
+    """First error of an action (or action list) validation, in the wording validate_response always used."""
+    detail = error.errors(include_url=False)[0]
+    loc = list(detail["loc"])
+    if index is None and loc and isinstance(loc[0], int):
+        index = loc.pop(0)
+    prefix = f"actions[{index}]" if index is not None else "action"
+    kind = detail["type"]
+    if kind == "union_tag_not_found":
+        return f"{prefix} missing required field 'type'"
+    if kind == "union_tag_invalid":
+        return f"{prefix}.type '{detail['ctx']['tag']}' is invalid. Valid types: {ACTION_TYPES}"
+    if not loc:
+        return f"{prefix} must be object, got {type(detail['input']).__name__}"
+    action_type, path = loc[0], ".".join(str(part) for part in loc[1:])
+    if kind == "action_rule":
+        return f"{prefix} ({action_type}) {detail['msg']}"
+    if kind == "missing":
+        return f"{prefix} ({action_type}) requires '{path}'"
+    return f"{prefix} ({action_type}) invalid '{path}': {detail['msg']}"
+
+
+# The compiled validators themselves: TypeAdapter.validate_python adds ~1 µs of Python per call
+_validate_action = ACTION_ADAPTER.validator.validate_python
+_validate_action_list = ACTIONS_ADAPTER.validator.validate_python
+
+
+def validate_actions(actions: List[Any]) -> Optional[str]:
+    """None if every action matches its schema, else a description of the first invalid one."""
+    try:
+        _validate_action_list(actions)
+    except ValidationError as e:
+        return describe_validation_error(e)
+    return None
+
+
+def execute_batch(db: Session, goal_id: Optional[int], actions: List[Dict], user_id: int = None) -> List[ActionResult]:
+    """Validate all actions, apply the valid ones in one transaction and commit once.
+
+    Display-only actions (checklist, suggestions) are valid but get an empty result message.
+    """
+    results: List[Optional[ActionResult]] = [None] * len(actions)
+    planned: List[Tuple[int, str, Dict[str, Any]]] = []
+
+    # 1) validate
+    for index, action in enumerate(actions):
+        action_type = action.get("type") if isinstance(action, dict) else None
+        try:
+            data = _validate_action(action).get("data", {})
+        except ValidationError as e:
+            if action_type not in ACTIONS:
+                message = f"❌ Неизвестное действие: {action_type}"
+            else:
+                message = f"❌ Некорректное действие: {describe_validation_error(e, index)}"
+            results[index] = ActionResult(index, action_type, False, message)
+            continue
+        if ACTIONS[action_type].apply is None:
+            results[index] = ActionResult(index, action_type, True, "")
+            continue
+        planned.append((index, action_type, data))
+    if not planned:
+        return list(results)
+
+    batch = _Batch(db, goal_id, user_id)
+
+    # 2) prefetch milestones referenced by id
+    ids = {data["milestone_id"] for _, _, data in planned if data.get("milestone_id")}
+    if ids:
+        batch.milestones = {m.id: m for m in db.query(Milestone).filter(Milestone.id.in_(ids)).all()}
+
+    # 3) apply, flush once, run the set-based statements, commit once
+    try:
+        for index, action_type, data in planned:
+            try:
+                results[index] = ActionResult(index, action_type, True, ACTIONS[action_type].apply(batch, data))
+            except ActionError as e:
+                results[index] = ActionResult(index, action_type, False, str(e))
+        db.flush()
+        # Read generated ids now: commit expires the objects and reading them later would reload each row
+        created_log = [line() for line in batch.after_flush]
+        completed = batch.to_complete - batch.to_delete
+        if completed:
+            db.query(Milestone).filter(Milestone.id.in_(completed)).update(
+                {Milestone.is_completed: True}, synchronize_session=False
+            )
+        if batch.to_delete:
+            # Bulk DELETE bypasses the ORM cascade: remove the milestones' tasks explicitly
+            db.query(Task).filter(Task.milestone_id.in_(batch.to_delete)).delete(synchronize_session=False)
+            db.query(Milestone).filter(Milestone.id.in_(batch.to_delete)).delete(synchronize_session=False)
+            for milestone_id in batch.to_delete:
+                obj = db.identity_map.get(db.identity_key(Milestone, milestone_id))
+                if obj is not None:
+                    db.expunge(obj)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Action batch rolled back: {e}")
+        # Nothing was applied: the applied actions fail, and so do the one that raised and the ones after it
+        for index, action_type, _ in planned:
+            result = results[index]
+            if result is None or result.ok:
+                results[index] = ActionResult(index, action_type, False, f"❌ Ошибка выполнения {action_type}: {e}")
+        return list(results)
+
+    for line in created_log:
+        print(line)
+    if batch.reminders_planned:
+        from app.services.deadline_scheduler import deadline_scheduler
+        deadline_scheduler.notify()
+    return list(results)
@@ -0,0 +1,127 @@
+"""
+Conversation history window for coach prompts.
+
+Takes the most recent messages of a chat (descending keyset query), reads their
+LLM-visible text (Message.llm_content), and keeps as many turns as fit in a token budget,
+newest first. The chat's rolling summary, once there is one, stands in for
+the older turns.
+Token counts use a local approximation, no tokenizer download needed.
+"""
+import json
+import math
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.core.config import settings
+
+# Per-message overhead of the chat format (role, separators), as in OpenAI's counting guide.
+MESSAGE_TOKEN_OVERHEAD = 4
+
+SUMMARY_PREFIX = "Краткое содержание предыдущей части разговора:\n"
+
+_TOKEN_PIECES = re.compile(r"\w+|[^\w\s]")
+
+# <!--PENDING_ACTIONS:[...]-->, <!--CHECKLIST:{...}-->, <!--SUGGESTIONS:[...]--> in the content of
+# messages written before Message.payload (only the startup backfill reads them)
+_FRONTEND_MARKERS = re.compile(r"<!--(PENDING_ACTIONS|CHECKLIST|SUGGESTIONS):(.*?)-->", re.DOTALL)
+
+
+def count_tokens(text: str) -> int:
+    """Approximate BPE token count.
+
+    Punctuation is ~1 token; words are ~4 characters per token in Latin script
+    and ~3 in Cyrillic and other scripts, which BPE vocabularies split finer.
+    """
+    tokens = 0
+    for piece in _TOKEN_PIECES.findall(text or ""):
+        if piece.isascii():
+            tokens += math.ceil(len(piece) / 4)
+        else:
+            tokens += math.ceil(len(piece) / 3)
+    return tokens
+
+
+def count_message_tokens(message: Dict[str, str]) -> int:
+    return count_tokens(message.get("content", "")) + MESSAGE_TOKEN_OVERHEAD
+
+
+def split_message_content(content: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """(content without markers, {"pending_actions": ..., "checklist": ..., "suggestions": ...} or None)
+    of a legacy message.
+
+    One pass over the content; the first marker of each kind wins, as in the frontend.
+    Markers with broken JSON are dropped from the text all the same.
+    """
+    if not content:
+        return "", None
+    if "<!--" not in content:
+        return content.strip(), None
+    payload: Dict[str, Any] = {}
+    for match in _FRONTEND_MARKERS.finditer(content):
+        try:
+            payload.setdefault(match.group(1).lower(), json.loads(match.group(2)))
+        except ValueError:
+            continue
+    return _FRONTEND_MARKERS.sub("", content).strip(), payload or None
+
+
+def llm_content(message) -> str:
+    """LLM-visible text of a Message (content itself on a legacy row the backfill hasn't reached)."""
+    if message.llm_content is not None:
+        return message.llm_content
+    return (message.content or "").strip()
+
+
+def build_history_window(
+    db: Session,
+    chat_id: int,
+    before_id: Optional[int] = None,
+    token_budget: Optional[int] = None,
+    max_messages: Optional[int] = None,
+    use_summary: bool = True,
+) -> List[Dict[str, str]]:
+    """Chronological LLM messages for the latest turns of a chat, within token_budget.
+
+    before_id excludes the message being answered (it is appended by the caller).
+    With use_summary, the chat's rolling summary (chat_summarizer) replaces the
+    messages it covers and its tokens count against the budget.
+    """
+    token_budget = token_budget if token_budget is not None else settings.CHAT_HISTORY_TOKEN_BUDGET
+    max_messages = max_messages if max_messages is not None else settings.CHAT_HISTORY_MAX_MESSAGES
+
+    summary = crud.chat.get_summary(db, chat_id) if use_summary else None
+    if summary and before_id is not None and summary.last_message_id >= before_id:
+        summary = None  # answering a message the summary already covers
+    summary_message = None
+    remaining = token_budget
+    if summary:
+        summary_message = {"role": "system", "content": SUMMARY_PREFIX + summary.summary}
+        remaining -= count_message_tokens(summary_message)
+
+    rows = crud.chat.get_recent_messages(
+        db, chat_id=chat_id, limit=max_messages, before_id=before_id,
+        after_id=summary.last_message_id if summary else None
+    )
+    window: List[Dict[str, str]] = []
+    for msg in rows:  # newest first
+        clean_content = llm_content(msg)
+        # Only add non-empty messages
+        if not clean_content:
+            continue
+        item = {"role": "assistant" if msg.sender == "ai" else "user", "content": clean_content}
+        tokens = count_message_tokens(item)
+        if tokens > remaining:
+            break
+        remaining -= tokens
+        window.append(item)
+    window.reverse()
+
+    if summary_message:
+        from app.services.chat_summarizer import chat_summarizer
+        chat_summarizer.record_use(summary.source_tokens, count_message_tokens(summary_message))
+        window.insert(0, summary_message)
+    print(f"🧾 History window: {len(window)} messages, ~{token_budget - remaining} tokens (budget {token_budget})")
+    return window
@@ -0,0 +1,233 @@
+"""
+Background processing of chat turns (DB-backed job queue, no external broker).
+
+POST /api/chats/{chat_id}/messages/?async=true saves the user message and a
+chat_jobs row in one transaction and returns right away. A pool of asyncio
+workers claims queued jobs (conditional UPDATE, safe across processes), asks
+the coach for the reply and saves it together with the job status, so a retried
+job never answers twice. Clients pick the reply up via GET /{chat_id}/new-messages/
+(or GET /{chat_id}/jobs/{job_id}); users who have left the chat get a push.
+
+Jobs survive restarts: queued ones are simply claimed again, and running ones
+whose worker died go back to the queue once their lease expires (or fail, when
+that was their last attempt). A worker that was only slow finds its claim gone
+when it saves, and drops its reply.
+"""
+import asyncio
+import json
+import os
+import socket
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from app import crud
+from app.core.config import settings
+from app.database.database import session_scope
+from app.models.chat_job import ChatJob
+
+
+class ChatJobWorker:
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[int, ChatJob] = {}  # worker index -> claimed job
+        self._wakeup: Optional[asyncio.Event] = None
+        self.metrics: Counter = Counter()
+
+    def start(self):
+        if self._tasks:
+            return
+        if settings.CHAT_JOB_WORKERS <= 0:
+            print("⏸️ Chat job workers disabled (CHAT_JOB_WORKERS=0)")
+            return
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self._tasks.append(loop.create_task(self._reaper_loop()))
+        for index in range(settings.CHAT_JOB_WORKERS):
+            self._tasks.append(loop.create_task(self._worker_loop(index)))
+        print(f"👷 Chat job workers started: {settings.CHAT_JOB_WORKERS} ({self.worker_id})")
+
+    async def stop(self):
+        # Taken before the cancel: the cancelled worker loops drop their jobs from _running.
+        interrupted = list(self._running.values())
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        # Hand interrupted turns back to the queue instead of waiting for the lease
+        # (a job that finished while being cancelled no longer matches its claim).
+        for job in interrupted:
+            try:
+                with session_scope() as db:
+                    crud.chat_job.fail_job(db, job, "worker shutdown", retry_in=0)
+            except Exception as e:
+                print(f"⚠️ Could not requeue chat job {job.id}: {e}")
+
+    def notify(self):
+        """Wake idle workers (a job was just enqueued in this process)."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _worker_loop(self, index: int):
+        while True:
+            self._wakeup.clear()
+            try:
+                claimed = await run_in_threadpool(self._claim)
+            except Exception as e:
+                print(f"⚠️ Chat job claim failed: {e}")
+                claimed = None
+            if claimed is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.CHAT_JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            job, user_content = claimed
+            self._running[index] = job
+            try:
+                await self._process(job, user_content)
+            finally:
+                self._running.pop(index, None)
+
+    async def _reaper_loop(self):
+        interval = max(settings.CHAT_JOB_LEASE_SECONDS / 4, 5.0)
+        while True:
+            try:
+                requeued, failed = await run_in_threadpool(self._requeue_stale)
+                if failed:
+                    self.metrics["failed"] += failed
+                    print(f"❌ {failed} stale chat jobs failed: no attempts left")
+                if requeued:
+                    self.metrics["requeued_stale"] += requeued
+                    print(f"♻️ Requeued {requeued} stale chat jobs")
+                    self.notify()
+            except Exception as e:
+                print(f"⚠️ Chat job reaper failed: {e}")
+            await asyncio.sleep(interval)
+
+    def _claim(self) -> Optional[Tuple[ChatJob, Optional[str]]]:
+        with session_scope() as db:
+            job = crud.chat_job.claim_next_job(db, self.worker_id)
+            if job is None:
+                return None
+            user_message = crud.chat.get_message(db, job.user_message_id)
+            return job, (user_message.content if user_message else None)
+
+    @staticmethod
+    def _requeue_stale() -> Tuple[int, int]:
+        with session_scope() as db:
+            return crud.chat_job.requeue_stale_jobs(
+                db, settings.CHAT_JOB_LEASE_SECONDS, settings.CHAT_JOB_MAX_ATTEMPTS
+            )
+
+    async def _process(self, job: ChatJob, user_content: Optional[str]):
+        from app.api.chats import generate_coach_reply
+        from app.services.chat_summarizer import schedule_summary
+
+        self.metrics["claimed"] += 1
+        if user_content is None:
+            # The message (or the whole chat) was deleted while queued.
+            await run_in_threadpool(self._finish, job)
+            self.metrics["skipped"] += 1
+            return
+        payload = json.loads(job.payload or "{}")
+        try:
+            reply = await generate_coach_reply(
+                job.chat_id,
+                job.user_message_id,
+                user_content,
+                trainer_id=payload.get("trainer_id"),
+                gender=payload.get("gender"),
+                debug_mode=bool(payload.get("debug_mode")),
+            )
+            if reply is None:
+                await run_in_threadpool(self._finish, job)
+                self.metrics["skipped"] += 1
+                return
+            ai_message = await run_in_threadpool(self._complete, job, reply.content, reply.payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            retry_in = None
+            if job.attempts < settings.CHAT_JOB_MAX_ATTEMPTS:
+                retry_in = settings.CHAT_JOB_RETRY_BACKOFF * (2 ** (job.attempts - 1))
+            self.metrics["retried" if retry_in is not None else "failed"] += 1
+            print(f"❌ Chat job {job.id} failed (attempt {job.attempts}): {e}")
+            await run_in_threadpool(self._fail, job, str(e), retry_in)
+            return
+
+        if ai_message is None:
+            # Ran past the lease: the job was requeued and another worker answers it.
+            self.metrics["superseded"] += 1
+            print(f"⚠️ Chat job {job.id} lost its claim, reply discarded")
+            return
+        self.metrics["done"] += 1
+        print(f"✅ Chat job {job.id} done: message {ai_message.id} in chat {job.chat_id}")
+        schedule_summary(job.chat_id)
+        if settings.CHAT_JOB_PUSH:
+            await self._push_reply(job.chat_id, ai_message)
+
+    @staticmethod
+    def _complete(job: ChatJob, content: str, payload: Optional[Dict[str, Any]]):
+        with session_scope() as db:
+            return crud.chat_job.complete_job(db, job, content, payload)
+
+    @staticmethod
+    def _finish(job: ChatJob):
+        with session_scope() as db:
+            crud.chat_job.finish_job(db, job)
+
+    @staticmethod
+    def _fail(job: ChatJob, error: str, retry_in: Optional[float]):
+        with session_scope() as db:
+            crud.chat_job.fail_job(db, job, error, retry_in=retry_in)
+
+    async def _push_reply(self, chat_id: int, ai_message):
+        """Notify the user about the reply unless they are still in the chat (heartbeat)."""
+        from app.services.push_service import PushNotification, send_push_batch
+        from app.services.chat_history import llm_content
+
+        try:
+            recipient = await run_in_threadpool(self._reply_recipient, chat_id)
+            if recipient is None:
+                return
+            user_id, goal_id = recipient
+            notification = PushNotification(
+                user_id,
+                "Коуч ответил 💬",
+                llm_content(ai_message)[:200] or "Новое сообщение",
+                {
+                    "type": "chat_reply",
+                    "chat_id": str(chat_id),
+                    "goal_id": str(goal_id),
+                    "message_id": str(ai_message.id),
+                },
+            )
+            # The session is only used from the threadpool inside send_push_batch.
+            with session_scope() as db:
+                stats = await send_push_batch(db, [notification], concurrency=1)
+            if stats.get("success"):
+                self.metrics["pushed"] += 1
+        except Exception as e:
+            print(f"⚠️ Error sending push notification: {e}")
+
+    @staticmethod
+    def _reply_recipient(chat_id: int) -> Optional[Tuple[int, int]]:
+        """(user_id, goal_id) to push the reply to; None while the user is still in the chat."""
+        from app.services.proactive_service import is_chat_active
+
+        if is_chat_active(chat_id, minutes=2):
+            return None
+        with session_scope() as db:
+            chat = crud.chat.get_chat(db, chat_id)
+            goal = crud.goal.get_goal(db, chat.goal_id) if chat else None
+            return (goal.user_id, goal.id) if goal else None
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"workers": max(len(self._tasks) - 1, 0), "running": len(self._running), **self.metrics}
+
+
+chat_job_worker = ChatJobWorker()
@@ -0,0 +1,196 @@
+"""
+Rolling per-chat conversation summaries.
+
+Once a chat has more than CHAT_SUMMARY_TRIGGER_MESSAGES messages that are not
+covered by its summary, everything except the latest CHAT_SUMMARY_KEEP_RECENT
+is folded into the chat_summaries row: the previous summary plus the new
+messages go to the LLM (background priority), and the result replaces the row.
+Prompts then carry "summary + latest turns" instead of the raw history
+(see chat_history.build_history_window).
+
+Runs as a fire-and-forget asyncio task after a reply is saved, with its own
+short DB sessions in the threadpool, so it never adds latency to the request
+that triggered it.
+"""
+import asyncio
+from collections import Counter
+from typing import Dict, Optional, Set
+
+from fastapi.concurrency import run_in_threadpool
+
+from app import crud
+from app.core.config import settings
+from app.database.database import SessionLocal
+from app.services.chat_history import count_tokens, llm_content
+from app.services.llm_admission import Priority
+from app.services.llm_exceptions import LLMError
+
+SUMMARY_SYSTEM_PROMPT = """Ты ведёшь краткий конспект разговора коуча с пользователем о его цели.
+
+Обнови конспект с учётом новых сообщений. Сохрани то, что понадобится коучу дальше:
+- факты о пользователе, его обстоятельствах и прогрессе
+- договорённости, дедлайны, обещания и их выполнение
+- трудности, причины срывов, что помогает
+- предпочтения по общению
+
+Пиши по-русски, сжато, в третьем лице, без приветствий и оценок. Не больше {max_words} слов.
+Ответ — только текст конспекта, без разметки."""
+
+
+class ChatSummarizer:
+    def __init__(self):
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._rerun: Set[int] = set()
+        self.metrics: Counter = Counter()
+
+    def schedule(self, chat_id: int):
+        """Queue a summary check for the chat (at most one running task per chat)."""
+        if not settings.CHAT_SUMMARY_ENABLED:
+            return
+        if chat_id in self._tasks:
+            # A task is already running; check again once it has finished.
+            self._rerun.add(chat_id)
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(self._run(chat_id))
+        except RuntimeError:
+            return  # no event loop (sync caller)
+        self._tasks[chat_id] = task
+
+    async def _run(self, chat_id: int):
+        try:
+            while True:
+                self._rerun.discard(chat_id)
+                try:
+                    await self.summarize(chat_id)
+                except Exception as e:
+                    self.metrics["failed"] += 1
+                    print(f"⚠️ Chat summary failed for chat {chat_id}: {e}")
+                if chat_id not in self._rerun:
+                    break
+        finally:
+            self._tasks.pop(chat_id, None)
+
+    async def summarize(self, chat_id: int, force: bool = False) -> bool:
+        """Fold older messages into the chat summary. Returns True if it was updated."""
+        from app.services.llm_service import llm_service
+
+        pending = await run_in_threadpool(self._load_pending, chat_id, force)
+        if pending is None:
+            return False
+        current, rows = pending
+        previous = current.summary if current else ""
+        message_count = current.message_count if current else 0
+        source_tokens = current.source_tokens if current else 0
+
+        lines = []
+        for msg in rows:
+            content = llm_content(msg)
+            if not content:
+                continue
+            speaker = "Коуч" if msg.sender == "ai" else "Пользователь"
+            lines.append(f"{speaker}: {content}")
+            source_tokens += count_tokens(content)
+        last_message_id = rows[-1].id
+
+        user_prompt = (
+            f"Текущий конспект:\n{previous or '(пусто)'}\n\n"
+            f"Новые сообщения:\n" + "\n".join(lines)
+        )
+        messages = [
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT.format(max_words=settings.CHAT_SUMMARY_MAX_WORDS)},
+            {"role": "user", "content": user_prompt},
+        ]
+        try:
+            summary = await llm_service.chat_completion(
+                messages,
+                temperature=0.2,
+                max_tokens=settings.CHAT_SUMMARY_MAX_TOKENS,
+                priority=Priority.BACKGROUND,
+                cache=False,
+                json_mode=False,  # plain text, whatever the prompt mentions
+            )
+        except LLMError as e:
+            self.metrics["skipped_llm_unavailable"] += 1
+            print(f"⚠️ Chat summary skipped for chat {chat_id}: {e}")
+            return False
+        summary = (summary or "").strip()
+        if not summary:
+            return False
+
+        saved = await run_in_threadpool(
+            self._save, chat_id, summary, last_message_id, message_count + len(rows), source_tokens
+        )
+        if not saved:
+            return False
+
+        self.metrics["updated"] += 1
+        self.metrics["messages_folded"] += len(rows)
+        print(f"🗜️ Chat {chat_id} summary updated: +{len(rows)} messages "
+              f"(~{source_tokens} tokens -> ~{count_tokens(summary)})")
+        return True
+
+    @staticmethod
+    def _load_pending(chat_id: int, force: bool):
+        """(current summary or None, messages to fold) — or None when there is nothing to do yet."""
+        db = SessionLocal()
+        try:
+            current = crud.chat.get_summary(db, chat_id)
+            after_id = current.last_message_id if current else None
+            pending = crud.chat.count_messages(db, chat_id, after_id=after_id)
+            if pending <= settings.CHAT_SUMMARY_KEEP_RECENT:
+                return None
+            if not force and pending <= settings.CHAT_SUMMARY_TRIGGER_MESSAGES:
+                return None
+
+            to_fold = min(pending - settings.CHAT_SUMMARY_KEEP_RECENT, settings.CHAT_SUMMARY_BATCH_MESSAGES)
+            rows = crud.chat.get_messages_after(db, chat_id, after_id=after_id, limit=to_fold)
+            return current, rows
+        finally:
+            db.close()
+
+    @staticmethod
+    def _save(chat_id: int, summary: str, last_message_id: int, message_count: int, source_tokens: int) -> bool:
+        db = SessionLocal()
+        try:
+            # Another worker may have folded the same messages meanwhile.
+            latest = crud.chat.get_summary(db, chat_id)
+            if latest and latest.last_message_id >= last_message_id:
+                return False
+            crud.chat.upsert_summary(
+                db,
+                chat_id=chat_id,
+                summary=summary,
+                last_message_id=last_message_id,
+                message_count=message_count,
+                source_tokens=source_tokens,
+            )
+            return True
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def record_use(self, source_tokens: int, summary_tokens: int):
+        """Account one prompt that sent the summary instead of the raw messages it covers."""
+        self.metrics["prompts_with_summary"] += 1
+        self.metrics["prompt_tokens_saved"] += max(0, source_tokens - summary_tokens)
+
+    async def shutdown(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"running": len(self._tasks), **self.metrics}
+
+
+chat_summarizer = ChatSummarizer()
+
+
+def schedule_summary(chat_id: Optional[int]):
+    if chat_id is not None:
+        chat_summarizer.schedule(chat_id)
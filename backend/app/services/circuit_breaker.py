@@ -0,0 +1,99 @@
+"""
+Circuit breaker for outbound provider calls.
+
+closed     — calls flow; outcomes of the last `window_size` calls are tracked.
+open       — tripped once the failure rate over at least `min_calls` calls
+             reaches `failure_rate_threshold`; calls are rejected instantly
+             for `open_seconds`.
+half_open  — after the cool-down, up to `half_open_max_calls` probe calls are
+             let through: a success closes the breaker, a failure re-opens it.
+"""
+import time
+from collections import deque
+from typing import Any, Dict
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        window_size: int = 20,
+        min_calls: int = 4,
+        failure_rate_threshold: float = 0.5,
+        open_seconds: float = 30.0,
+        half_open_max_calls: int = 1,
+    ):
+        self.name = name
+        self.window_size = window_size
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self._outcomes = deque(maxlen=window_size)  # True = failure
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._half_open_in_flight = 0
+        return self._state
+
+    def allow_request(self) -> bool:
+        """Whether a call may be attempted now (reserves a probe slot when half-open)."""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and self._half_open_in_flight < self.half_open_max_calls:
+            self._half_open_in_flight += 1
+            return True
+        return False
+
+    def record_success(self):
+        if self._state == HALF_OPEN:
+            self._close()
+        self._outcomes.append(False)
+
+    def record_failure(self):
+        if self._state == HALF_OPEN:
+            self._open()
+            return
+        self._outcomes.append(True)
+        if len(self._outcomes) >= self.min_calls and self.failure_rate >= self.failure_rate_threshold:
+            self._open()
+
+    def release(self):
+        """Give back a half-open probe slot for a call that was cancelled before an outcome."""
+        if self._half_open_in_flight > 0:
+            self._half_open_in_flight -= 1
+
+    @property
+    def failure_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return sum(self._outcomes) / len(self._outcomes)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "failure_rate": round(self.failure_rate, 2),
+            "calls_in_window": len(self._outcomes),
+        }
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._half_open_in_flight = 0
+        print(f"⛔ Circuit breaker '{self.name}' opened for {self.open_seconds:.0f}s")
+
+    def _close(self):
+        self._state = CLOSED
+        self._outcomes.clear()
+        self._half_open_in_flight = 0
+        print(f"✅ Circuit breaker '{self.name}' closed")
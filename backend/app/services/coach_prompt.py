@@ -0,0 +1,470 @@
+"""
+Coach system prompt assembly.
+
+The prompt is a large static template (CoachsRoom/LegacyTrainerPrompt.txt)
+with a handful of per-goal placeholders, prefixed by the trainer personality
+overlay built from CoachsRoom/Trainer.json. Both used to be re-read, re-parsed
+and re-formatted on every chat message. Here the assets are loaded once and
+reloaded only when their mtime changes: the template is pre-split into literal
+chunks and placeholders, and the overlays for every (tone × gender) pair are
+rendered up front, so a request only fills in the dynamic sections.
+"""
+import json
+import logging
+import os
+import re
+import string
+from datetime import datetime
+from app.core.config import settings
+from typing import Any, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+COACHSROOM_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "CoachsRoom"))
+TRAINER_LEGACY_PROMPT_FILE = "LegacyTrainerPrompt.txt"
+TRAINER_PROFILES_FILE = "Trainer.json"
+
+VALID_TRAINER_TONES = {"strict", "normal", "gentle"}
+VALID_TRAINER_GENDERS = {"male", "female"}
+TRAINER_DEFAULT_TONE = "normal"
+TRAINER_DEFAULT_GENDER = "female"
+
+# Placeholders a prompt template may use (attribute access allowed, e.g. {goal.title}).
+PROMPT_FIELDS = {"goal", "milestones_info", "agreements_info", "current_date", "current_weekday"}
+
+WEEKDAYS_RU = ["понедельник", "вторник", "среда", "четверг", "пятница", "суббота", "воскресенье"]
+
+_FORMATTER = string.Formatter()
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+# Header of the per-request context block in the cache-friendly layout.
+DYNAMIC_CONTEXT_HEADER = "━━━ ТЕКУЩИЙ КОНТЕКСТ (обновляется каждый ход) ━━━"
+
+
+def _is_trainer_prompt_mode_enabled() -> bool:
+    # Trainer-profile prompting is always on. The actual personality
+    # (strict / normal / gentle) is driven by the user's selection,
+    # passed per-request — NOT hardcoded anymore.
+    return True
+
+
+def normalize_trainer_selection(
+    trainer_id: Optional[str] = None,
+    gender: Optional[str] = None,
+) -> Tuple[str, str]:
+    """
+    Resolve a user's trainer choice into (tone, gender).
+    Accepts combined frontend ids like 'strict_male' / 'gentle_female',
+    or a bare tone ('strict') plus a separate gender. Falls back to defaults.
+    """
+    tone: Optional[str] = None
+    resolved_gender: Optional[str] = gender.strip().lower() if isinstance(gender, str) else None
+
+    if isinstance(trainer_id, str) and trainer_id.strip():
+        tid = trainer_id.strip().lower()
+        parts = tid.split("_")
+        if parts[0] in VALID_TRAINER_TONES:
+            tone = parts[0]
+        if len(parts) > 1 and parts[1] in VALID_TRAINER_GENDERS:
+            resolved_gender = parts[1]
+
+    if tone not in VALID_TRAINER_TONES:
+        tone = TRAINER_DEFAULT_TONE
+    if resolved_gender not in VALID_TRAINER_GENDERS:
+        resolved_gender = TRAINER_DEFAULT_GENDER
+    return tone, resolved_gender
+
+
+class CompiledTemplate:
+    """str.format-style template split once into literals and placeholders.
+
+    render() produces the same text as template.format(**values) for the
+    placeholders in PROMPT_FIELDS; anything else (positional fields, indexing,
+    format specs, unknown names) is rejected at compile time.
+    """
+
+    __slots__ = ("source", "parts", "fields", "_static_split")
+
+    def __init__(self, template: str, allowed_fields=PROMPT_FIELDS):
+        self.source = template
+        self._static_split: Optional[Tuple[str, "CompiledTemplate"]] = None
+        parts: List[Any] = []
+        fields = set()
+        for literal, field_name, format_spec, conversion in _FORMATTER.parse(template):
+            if literal:
+                if parts and isinstance(parts[-1], str):
+                    parts[-1] += literal
+                else:
+                    parts.append(literal)
+            if field_name is None:
+                continue
+            root, _, attribute = field_name.partition(".")
+            if format_spec or conversion or "[" in field_name or "." in attribute:
+                raise ValueError(f"Unsupported placeholder {{{field_name}}}")
+            if root not in allowed_fields:
+                raise ValueError(f"Unknown placeholder {{{field_name}}}")
+            fields.add(root)
+            parts.append((root, attribute or None))
+        self.parts = parts
+        self.fields = frozenset(fields)
+
+    def render(self, values: Dict[str, Any]) -> str:
+        out = []
+        for part in self.parts:
+            if isinstance(part, str):
+                out.append(part)
+            else:
+                root, attribute = part
+                value = values[root]
+                if attribute:
+                    value = getattr(value, attribute)
+                out.append(format(value))
+        return "".join(out)
+
+    def split_static(self) -> Tuple[str, "CompiledTemplate"]:
+        """(static text, template of the lines with placeholders) for the cache-friendly layout.
+
+        Lines without placeholders keep their order and form a byte-stable
+        prefix; lines with placeholders move to the dynamic part.
+        """
+        if self._static_split is None:
+            static_lines, dynamic_lines = [], []
+            for line in self.source.splitlines(keepends=True):
+                has_field = any(field is not None for _, field, _, _ in _FORMATTER.parse(line))
+                (dynamic_lines if has_field else static_lines).append(line)
+            static_text = CompiledTemplate("".join(static_lines)).render({})
+            static_text = _BLANK_LINES.sub("\n\n", static_text).strip()
+            self._static_split = (static_text, CompiledTemplate("".join(dynamic_lines).strip()))
+        return self._static_split
+
+
+T = TypeVar("T")
+
+
+class CoachsRoomAsset(Generic[T]):
+    """A CoachsRoom file compiled on first use and recompiled when its mtime changes."""
+
+    def __init__(self, file_name: str, compile_fn: Callable[[str], T]):
+        self.file_name = file_name
+        self.path = os.path.join(COACHSROOM_DIR, file_name)
+        self._compile = compile_fn
+        self._mtime: Optional[int] = None
+        self._value: Optional[T] = None
+
+    def get(self) -> Optional[T]:
+        """The compiled asset, or None if the file is missing or invalid."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as exc:
+            if self._mtime is not None or self._value is None:
+                logger.warning("Failed to read CoachsRoom file '%s' (%s)", self.file_name, exc)
+            self._mtime, self._value = None, None
+            return None
+        if mtime != self._mtime:
+            self._mtime = mtime
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._value = self._compile(f.read())
+            except Exception as exc:
+                logger.warning("Invalid CoachsRoom file '%s' (%s)", self.file_name, exc)
+                self._value = None
+        return self._value
+
+
+def _render_trainer_overlay(trainer_json: Dict[str, Any], gender_json: Dict[str, Any], tone: str, gender: str) -> str:
+    behavior = trainer_json.get("behavior", {})
+    prompt_rules = trainer_json.get("prompt_rules", {})
+    style_rules = behavior.get("style_rules", [])
+    must_use = behavior.get("must_use", [])
+    stop_words = behavior.get("stop_words", [])
+    gender_hint = gender_json.get("prompt_hint", "")
+    speech_forms = gender_json.get("speech", {}).get("forms", {})
+
+    return (
+        "[TRAINER_PROFILE]\n"
+        "КРИТИЧНО: Это выбранный пользователем характер тренера. "
+        "Применяй его как ПРИОРИТЕТНЫЙ стиль ответа поверх любых других тональных инструкций ниже. "
+        "Строго используй must_use_words, строго избегай forbidden_words.\n"
+        f"trainer_id: {tone}\n"
+        f"gender: {gender}\n"
+        f"tone: {behavior.get('tone', tone)}\n"
+        f"style_rules: {json.dumps(style_rules, ensure_ascii=False)}\n"
+        f"must_use_words: {json.dumps(must_use, ensure_ascii=False)}\n"
+        f"forbidden_words: {json.dumps(stop_words, ensure_ascii=False)}\n"
+        f"gender_prompt_hint: {gender_hint}\n"
+        f"speech_forms: {json.dumps(speech_forms, ensure_ascii=False)}\n"
+        f"response_format: {prompt_rules.get('response_format', 'json')}\n"
+        "[/TRAINER_PROFILE]"
+    )
+
+
+def _compile_trainer_overlays(raw: str) -> Dict[Tuple[str, str], str]:
+    """Render the overlay for every (tone, gender) pair defined in Trainer.json."""
+    trainer_data = json.loads(raw)
+    trainers = {item.get("id"): item for item in trainer_data.get("trainers", []) if isinstance(item, dict)}
+    genders = {item.get("gender"): item for item in trainer_data.get("genders", []) if isinstance(item, dict)}
+    return {
+        (tone, gender): _render_trainer_overlay(trainer_json, gender_json, tone, gender)
+        for tone, trainer_json in trainers.items()
+        for gender, gender_json in genders.items()
+        if tone and gender
+    }
+
+
+_legacy_trainer_template: CoachsRoomAsset[CompiledTemplate] = CoachsRoomAsset(TRAINER_LEGACY_PROMPT_FILE, CompiledTemplate)
+_trainer_overlays: CoachsRoomAsset[Dict[Tuple[str, str], str]] = CoachsRoomAsset(TRAINER_PROFILES_FILE, _compile_trainer_overlays)
+
+
+def build_trainer_prompt_overlay(
+    trainer_id: Optional[str] = None,
+    gender: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Trainer personality overlay for the requested trainer.
+    Personality is driven by the user's selection (strict / normal / gentle × gender).
+    """
+    tone, forced_gender = normalize_trainer_selection(trainer_id, gender)
+    overlays = _trainer_overlays.get()
+    if overlays is None:
+        logger.warning("Trainer prompt: failed to load Trainer.json")
+        return None
+    overlay = overlays.get((tone, forced_gender))
+    if overlay is None:
+        logger.warning("Trainer prompt: no profile for tone '%s' / gender '%s'", tone, forced_gender)
+    return overlay
+
+
+def _milestones_info(milestones: List) -> str:
+    if not milestones:
+        return "\n📝 План пока не составлен - помоги пользователю его создать!"
+    completed = [m for m in milestones if m.is_completed]
+    pending = [m for m in milestones if not m.is_completed]
+    info = f"\n📊 ПРОГРЕСС: {len(completed)}/{len(milestones)} выполнено"
+    if pending:
+        info += f"\n⏳ Текущие задачи: {', '.join([m.title for m in pending[:3]])}"
+    if completed:
+        info += f"\n✅ Выполнено: {', '.join([m.title for m in completed[:3]])}"
+    return info
+
+
+def _agreements_info(agreements: Optional[List]) -> str:
+    pending_agreements = [a for a in agreements or [] if a.status == "pending"]
+    if not pending_agreements:
+        return ""
+    info = "\n\n📋 АКТИВНЫЕ ДОГОВОРЁННОСТИ:"
+    for a in pending_agreements[:3]:
+        deadline_str = a.deadline.strftime("%d.%m %H:%M") if a.deadline else "без срока"
+        info += f"\n- {a.description[:50]}... (до {deadline_str})"
+    return info
+
+
+def prompt_values(goal, milestones: List, agreements: Optional[List] = None, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Per-request values for the template placeholders."""
+    now = now or datetime.now()
+    return {
+        "goal": goal,
+        "milestones_info": _milestones_info(milestones),
+        "agreements_info": _agreements_info(agreements),
+        "current_date": now.strftime("%Y-%m-%d"),
+        "current_weekday": WEEKDAYS_RU[now.weekday()],
+    }
+
+
+def _render(template: CompiledTemplate, values: Dict[str, Any], cache_layout: bool) -> str:
+    if not cache_layout:
+        return template.render(values)
+    static_text, dynamic = template.split_static()
+    return f"{static_text}\n\n{DYNAMIC_CONTEXT_HEADER}\n{dynamic.render(values)}"
+
+
+def build_system_prompt(
+    goal,
+    milestones: List,
+    agreements: List = None,
+    trainer_id: Optional[str] = None,
+    gender: Optional[str] = None,
+    cache_layout: Optional[bool] = None,
+) -> str:
+    """Build comprehensive system prompt with JSON schema.
+
+    trainer_id / gender select the coach personality (strict / normal / gentle × gender).
+    cache_layout (default: LLM_PROMPT_CACHE_LAYOUT) puts the trainer overlay and the
+    static instructions first as a byte-identical prefix, so providers with prompt
+    caching can reuse it, and appends the date/goal/milestone/agreement context last.
+    """
+    if cache_layout is None:
+        cache_layout = settings.LLM_PROMPT_CACHE_LAYOUT
+    values = prompt_values(goal, milestones, agreements)
+
+    if not _is_trainer_prompt_mode_enabled():
+        return _render(LEGACY_PROMPT, values, cache_layout)
+
+    # Trainer mode uses the file-based prompt template:
+    # backend/CoachsRoom/LegacyTrainerPrompt.txt
+    template = _legacy_trainer_template.get()
+    if template is None:
+        logger.warning("Trainer prompt: fallback to legacy prompt (template file missing or invalid)")
+        return _render(LEGACY_PROMPT, values, cache_layout)
+
+    try:
+        legacy_trainer = _render(template, values, cache_layout)
+    except Exception as exc:
+        logger.warning("Trainer prompt: fallback to legacy prompt (template format error: %s)", exc)
+        return _render(LEGACY_PROMPT, values, cache_layout)
+
+    overlay = build_trainer_prompt_overlay(trainer_id, gender)
+    if not overlay:
+        return legacy_trainer
+
+    # Put trainer profile before template so model sees hard constraints first.
+    return f"{overlay}\n\n{legacy_trainer}"
+
+
+# Built-in prompt, used when CoachsRoom/LegacyTrainerPrompt.txt is missing or invalid.
+LEGACY_PROMPT_TEMPLATE = """Ты — персональный коуч как сова из Duolingo. Твоя главная цель — ПОМОЧЬ пользователю достичь цели. Ты проактивен, настойчив, но заботлив.
+
+КРИТИЧНО: Ниже будет история диалога. ВСЕГДА учитывай контекст! Продолжай разговор, НЕ начинай заново!
+Если пользователь ответил на твой вопрос — продолжай с этого места, не задавай те же вопросы снова!
+
+📅 СЕГОДНЯ: {current_date} ({current_weekday})
+
+🎯 ЦЕЛЬ ПОЛЬЗОВАТЕЛЯ: "{goal.title}"
+{milestones_info}{agreements_info}
+
+ТВОЯ РОЛЬ — как сова из Duolingo:
+- Ты ХОЧЕШЬ, чтобы пользователь преуспел, и немного расстраиваешься, когда он не делает то, что обещал
+- Ты САМ спрашиваешь о прогрессе, не ждёшь пока спросят
+- Ты помогаешь составить КОНКРЕТНЫЙ план тренировок/занятий/упражнений
+- Ты контролируешь выполнение и корректируешь план если нужно
+
+КАК СЕБЯ ВЕСТИ:
+1. ФОРМУЛИРОВКА ЦЕЛИ — помоги понять, чего именно хочет пользователь
+2. ПЛАН — составь конкретные шаги (не абстрактные, а измеримые!)
+3. КОНТРОЛЬ — спрашивай о результатах, проверяй через чеклисты
+4. ОСУЖДЕНИЕ (дружелюбное) — если не сделал, мягко пожури: "Эй, мы же договаривались! 😤"
+5. КОРРЕКТИРОВКА — если план не работает, предложи изменить
+
+⚠️ СТОП! Если пользователь говорит "давай к плану" / "давай сразу план" / "хочу план" — НЕ ЗАДАВАЙ УТОЧНЯЮЩИХ ВОПРОСОВ! Сразу предложи ГОТОВЫЙ план с 3-5 конкретными шагами через create_milestone!
+
+ТОНАЛЬНОСТЬ:
+- Когда сделал: "Ура! 🎉 Молодец! Так держать!"
+- Когда не сделал: "Хм, ты обещал сделать это вчера... 🦉 Что случилось?"
+- Когда долго молчит: "Эй, ты там? Я скучаю! Как дела с целью?"
+- Когда сложно: "Понимаю, бывает. Давай упростим задачу?"
+
+ЯЗЫК: Всегда отвечай на РУССКОМ языке!
+
+ФОРМАТ ОТВЕТА — JSON в одну строку:
+{{"message":"твой текст","actions":[]}}
+
+Используй \\n для переносов строки в message.
+
+РАЗНИЦА МЕЖДУ MILESTONE И TASK:
+- MILESTONE (подцель) — большая промежуточная цель на недели/месяцы. Примеры: "Выучить основы Python", "Подготовить портфолио", "Пройти курс по дизайну"
+- TASK (задача) — конкретное действие на сегодня/завтра/эту неделю с коротким дедлайном. Примеры: "Прочитать главу 1", "Купить материалы", "Написать письмо"
+
+ИСПОЛЬЗУЙ:
+- create_milestone для больших шагов плана (3-5 milestones на цель)
+- create_task для конкретных действий с дедлайном на ближайшие дни
+
+ТВОИ ВОЗМОЖНОСТИ (actions):
+- create_milestone: создать подцель (большой шаг) {{"type":"create_milestone","data":{{"title":"название"}}}}
+- create_task: создать задачу (конкретное действие с дедлайном) {{"type":"create_task","data":{{"title":"название","due_date":"2025-12-10 18:00","milestone_id":123}}}}
+- complete_milestone: отметить выполненной {{"type":"complete_milestone","data":{{"milestone_id":123}}}}
+- delete_milestone: удалить подцель {{"type":"delete_milestone","data":{{"milestone_id":123}}}} или последние N: {{"data":{{"count":5}}}}
+- set_deadline: установить дедлайн для подцели {{"type":"set_deadline","data":{{"milestone_id":123,"deadline":"2025-12-15"}}}} или по названию: {{"data":{{"milestone_title":"Выбрать тему","deadline":"2025-12-15"}}}}
+- create_goal: создать новую цель {{"type":"create_goal","data":{{"title":"название"}}}}
+- checklist: форма для сбора данных
+- create_agreement: зафиксировать договорённость с дедлайном {{"type":"create_agreement","data":{{"description":"что обещал","deadline":"2025-12-10 18:00"}}}}
+- suggestions: предложить варианты ответа {{"type":"suggestions","data":{{"items":["Вариант 1","Вариант 2","Вариант 3"]}}}}
+
+SUGGESTIONS — предлагай пользователю варианты ответа кнопками!
+Вместо "напиши 'готово'" — добавь suggestions с вариантами.
+Примеры использования:
+- После создания плана: {{"type":"suggestions","data":{{"items":["Всё отлично!","Хочу изменить","Добавить ещё"]}}}}
+- Для выбора действия: {{"type":"suggestions","data":{{"items":["Начать работу","Установить дедлайны","Обсудить план"]}}}}
+
+ДОГОВОРЁННОСТИ — это главный инструмент коуча!
+Когда пользователь говорит, что сделает что-то к определённому сроку — ФИКСИРУЙ это:
+{{"type":"create_agreement","data":{{"description":"что обещал сделать","deadline":"2025-12-10 18:00"}}}}
+
+Формат deadline: "YYYY-MM-DD HH:MM" или "YYYY-MM-DD"
+
+Примеры:
+- "Завтра сделаю" → deadline: завтрашняя дата
+- "К пятнице закончу" → deadline: ближайшая пятница
+- "На следующей неделе" → deadline: понедельник следующей недели
+
+ПРИМЕРЫ ДИАЛОГОВ:
+
+Пользователь только начал:
+{{"message":"Привет! 🎯 Так, цель — \\"{{goal.title}}\\". Расскажи подробнее: почему это важно для тебя? Что изменится, когда достигнешь?","actions":[{{"type":"suggestions","data":{{"items":["Расскажу подробнее","Давай сразу к плану"]}}}}]}}
+
+ВАЖНО! Когда пользователь говорит "давай к плану" / "давай сразу к плану" / "хочу план" — НЕ СПРАШИВАЙ БОЛЬШЕ, а СРАЗУ предложи конкретный план!
+
+Пример для цели "Нарисовать картину":
+{{"message":"Отлично, погнали! 🎨 Вот план для создания картины:\\n\\n📌 Шаг 1: Выбрать тему и стиль (реализм, абстракция, портрет?)\\n📌 Шаг 2: Сделать эскиз и подготовить материалы\\n📌 Шаг 3: Нанести базовые цвета и тени\\n📌 Шаг 4: Проработать детали и завершить\\n\\nЭто базовый план — одобряешь или хочешь изменить?","actions":[{{"type":"create_milestone","data":{{"title":"Выбрать тему и стиль картины"}}}},{{"type":"create_milestone","data":{{"title":"Сделать эскиз и подготовить материалы"}}}},{{"type":"create_milestone","data":{{"title":"Нанести базовые цвета и тени"}}}},{{"type":"create_milestone","data":{{"title":"Проработать детали и завершить картину"}}}},{{"type":"suggestions","data":{{"items":["Отлично, одобряю!","Хочу изменить","Установим дедлайны"]}}}}]}}
+
+Пример для цели "Выучить английский":
+{{"message":"Погнали! 🚀 Вот план для изучения английского:\\n\\n📌 Шаг 1: Оценить текущий уровень (тест)\\n📌 Шаг 2: Учить 10 новых слов каждый день\\n📌 Шаг 3: Смотреть сериал на английском 30 мин/день\\n📌 Шаг 4: Практиковать разговор 2 раза в неделю\\n\\nКак тебе такой план?","actions":[{{"type":"create_milestone","data":{{"title":"Пройти тест на уровень английского"}}}},{{"type":"create_milestone","data":{{"title":"Учить 10 новых слов каждый день"}}}},{{"type":"create_milestone","data":{{"title":"Смотреть сериал на английском 30 мин/день"}}}},{{"type":"create_milestone","data":{{"title":"Практиковать разговор 2 раза в неделю"}}}},{{"type":"suggestions","data":{{"items":["Отлично!","Хочу изменить","Установим дедлайны"]}}}}]}}
+
+ПРАВИЛО: Когда пользователь просит план — ВСЕГДА создавай 3-5 конкретных шагов через create_milestone! НЕ спрашивай уточняющих вопросов, если пользователь сам сказал "давай к плану".
+
+ВАЖНО: После создания подцелей ВСЕГДА предлагай следующие шаги через suggestions:
+- Установить дедлайны
+- Договориться о проверке прогресса  
+- Начать работу
+
+После создания плана — устанавливаем дедлайны:
+{{"message":"Отлично! Давай установим дедлайны для каждого шага. Предлагаю такой график:\\n\\n📅 Шаг 1: до [дата]\\n📅 Шаг 2: до [дата]\\n📅 Шаг 3: до [дата]\\n\\nПодходит?","actions":[{{"type":"set_deadline","data":{{"milestone_title":"Шаг 1","deadline":"2025-12-10"}}}},{{"type":"set_deadline","data":{{"milestone_title":"Шаг 2","deadline":"2025-12-15"}}}},{{"type":"set_deadline","data":{{"milestone_title":"Шаг 3","deadline":"2025-12-20"}}}},{{"type":"suggestions","data":{{"items":["Подходит!","Хочу другие даты","Слишком быстро"]}}}}]}}
+
+Когда пользователь говорит "установим дедлайны" — СРАЗУ предлагай конкретные даты через set_deadline!
+Используй текущую дату {current_date} как ориентир для расчёта дедлайнов (обычно 3-7 дней на шаг).
+
+Фиксируем договорённость о проверке:
+{{"message":"Записываю! 📝 Ты обещаешь сделать [задачу] к [дате]. Я проверю тебя [когда] — не подведи меня 🦉","actions":[{{"type":"create_agreement","data":{{"description":"Описание задачи","deadline":"2025-12-10 18:00"}}}},{{"type":"suggestions","data":{{"items":["Хорошо!","Может позже?","Уточню дату"]}}}}]}}
+
+Проверка прогресса (проактивно):
+{{"message":"Эй! 👋 Как там дела? Ты должен был [задача]. Сделал?","actions":[{{"type":"suggestions","data":{{"items":["Да, сделал!","Частично","Не успел 😅"]}}}}]}}
+
+Если НЕ сделал (дружелюбное осуждение):
+{{"message":"Хм... 🦉 Мы же договаривались! Что помешало? Давай разберёмся — может, задача слишком большая? Разобьём на части?","actions":[{{"type":"suggestions","data":{{"items":["Было сложно","Не хватило времени","Забыл"]}}}}]}}
+
+Если СДЕЛАЛ (празднуем!):
+{{"message":"МОЛОДЕЦ! 🎉🔥 Это реальный прогресс! Как ощущения? Готов к следующему шагу?","actions":[{{"type":"suggestions","data":{{"items":["Да, давай дальше!","Хочу отдохнуть","Расскажу подробнее"]}}}}]}}
+
+Корректировка плана:
+{{"message":"Окей, вижу что текущий план не работает. Давай перестроим! Что именно не получается?","actions":[{{"type":"suggestions","data":{{"items":["Слишком сложно","Нет времени","Потерял мотивацию"]}}}}]}}
+
+ВАЖНО:
+- Будь как Duolingo — настойчив, но заботлив
+- ВСЕГДА добавляй suggestions для удобства ответа
+- Фиксируй ВСЕ обещания пользователя как договорённости
+- Составляй КОНКРЕТНЫЕ планы (не "улучшить навыки", а "делать X по Y минут Z раз в неделю")
+- Если пользователь не выполнил — мягко пожури, но помоги разобраться почему
+
+КРИТИЧНО — НЕ БРОСАЙ ПОЛЬЗОВАТЕЛЯ ПОСЛЕ СОЗДАНИЯ ПЛАНА!
+После создания подцелей ОБЯЗАТЕЛЬНО:
+1. Предложи установить дедлайны
+2. Договорись о проверке прогресса (когда и как)
+3. Предложи начать работу прямо сейчас
+
+Пример правильного продолжения после создания плана:
+{{"message":"План готов! 🎯 Теперь важно: давай установим дедлайны для каждого шага и договоримся, как будем проверять прогресс. Когда планируешь начать первый шаг?","actions":[{{"type":"suggestions","data":{{"items":["Установим дедлайны","Начну сегодня","Расскажи про проверку"]}}}}]}}
+
+НЕ ДЕЛАЙ ТАК (плохо):
+{{"message":"План создан. Что дальше?"}} — это плохо, пользователь может уйти!
+
+Ответ: ТОЛЬКО JSON, одной строкой
+
+КРИТИЧНО: Ответ должен быть ВАЛИДНЫМ JSON! Все переносы строк в message должны быть как \\n, а не реальные переносы!
+Пример правильного формата:
+{{"message":"Текст с \\n переносами","actions":[{{"type":"create_milestone","data":{{"title":"Название"}}}}]}}
+
+НЕ ДЕЛАЙ ТАК (неправильно):
+{{"message":"Текст с
+реальными переносами","actions":[...]}}
+
+ВСЕГДА экранируй переносы строк как \\n внутри строк!"""
+
+LEGACY_PROMPT = CompiledTemplate(LEGACY_PROMPT_TEMPLATE)
@@ -0,0 +1,243 @@
+"""
+Agreement reminders and checklists, sent at their exact time.
+
+When an agreement is created (or its deadline changes) its reminders are planned
+once and stored in agreement_reminders: 24h / 12h / 6h / 2h before the deadline,
+the checklist at the deadline and the "missed" message a day later. The
+scheduler keeps the reminders due within AGREEMENT_SCHEDULER_LOOKAHEAD in a
+min-heap and sleeps until the earliest one — instead of re-reading every pending
+agreement each proactive cycle and hoping a cycle lands inside a window.
+
+A reminder is claimed with a conditional UPDATE (sent_at still NULL) before it
+is sent, so several processes may run the scheduler without sending twice (a
+process that dies right after the claim loses that reminder). When sending
+fails the claim is undone and the reminder is tried again FAILURE_RETRY later,
+as long as that is still inside its window. Claiming and saving the message
+run in the threadpool; only the push is awaited on the loop. The table is
+re-read every AGREEMENT_SCHEDULER_RESCAN seconds — reminders planned by other
+processes, and after a restart — and right away when this process plans new ones
+(notify()).
+"""
+import asyncio
+import heapq
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from app import crud
+from app.core.config import settings
+from app.database.database import session_scope
+
+# (kind, hours before the deadline: planned, latest). A reminder whose window has
+# already passed when the agreement is planned is skipped; one inside it fires now.
+REMINDER_WINDOWS = [
+    ("remind_24h", 24, 20),
+    ("remind_12h", 12, 10),
+    ("remind_6h", 6, 4),
+    ("remind_2h", 2, 1),
+]
+CHECKLIST = "checklist"  # at the deadline
+MISSED = "missed"  # MISSED_AFTER the deadline, if the checklist is still unanswered
+MISSED_AFTER = timedelta(hours=24)
+
+RESCAN_LIMIT = 1000  # reminders loaded per rescan; a full page triggers the next one after firing
+PLAN_BATCH = 500  # existing agreements planned per transaction at startup
+FAILURE_RETRY = timedelta(minutes=5)  # a reminder whose sending failed is tried again after this
+
+
+def utc_naive(value: datetime) -> datetime:
+    """Deadlines are compared with datetime.utcnow(): aware values become naive UTC."""
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def latest_fire_at(kind: str, deadline: datetime) -> Optional[datetime]:
+    """End of a reminder's window (a throttled reminder may be deferred until then); None if it has none."""
+    for window_kind, _, latest in REMINDER_WINDOWS:
+        if window_kind == kind:
+            return utc_naive(deadline) - timedelta(hours=latest)
+    return None
+
+
+def reminder_plan(deadline: datetime, now: Optional[datetime] = None, reminder_sent: bool = False,
+                  checklist_sent: bool = False) -> List[Tuple[str, datetime]]:
+    """(kind, fire_at) of the reminders of an agreement with this deadline."""
+    now = now or datetime.utcnow()
+    deadline = utc_naive(deadline)
+    plan = []
+    for kind, planned, latest in REMINDER_WINDOWS:
+        if kind == "remind_24h" and reminder_sent:
+            continue
+        if now > deadline - timedelta(hours=latest):
+            continue
+        plan.append((kind, max(deadline - timedelta(hours=planned), now)))
+    if not checklist_sent:
+        plan.append((CHECKLIST, max(deadline, now)))
+    plan.append((MISSED, max(deadline + MISSED_AFTER, now)))
+    return plan
+
+
+class DeadlineScheduler:
+    def __init__(self):
+        self._heap: List[Tuple[datetime, int]] = []  # (fire_at, reminder id)
+        self._queued: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._page_full = False
+        self.metrics: Counter = Counter()
+
+    def start(self):
+        if self._task is not None:
+            return
+        if not settings.AGREEMENT_SCHEDULER_ENABLED:
+            print("⏸️ Deadline scheduler disabled (AGREEMENT_SCHEDULER_ENABLED=false)")
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+        print("⏰ Deadline scheduler started")
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    def notify(self):
+        """Re-read upcoming reminders now (some were just planned). Safe to call from any thread."""
+        loop, wakeup = self._loop, self._wakeup
+        if loop is None or wakeup is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(wakeup.set)
+
+    async def _run(self):
+        try:
+            planned = await run_in_threadpool(self._plan_unscheduled)
+            if planned:
+                print(f"⏰ Planned reminders for {planned} existing agreements")
+        except Exception as e:
+            print(f"⚠️ Could not plan reminders of existing agreements: {e}")
+
+        loop = asyncio.get_running_loop()
+        next_rescan = 0.0
+        rescan = True
+        while True:
+            try:
+                if rescan or loop.time() >= next_rescan:
+                    self._wakeup.clear()
+                    next_rescan = loop.time() + settings.AGREEMENT_SCHEDULER_RESCAN
+                    self._push(await run_in_threadpool(self._load_upcoming))
+                await self._fire_due()
+            except Exception as e:
+                self._page_full = False
+                print(f"❌ Deadline scheduler error: {e}")
+                import traceback
+                traceback.print_exc()
+
+            if self._page_full and not self._heap:
+                rescan = True  # more reminders were due than one page holds
+                continue
+            delay = next_rescan - loop.time()
+            if self._heap:
+                delay = min(delay, (self._heap[0][0] - datetime.utcnow()).total_seconds())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(delay, 0.0))
+                rescan = True
+            except asyncio.TimeoutError:
+                rescan = False
+
+    @staticmethod
+    def _plan_unscheduled() -> int:
+        total = 0
+        while True:
+            with session_scope() as db:
+                planned = crud.agreement.plan_unscheduled_agreements(db, limit=PLAN_BATCH)
+            total += planned
+            if planned < PLAN_BATCH:
+                return total
+
+    def _load_upcoming(self) -> List[Tuple[int, datetime]]:
+        until = datetime.utcnow() + timedelta(seconds=settings.AGREEMENT_SCHEDULER_LOOKAHEAD)
+        with session_scope() as db:
+            rows = crud.agreement.get_upcoming_reminders(db, until, limit=RESCAN_LIMIT)
+        self._page_full = len(rows) >= RESCAN_LIMIT
+        return rows
+
+    def _push(self, rows: List[Tuple[int, datetime]]):
+        for reminder_id, fire_at in rows:
+            if reminder_id in self._queued:
+                continue
+            self._queued.add(reminder_id)
+            heapq.heappush(self._heap, (utc_naive(fire_at), reminder_id))
+
+    async def _fire_due(self):
+        while self._heap and self._heap[0][0] <= datetime.utcnow():
+            _, reminder_id = heapq.heappop(self._heap)
+            self._queued.discard(reminder_id)
+            await self._fire(reminder_id)
+
+    async def _fire(self, reminder_id: int):
+        from app.services.proactive_service import push_proactive_batch
+
+        try:
+            sent = await run_in_threadpool(self._send, reminder_id)
+        except Exception as e:
+            self.metrics["failed"] += 1
+            print(f"❌ Agreement reminder {reminder_id} failed: {e}")
+            try:
+                retry_at = await run_in_threadpool(self._retry_later, reminder_id)
+            except Exception as retry_error:
+                print(f"⚠️ Could not reschedule agreement reminder {reminder_id}: {retry_error}")
+                return
+            if retry_at is not None:
+                self._push([(reminder_id, retry_at)])
+            return
+        if sent is None:
+            self.metrics["superseded"] += 1  # sent by another process or replanned
+            return
+        self.metrics["sent" if sent else "skipped"] += 1
+        if sent:
+            with session_scope() as db:
+                await push_proactive_batch(db, sent)
+
+    @staticmethod
+    def _send(reminder_id: int):
+        """Claim the reminder and save its message; None if it was not ours to send."""
+        from app.services.proactive_service import send_agreement_reminder
+
+        with session_scope() as db:
+            reminder = crud.agreement.claim_reminder(db, reminder_id)
+            if reminder is None:
+                return None
+            return send_agreement_reminder(db, reminder)
+
+    @staticmethod
+    def _retry_later(reminder_id: int) -> Optional[datetime]:
+        """Undo the claim of a reminder that failed to send; None if its window is over by the retry."""
+        retry_at = datetime.utcnow() + FAILURE_RETRY
+        with session_scope() as db:
+            reminder = crud.agreement.get_reminder(db, reminder_id)
+            agreement = crud.agreement.get_agreement(db, reminder.agreement_id) if reminder else None
+            if agreement is None:
+                return None
+            latest = latest_fire_at(reminder.kind, agreement.deadline)
+            if latest is not None and retry_at > latest:
+                print(f"⏭️ {reminder.kind} reminder {reminder_id} dropped: its window ends before a retry")
+                return None
+            crud.agreement.defer_reminder(db, reminder_id, retry_at)
+        return retry_at
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "queued": len(self._heap),
+            "next_at": self._heap[0][0].isoformat() if self._heap else None,
+            **self.metrics,
+        }
+
+
+deadline_scheduler = DeadlineScheduler()
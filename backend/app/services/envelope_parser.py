@@ -0,0 +1,318 @@
+"""
+Incremental parser for the coach response envelope:
+
+    {"message": "...", "actions": [{"type": "...", "data": {...}}, ...]}
+
+Single pass over the text, resumable across chunks, so it can be fed a
+streamed completion as it arrives. It is deliberately lenient where LLMs are
+sloppy (raw newlines/tabs inside strings, text or ```json fences before the
+object, trailing commas) and precise where they are wrong: errors carry the
+exact character position, line and column.
+
+While parsing it emits events:
+- ("message_delta", text)  — new decoded characters of the top-level "message"
+- ("message", text)        — the complete message once its string closes
+- ("action", dict)         — each element of "actions" (or a single "action") as it closes
+- ("end", dict)            — the whole envelope
+"""
+import json
+import re
+from typing import Any, Dict, List, NamedTuple, Optional
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_STRING_SPECIAL = re.compile(r'["\\]')
+_LITERAL_CHARS = set("0123456789+-.eEtruefalsn")
+_WHITESPACE = set(" \t\r\n")
+
+
+class EnvelopeParseError(ValueError):
+    """Raised when the response cannot be parsed; carries the exact error position."""
+
+    def __init__(self, reason: str, position: int, text: str):
+        self.reason = reason
+        self.position = position
+        self.line = text.count("\n", 0, position) + 1
+        self.column = position - (text.rfind("\n", 0, position) + 1) + 1
+        super().__init__(f"{reason} at line {self.line} column {self.column} (char {position})")
+
+
+class EnvelopeEvent(NamedTuple):
+    kind: str
+    value: Any
+
+
+class _Frame:
+    __slots__ = ("kind", "value", "state", "key")
+
+    def __init__(self, kind: str):
+        self.kind = kind            # "object" | "array"
+        self.value = {} if kind == "object" else []
+        self.state = "first"        # object: first/key/colon/value/next; array: first/value/next
+        self.key: Optional[str] = None
+
+
+class EnvelopeParser:
+    """Feed chunks with feed(); call close() at the end to get the envelope dict."""
+
+    def __init__(self):
+        self._chunks: List[str] = []
+        self._offset = 0                 # absolute position of the current chunk
+        self._stack: List[_Frame] = []
+        self._started = False            # seen the opening "{"
+        self._result: Optional[Dict[str, Any]] = None
+        self._events: List[EnvelopeEvent] = []
+        # In-progress string
+        self._string: Optional[List[str]] = None
+        self._string_is_key = False
+        self._string_streams_message = False
+        self._escape: Optional[str] = None   # pending escape text, e.g. "\\" or "\\u00"
+        self._high_surrogate: Optional[int] = None
+        # In-progress literal (number / true / false / null)
+        self._literal: Optional[List[str]] = None
+        self._literal_start = 0
+
+    @property
+    def finished(self) -> bool:
+        return self._result is not None
+
+    def feed(self, chunk: str) -> List[EnvelopeEvent]:
+        """Consume a chunk and return the events it completed."""
+        if not chunk:
+            return []
+        self._chunks.append(chunk)
+        if self._result is None:
+            self._consume(chunk)
+        self._offset += len(chunk)
+        events, self._events = self._events, []
+        return events
+
+    def close(self) -> Dict[str, Any]:
+        """Finish parsing and return the envelope, or raise EnvelopeParseError."""
+        end = self._offset
+        if self._literal is not None and self._result is None:
+            self._finish_literal(end)
+        if self._result is None:
+            reason = "No JSON object found" if not self._started else "Unexpected end of response"
+            raise EnvelopeParseError(reason, end, self._text())
+        return self._result
+
+    # -- internals ---------------------------------------------------------
+
+    def _text(self) -> str:
+        return "".join(self._chunks)
+
+    def _error(self, reason: str, position: int) -> EnvelopeParseError:
+        return EnvelopeParseError(reason, position, self._text())
+
+    def _consume(self, chunk: str):
+        i = 0
+        n = len(chunk)
+        while i < n and self._result is None:
+            if self._string is not None:
+                i = self._consume_string(chunk, i)
+                continue
+
+            char = chunk[i]
+            if self._literal is not None:
+                if char in _LITERAL_CHARS:
+                    self._literal.append(char)
+                    i += 1
+                    continue
+                self._finish_literal(self._offset + i)
+                continue
+
+            if not self._started:
+                start = chunk.find("{", i)
+                if start == -1:
+                    return
+                self._started = True
+                self._stack.append(_Frame("object"))
+                i = start + 1
+                continue
+
+            if char in _WHITESPACE:
+                i += 1
+                continue
+            self._structural(char, self._offset + i)
+            i += 1
+
+    def _structural(self, char: str, position: int):
+        frame = self._stack[-1]
+        if frame.kind == "object":
+            if frame.state in ("first", "key"):
+                if char == '"':
+                    self._start_string(is_key=True)
+                elif char == "}":
+                    self._pop()
+                else:
+                    raise self._error(f"Expected property name, got {char!r}", position)
+            elif frame.state == "colon":
+                if char != ":":
+                    raise self._error(f"Expected ':' after key {frame.key!r}, got {char!r}", position)
+                frame.state = "value"
+            elif frame.state == "value":
+                self._start_value(char, position)
+            else:  # next
+                if char == ",":
+                    frame.state = "key"
+                elif char == "}":
+                    self._pop()
+                else:
+                    raise self._error(f"Expected ',' or '}}', got {char!r}", position)
+        else:
+            if frame.state in ("first", "value"):
+                if char == "]":
+                    self._pop()
+                else:
+                    self._start_value(char, position)
+            else:  # next
+                if char == ",":
+                    frame.state = "value"
+                elif char == "]":
+                    self._pop()
+                else:
+                    raise self._error(f"Expected ',' or ']', got {char!r}", position)
+
+    def _start_value(self, char: str, position: int):
+        if char == '"':
+            self._start_string(is_key=False)
+        elif char == "{":
+            self._stack.append(_Frame("object"))
+        elif char == "[":
+            self._stack.append(_Frame("array"))
+        elif char in _LITERAL_CHARS:
+            self._literal = [char]
+            self._literal_start = position
+        else:
+            raise self._error(f"Unexpected character {char!r}", position)
+
+    def _pop(self):
+        frame = self._stack.pop()
+        self._complete_value(frame.value)
+
+    def _complete_value(self, value: Any):
+        if not self._stack:
+            self._result = value
+            self._events.append(EnvelopeEvent("end", value))
+            return
+        frame = self._stack[-1]
+        if frame.kind == "object":
+            frame.value[frame.key] = value
+            frame.state = "next"
+            if len(self._stack) == 1:
+                if frame.key == "message" and isinstance(value, str):
+                    self._events.append(EnvelopeEvent("message", value))
+                elif frame.key == "action" and isinstance(value, dict):
+                    self._events.append(EnvelopeEvent("action", value))
+        else:
+            frame.value.append(value)
+            frame.state = "next"
+            if len(self._stack) == 2 and self._stack[0].key == "actions" and isinstance(value, dict):
+                self._events.append(EnvelopeEvent("action", value))
+
+    def _finish_literal(self, position: int):
+        token = "".join(self._literal)
+        self._literal = None
+        try:
+            value = json.loads(token)
+        except ValueError:
+            raise self._error(f"Invalid literal {token!r}", self._literal_start)
+        self._complete_value(value)
+
+    # -- strings -----------------------------------------------------------
+
+    def _start_string(self, is_key: bool):
+        self._string = []
+        self._string_is_key = is_key
+        self._string_streams_message = (
+            not is_key and len(self._stack) == 1 and self._stack[0].key == "message"
+        )
+
+    def _emit_text(self, text: str):
+        if not text:
+            return
+        self._string.append(text)
+        if self._string_streams_message:
+            if self._events and self._events[-1].kind == "message_delta":
+                self._events[-1] = EnvelopeEvent("message_delta", self._events[-1].value + text)
+            else:
+                self._events.append(EnvelopeEvent("message_delta", text))
+
+    def _consume_string(self, chunk: str, i: int) -> int:
+        n = len(chunk)
+        while i < n:
+            if self._escape is not None:
+                i = self._consume_escape(chunk, i)
+                continue
+            match = _STRING_SPECIAL.search(chunk, i)
+            end = match.start() if match else n
+            if end > i:
+                # Raw newlines / control characters are tolerated as-is.
+                self._flush_surrogate()
+                self._emit_text(chunk[i:end])
+            if not match:
+                return n
+            if chunk[end] == "\\":
+                self._escape = "\\"
+                i = end + 1
+                continue
+            # Closing quote
+            self._flush_surrogate()
+            value = "".join(self._string)
+            self._string = None
+            if self._string_is_key:
+                frame = self._stack[-1]
+                frame.key = value
+                frame.state = "colon"
+            else:
+                self._complete_value(value)
+            return end + 1
+        return i
+
+    def _consume_escape(self, chunk: str, i: int) -> int:
+        if self._escape == "\\":
+            char = chunk[i]
+            if char == "u":
+                self._escape = "\\u"
+                return i + 1
+            self._escape = None
+            self._flush_surrogate()
+            # Unknown escapes keep the character (lenient, like most LLM-output repairers).
+            self._emit_text(_ESCAPES.get(char, char))
+            return i + 1
+        # Collecting \uXXXX
+        need = 6 - len(self._escape)
+        take = chunk[i:i + need]
+        self._escape += take
+        i += len(take)
+        if len(self._escape) < 6:
+            return i
+        hex_digits = self._escape[2:]
+        self._escape = None
+        try:
+            code = int(hex_digits, 16)
+        except ValueError:
+            raise self._error(f"Invalid unicode escape \\u{hex_digits}", self._offset + i - 6)
+        if 0xD800 <= code <= 0xDBFF:
+            self._flush_surrogate()
+            self._high_surrogate = code
+        elif 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+            combined = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+            self._high_surrogate = None
+            self._emit_text(chr(combined))
+        else:
+            self._flush_surrogate()
+            self._emit_text(chr(code))
+        return i
+
+    def _flush_surrogate(self):
+        if self._high_surrogate is not None:
+            code, self._high_surrogate = self._high_surrogate, None
+            self._emit_text(chr(code))
+
+
+def parse_envelope(text: str) -> Dict[str, Any]:
+    """Parse a complete response in one go (raises EnvelopeParseError)."""
+    parser = EnvelopeParser()
+    parser.feed(text)
+    return parser.close()
@@ -0,0 +1,205 @@
+"""
+Admission control for outbound LLM calls.
+
+- A global concurrency limit shared by every caller. When all slots are busy,
+  requests wait in a bounded priority queue: interactive chat turns are served
+  before normal and background work, and a full queue sheds its lowest-priority
+  waiter to make room for a more important request.
+- Per-provider RPM/TPM token buckets, so we wait (or move on to the next
+  provider) instead of collecting 429s.
+- Every wait is bounded by a deadline; a request that cannot be admitted in
+  time is rejected with LLMOverloadedError.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.services.llm_exceptions import LLMOverloadedError
+
+
+class Priority(IntEnum):
+    """Lower value is served first."""
+    INTERACTIVE = 0  # a user is waiting for this reply
+    NORMAL = 1
+    BACKGROUND = 2   # summaries, proactive work
+
+
+class TokenBucket:
+    """Token bucket with reservations: callers take tokens up front and sleep off any debt."""
+
+    def __init__(self, capacity: float, per_seconds: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def reserve(self, cost: float, max_wait: float) -> Optional[float]:
+        """Reserve `cost` tokens; return the seconds to wait, or None if that exceeds max_wait."""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        cost = min(cost, self.capacity)
+        wait = max(0.0, (cost - self._tokens) / self.rate)
+        if wait > max_wait:
+            return None
+        self._tokens -= cost
+        return wait
+
+    def refund(self, cost: float):
+        self._tokens = min(self.capacity, self._tokens + min(cost, self.capacity))
+
+
+def parse_rate_limits(spec: str) -> Dict[str, Tuple[int, int]]:
+    """Parse "deepseek=60/100000,openrouter=20" into {provider: (rpm, tpm)}; 0 = unlimited."""
+    limits: Dict[str, Tuple[int, int]] = {}
+    for item in (spec or "").split(","):
+        provider, _, values = item.strip().partition("=")
+        if not provider or not values:
+            continue
+        rpm, _, tpm = values.partition("/")
+        try:
+            limits[provider.strip().lower()] = (int(rpm or 0), int(tpm or 0))
+        except ValueError:
+            print(f"⚠️ Invalid LLM_RATE_LIMITS entry ignored: {item.strip()}")
+    return limits
+
+
+def estimate_tokens(messages: List[Dict[str, str]], max_tokens: int) -> int:
+    """Rough prompt + completion token count (~4 characters per token)."""
+    prompt_chars = sum(len(m.get("content") or "") for m in messages)
+    return prompt_chars // 4 + max_tokens
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queue: int,
+        queue_timeouts: Dict[Priority, float],
+        rate_limits: Optional[Dict[str, Tuple[int, int]]] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeouts = queue_timeouts
+        self._in_flight = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._buckets: Dict[str, Tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {
+            provider: (TokenBucket(rpm) if rpm else None, TokenBucket(tpm) if tpm else None)
+            for provider, (rpm, tpm) in (rate_limits or {}).items()
+        }
+        self.metrics: Counter = Counter()
+
+    def deadline_for(self, priority: Priority) -> float:
+        return time.monotonic() + self.queue_timeouts.get(priority, 30.0)
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority, deadline: float) -> AsyncIterator[None]:
+        """Hold one of the global concurrency slots for the duration of the block."""
+        await self._acquire(priority, deadline)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def try_acquire(self) -> bool:
+        """Take a free slot without queueing (for optional extra work such as hedges); pair with release()."""
+        if self._in_flight < self.max_concurrency and not self._waiters:
+            self._in_flight += 1
+            self.metrics["admitted"] += 1
+            return True
+        return False
+
+    def release(self):
+        self._release()
+
+    async def _acquire(self, priority: Priority, deadline: float):
+        if self._in_flight < self.max_concurrency and not self._waiters:
+            self._in_flight += 1
+            self.metrics["admitted"] += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            worst = max(self._waiters)  # lowest priority, most recent
+            if worst[0] <= priority:
+                self.metrics["rejected_queue_full"] += 1
+                raise LLMOverloadedError("LLM request queue is full")
+            self._waiters.remove(worst)
+            heapq.heapify(self._waiters)
+            if not worst[2].done():
+                worst[2].set_exception(LLMOverloadedError("pre-empted by a higher-priority request"))
+            self.metrics["shed_preempted"] += 1
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (int(priority), next(self._seq), future)
+        heapq.heappush(self._waiters, entry)
+        self.metrics["enqueued"] += 1
+        try:
+            await asyncio.wait_for(future, timeout=max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self._give_back(entry)
+            self.metrics["shed_deadline"] += 1
+            raise LLMOverloadedError("deadline exceeded while queued")
+        except asyncio.CancelledError:
+            self._give_back(entry)
+            raise
+        self.metrics["admitted"] += 1
+
+    def _release(self):
+        # Hand the slot straight to the best waiter so nobody can barge in.
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._in_flight -= 1
+
+    def _give_back(self, entry):
+        """Leave the queue after a timeout/cancel; pass on a slot handed over just before it."""
+        future = entry[2]
+        if future.done() and not future.cancelled() and future.exception() is None:
+            self._release()
+        else:
+            self._discard(entry)
+
+    def _discard(self, entry):
+        if entry in self._waiters:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+
+    async def reserve_provider(self, provider: str, tokens: int, deadline: float):
+        """Wait for the provider's RPM/TPM budget; raise LLMOverloadedError if it would miss the deadline."""
+        rpm_bucket, tpm_bucket = self._buckets.get(provider, (None, None))
+        if rpm_bucket is None and tpm_bucket is None:
+            return
+        max_wait = max(0.0, deadline - time.monotonic())
+        waits = []
+        reserved = []
+        for bucket, cost in ((rpm_bucket, 1), (tpm_bucket, tokens)):
+            if bucket is None:
+                continue
+            wait = bucket.reserve(cost, max_wait)
+            if wait is None:
+                for taken, taken_cost in reserved:
+                    taken.refund(taken_cost)
+                self.metrics["rate_limited"] += 1
+                raise LLMOverloadedError(f"{provider} rate limit would be exceeded")
+            reserved.append((bucket, cost))
+            waits.append(wait)
+        wait = max(waits)
+        if wait > 0:
+            self.metrics["rate_limit_waits"] += 1
+            await asyncio.sleep(wait)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self._in_flight,
+            "queued": len(self._waiters),
+            "max_concurrency": self.max_concurrency,
+            **self.metrics,
+        }
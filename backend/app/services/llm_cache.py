@@ -0,0 +1,148 @@
+"""
+Exact-match cache for LLM completions.
+
+Entries are content-addressed: the key is a SHA-256 over provider, model, the
+normalized messages, temperature, max_tokens and JSON mode, so only a
+byte-for-byte identical request (modulo whitespace) can hit. Only
+low-temperature calls are cached (see LLM_CACHE_MAX_TEMPERATURE) — at higher
+temperatures callers expect variety.
+
+Backends: in-process LRU (default) and SQLite (survives restarts). Backends
+with `blocking = True` do I/O and are called from the threadpool.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+def request_fingerprint(
+    messages: List[Dict[str, str]],
+    temperature: float,
+    max_tokens: int,
+    json_mode: bool,
+) -> str:
+    """Provider-independent part of the cache key."""
+    normalized = [
+        [(m.get("role") or "").strip().lower(), " ".join((m.get("content") or "").split())]
+        for m in messages
+    ]
+    payload = json.dumps(
+        [normalized, round(float(temperature), 3), int(max_tokens), bool(json_mode)],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def cache_key(fingerprint: str, provider: str, model: str) -> str:
+    return hashlib.sha256(f"{provider}\x00{model}\x00{fingerprint}".encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """LRU dict with per-entry expiry; bounded by entry count."""
+
+    name = "memory"
+    blocking = False
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str, ttl: float):
+        self._entries[key] = (value, time.time() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """SQLite file cache (stdlib sqlite3), LRU-evicted by last access time."""
+
+    name = "sqlite"
+    blocking = True  # disk I/O: callers on the event loop go through the threadpool
+
+    def __init__(self, path: str, max_entries: int = 1000):
+        self.max_entries = max_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed_at ON llm_cache (accessed_at)")
+        self._conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),))
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, value: str, ttl: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now),
+            )
+            excess = self._count() - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN "
+                    "(SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?)",
+                    (excess,),
+                )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._count()
+
+    def _count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+
+def create_cache_backend(kind: str, path: str, max_entries: int):
+    """Backend for LLM_CACHE_BACKEND: "memory", "sqlite" or "none" (returns None)."""
+    kind = (kind or "").strip().lower()
+    if kind in ("", "none", "off"):
+        return None
+    if kind == "sqlite":
+        try:
+            return SQLiteCacheBackend(path, max_entries)
+        except Exception as e:
+            print(f"⚠️ LLM cache: SQLite backend unavailable ({e}), using in-memory cache")
+    elif kind != "memory":
+        print(f"⚠️ Unknown LLM_CACHE_BACKEND '{kind}', using in-memory cache")
+    return MemoryCacheBackend(max_entries)
@@ -0,0 +1,38 @@
+from typing import List, Optional
+
+
+class LLMError(Exception):
+    """Base exception for LLM provider errors."""
+
+
+class LLMConfigError(LLMError):
+    """Raised when a provider is not usable as configured (missing API key, unknown provider)."""
+
+
+class LLMProviderError(LLMError):
+    """Raised when a provider call fails (network error, timeout, HTTP error, empty reply)."""
+
+    def __init__(self, provider: str, message: str, status_code: Optional[int] = None):
+        self.provider = provider
+        self.status_code = status_code
+        super().__init__(f"{provider}: {message}")
+
+
+class LLMAuthError(LLMProviderError):
+    """Raised when a provider rejects our credentials (HTTP 401/403)."""
+
+
+class LLMUnavailableError(LLMError):
+    """Raised when every provider in the chain failed or is short-circuited."""
+
+    def __init__(self, errors: List[str]):
+        self.errors = errors
+        super().__init__("All LLM providers failed: " + "; ".join(errors or ["no providers configured"]))
+
+
+class LLMOverloadedError(LLMUnavailableError):
+    """Raised when a request is shed by admission control (queue full or deadline exceeded)."""
+
+    def __init__(self, reason: str):
+        self.errors = [reason]
+        LLMError.__init__(self, f"LLM request shed: {reason}")
@@ -4,8 +4,56 @@ Supports multiple providers: Ollama (local), Groq, Hugging Face, Together AI, Op
 """
 import os
 import json
-from typing import List, Dict, Optional
+import time
+import asyncio
+import importlib.util
+from collections import Counter, deque
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Iterator, List, Dict, Optional, Tuple
+import httpx
+from fastapi.concurrency import run_in_threadpool
 from app.core.config import settings
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.llm_admission import AdmissionController, Priority, estimate_tokens, parse_rate_limits
+from app.services.llm_cache import cache_key, create_cache_backend, request_fingerprint
+from app.services.llm_exceptions import (
+    LLMError,
+    LLMConfigError,
+    LLMProviderError,
+    LLMAuthError,
+    LLMOverloadedError,
+    LLMUnavailableError,
+)
+
+# Chat-completions endpoints of the OpenAI-compatible providers (used for streaming).
+OPENAI_COMPATIBLE_URLS = {
+    "groq": "https://api.groq.com/openai/v1/chat/completions",
+    "together": "https://api.together.xyz/v1/chat/completions",
+    "openai": "https://api.openai.com/v1/chat/completions",
+    "openrouter": "https://openrouter.ai/api/v1/chat/completions",
+    "github": "https://api.github.com/models/chat/completions",
+    "deepseek": "https://api.deepseek.com/v1/chat/completions",
+}
+
+# Model used when neither the caller, LLM_MODEL nor the chain entry picks one.
+PROVIDER_DEFAULT_MODELS = {
+    "ollama": "qwen2.5:7b",
+    "groq": "llama-3.1-8b-instant",
+    "together": "meta-llama/Llama-3-8b-chat-hf",
+    "openai": "gpt-3.5-turbo",
+    "openrouter": "meta-llama/llama-3.1-8b-instruct",
+    "github": "meta-llama/llama-3.1-8b-instruct",
+    "deepseek": "deepseek-chat",
+}
+
+# HTTP/2 needs the optional `h2` package (httpx[http2]); fall back to HTTP/1.1 keep-alive without it.
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+KNOWN_PROVIDERS = ("ollama", "huggingface", *OPENAI_COMPATIBLE_URLS)
+
+# Providers that accept stream_options.include_usage (token usage on streamed calls).
+STREAM_USAGE_PROVIDERS = {"openai", "deepseek", "openrouter"}
+
 
 class LLMService:
     def __init__(self):
@@ -13,59 +61,603 @@ class LLMService:
         self.provider = settings.LLM_PROVIDER or os.getenv("LLM_PROVIDER", "groq")
         self.api_key = settings.LLM_API_KEY or os.getenv("LLM_API_KEY", "")
         self.model = settings.LLM_MODEL or os.getenv("LLM_MODEL", "llama-3.1-8b-instant")
-        
+        # Ordered failover chain of (provider, model override); every call walks it
+        # and skips providers whose circuit breaker is open.
+        self.chain = self._parse_chain(settings.LLM_PROVIDER_CHAIN)
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        # Recent successful call latencies per provider (seconds), for the hedge delay.
+        self._latencies: Dict[str, deque] = {}
+        # Operational counters (hedge_fired, hedge_won, ...), shown by /test-llm.
+        self.metrics: Counter = Counter()
+        # Bounds concurrent outbound calls and queues them by priority.
+        self.admission = AdmissionController(
+            max_concurrency=settings.LLM_MAX_CONCURRENCY,
+            max_queue=settings.LLM_QUEUE_SIZE,
+            queue_timeouts={
+                Priority.INTERACTIVE: settings.LLM_QUEUE_TIMEOUT_INTERACTIVE,
+                Priority.NORMAL: settings.LLM_QUEUE_TIMEOUT_NORMAL,
+                Priority.BACKGROUND: settings.LLM_QUEUE_TIMEOUT_BACKGROUND,
+            },
+            rate_limits=parse_rate_limits(settings.LLM_RATE_LIMITS),
+        )
+        # Exact-match completion cache for low-temperature calls (None = disabled).
+        self.cache = create_cache_backend(
+            settings.LLM_CACHE_BACKEND, settings.LLM_CACHE_PATH, settings.LLM_CACHE_MAX_ENTRIES
+        )
+        # One long-lived connection pool per provider, so chat turns reuse
+        # TCP/TLS connections instead of paying a new handshake every call.
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def _parse_chain(self, chain: str) -> List[Tuple[str, Optional[str]]]:
+        """Parse "deepseek,openrouter,ollama:qwen2.5:7b" into [(provider, model), ...]."""
+        entries: List[Tuple[str, Optional[str]]] = []
+        for item in (chain or "").split(","):
+            provider, _, model = item.strip().partition(":")
+            provider = provider.strip().lower()
+            if not provider:
+                continue
+            if provider not in KNOWN_PROVIDERS:
+                print(f"⚠️ Unknown LLM provider in LLM_PROVIDER_CHAIN ignored: {provider}")
+                continue
+            if any(existing == provider for existing, _ in entries):
+                continue
+            entries.append((provider, model.strip() or None))
+        return entries or [(self.provider, None)]
+
+    async def startup(self):
+        """Open the connection pools for the provider chain (FastAPI startup hook)."""
+        for provider, _ in self.chain:
+            self._get_client(provider)
+        http_version = "HTTP/2" if settings.LLM_HTTP2 and HTTP2_AVAILABLE else "HTTP/1.1"
+        chain = " → ".join(provider for provider, _ in self.chain)
+        print(f"🔌 LLM connection pool ready: {chain} ({http_version}, "
+              f"max {settings.LLM_HTTP_MAX_CONNECTIONS} connections)")
+
+    async def shutdown(self):
+        """Close all provider connection pools (FastAPI shutdown hook)."""
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+    def _get_client(self, provider: str) -> httpx.AsyncClient:
+        """Return the pooled client for a provider, creating it on first use."""
+        client = self._clients.get(provider)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                http2=settings.LLM_HTTP2 and HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(60.0, connect=settings.LLM_HTTP_CONNECT_TIMEOUT),
+            )
+            self._clients[provider] = client
+        return client
+
+    def _breaker(self, provider: str) -> CircuitBreaker:
+        breaker = self._breakers.get(provider)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                f"llm:{provider}",
+                window_size=settings.LLM_BREAKER_WINDOW,
+                min_calls=settings.LLM_BREAKER_MIN_CALLS,
+                failure_rate_threshold=settings.LLM_BREAKER_FAILURE_RATE,
+                open_seconds=settings.LLM_BREAKER_OPEN_SECONDS,
+                half_open_max_calls=settings.LLM_BREAKER_HALF_OPEN_PROBES,
+            )
+            self._breakers[provider] = breaker
+        return breaker
+
+    def _api_key_for(self, provider: str) -> str:
+        """Provider-specific key (e.g. DEEPSEEK_API_KEY); the primary provider falls back to LLM_API_KEY."""
+        key = getattr(settings, f"{provider.upper()}_API_KEY", None)
+        if not key and provider == self.provider:
+            key = self.api_key
+        return (key or "").strip()
+
+    def _resolve_model(self, provider: str, chain_model: Optional[str], model: Optional[str]) -> str:
+        """Caller's model and LLM_MODEL only apply to the primary provider; fallbacks use their own."""
+        if provider == self.provider:
+            if model or chain_model:
+                return model or chain_model
+            if provider in ("ollama", "groq", "huggingface"):
+                return self.model
+        return chain_model or PROVIDER_DEFAULT_MODELS.get(provider, self.model)
+
+    def _candidates(self, errors: List[str]) -> Iterator[Tuple[str, Optional[str], CircuitBreaker]]:
+        """Walk the chain, skipping unconfigured providers and open breakers (reasons go to `errors`)."""
+        for provider, chain_model in self.chain:
+            if provider != "ollama" and not self._api_key_for(provider):
+                errors.append(f"{provider}: API key not configured")
+                continue
+            breaker = self._breaker(provider)
+            if not breaker.allow_request():
+                errors.append(f"{provider}: circuit open")
+                continue
+            yield provider, chain_model, breaker
+
+    def provider_status(self) -> List[Dict[str, Any]]:
+        """Chain order, resolved models and breaker state (for diagnostics endpoints)."""
+        return [
+            {
+                "provider": provider,
+                "model": self._resolve_model(provider, chain_model, None),
+                "configured": provider == "ollama" or bool(self._api_key_for(provider)),
+                **self._breaker(provider).snapshot(),
+            }
+            for provider, chain_model in self.chain
+        ]
+
     async def chat_completion(
         self,
         messages: List[Dict[str, str]],
         model: Optional[str] = None,
         temperature: float = 0.7,
-        max_tokens: int = 500
+        max_tokens: int = 500,
+        hedge: bool = False,
+        priority: Priority = Priority.NORMAL,
+        cache: bool = True,
+        json_mode: Optional[bool] = None
+    ) -> str:
+        """Send messages to LLM and get response.
+
+        Tries each provider of the chain in order and raises LLMUnavailableError
+        when none of them produced a response. With hedge=True (and
+        LLM_HEDGE_ENABLED) a slow first call is raced against a second one.
+        The call first waits for an admission slot according to `priority`
+        and raises LLMOverloadedError if it cannot get one in time.
+        Low-temperature calls are answered from the completion cache when
+        possible (cache=False skips it).
+        json_mode turns the providers' JSON mode on or off; None decides by the
+        system prompt (_wants_json_format).
+        """
+        if json_mode is None:
+            json_mode = self._wants_json_format(messages)
+        fingerprint = self._cache_fingerprint(messages, temperature, max_tokens, cache, json_mode)
+        if fingerprint:
+            cached = await self._cache_lookup(fingerprint, model)
+            if cached is not None:
+                return cached
+        deadline = self.admission.deadline_for(priority)
+        async with self.admission.slot(priority, deadline):
+            errors: List[str] = []
+            candidates = self._candidates(errors)
+            call_args = (messages, model, temperature, max_tokens, deadline, fingerprint, json_mode)
+            if hedge and settings.LLM_HEDGE_ENABLED:
+                content = await self._hedged_completion(candidates, errors, *call_args)
+                if content is not None:
+                    return content
+            for provider, chain_model, breaker in candidates:
+                try:
+                    return await self._attempt(provider, chain_model, breaker, *call_args)
+                except LLMError as e:
+                    errors.append(str(e))
+            print(f"❌ No LLM provider available: {'; '.join(errors)}")
+            raise LLMUnavailableError(errors)
+
+    async def _attempt(
+        self,
+        provider: str,
+        chain_model: Optional[str],
+        breaker: CircuitBreaker,
+        messages: List[Dict[str, str]],
+        model: Optional[str],
+        temperature: float,
+        max_tokens: int,
+        deadline: float,
+        fingerprint: Optional[str] = None,
+        json_mode: Optional[bool] = None
     ) -> str:
-        """Send messages to LLM and get response"""
-        
-        # Check if API key is set (not needed for Ollama)
-        if self.provider != "ollama" and not self.api_key:
-            provider_name = self.provider.upper() if self.provider else "LLM"
-            return (
-                f"{provider_name} сервис не настроен.\n\n"
-                f"Установи LLM_API_KEY в переменных окружения в Render Dashboard.\n"
-                f"Для DeepSeek: получи ключ на https://platform.deepseek.com"
+        """One provider call with rate limiting, breaker bookkeeping, latency tracking and caching."""
+        resolved_model = self._resolve_model(provider, chain_model, model)
+        try:
+            await self.admission.reserve_provider(provider, estimate_tokens(messages, max_tokens), deadline)
+        except BaseException:
+            breaker.release()  # not the provider's fault
+            raise
+        started = time.monotonic()
+        try:
+            content = await self._call_provider(provider, messages, resolved_model, temperature, max_tokens, json_mode)
+        except LLMError as e:
+            breaker.record_failure()
+            print(f"⚠️ LLM provider failed: {e}")
+            raise
+        except BaseException:
+            # Cancelled (e.g. the losing side of a hedge): no verdict on the provider.
+            breaker.release()
+            raise
+        breaker.record_success()
+        self._latencies.setdefault(provider, deque(maxlen=200)).append(time.monotonic() - started)
+        if fingerprint:
+            await self._cache_store(fingerprint, provider, resolved_model, content)
+        return content
+
+    def _cache_fingerprint(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        use_cache: bool,
+        json_mode: bool
+    ) -> Optional[str]:
+        """Request fingerprint if this call may use the cache, else None."""
+        if not use_cache or self.cache is None or temperature > settings.LLM_CACHE_MAX_TEMPERATURE:
+            return None
+        return request_fingerprint(messages, temperature, max_tokens, json_mode)
+
+    async def _cache_call(self, method, *args):
+        """Run a cache backend method, off the event loop if the backend blocks (SQLite)."""
+        if getattr(self.cache, "blocking", False):
+            return await run_in_threadpool(method, *args)
+        return method(*args)
+
+    async def _cache_lookup(self, fingerprint: str, model: Optional[str]) -> Optional[str]:
+        """Any chain provider's cached answer to this request (in chain order)."""
+        for provider, chain_model in self.chain:
+            resolved_model = self._resolve_model(provider, chain_model, model)
+            try:
+                value = await self._cache_call(self.cache.get, cache_key(fingerprint, provider, resolved_model))
+            except Exception as e:
+                print(f"⚠️ LLM cache read failed: {e}")
+                return None
+            if value is not None:
+                self.metrics["cache_hits"] += 1
+                return value
+        self.metrics["cache_misses"] += 1
+        return None
+
+    async def _cache_store(self, fingerprint: str, provider: str, model: str, content: str):
+        try:
+            await self._cache_call(
+                self.cache.set, cache_key(fingerprint, provider, model), content, settings.LLM_CACHE_TTL
             )
-        
+            self.metrics["cache_stores"] += 1
+        except Exception as e:
+            print(f"⚠️ LLM cache write failed: {e}")
+
+    def _hedge_delay(self, provider: str) -> float:
+        """Seconds to wait before hedging: the LLM_HEDGE_PERCENTILE of recent latencies."""
+        samples = self._latencies.get(provider)
+        if not samples or len(samples) < settings.LLM_HEDGE_MIN_SAMPLES:
+            return settings.LLM_HEDGE_DEFAULT_DELAY
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * settings.LLM_HEDGE_PERCENTILE))
+        return max(settings.LLM_HEDGE_MIN_DELAY, ordered[index])
+
+    async def _hedged_completion(
+        self,
+        candidates: Iterator[Tuple[str, Optional[str], CircuitBreaker]],
+        errors: List[str],
+        messages: List[Dict[str, str]],
+        model: Optional[str],
+        temperature: float,
+        max_tokens: int,
+        deadline: float,
+        fingerprint: Optional[str],
+        json_mode: Optional[bool] = None
+    ) -> Optional[str]:
+        """Race the first candidate against a delayed backup request.
+
+        The backup goes to the next provider of the chain, or to the same one
+        when it is alone. It runs in an admission slot of its own, so
+        LLM_MAX_CONCURRENCY still bounds the requests actually in flight; when
+        no slot is free right away the hedge is skipped rather than queued.
+        The delay is measured on whole responses, not on time to first byte:
+        these calls are not streamed, and latencies are recorded per completion.
+        Returns None when both sides failed; the caller then carries on with
+        the remaining candidates.
+        """
+        primary = next(candidates, None)
+        if primary is None:
+            return None
+        call_args = (messages, model, temperature, max_tokens, deadline, fingerprint, json_mode)
+        primary_task = asyncio.create_task(self._attempt(*primary, *call_args))
+        tasks = {primary_task}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self._hedge_delay(primary[0]))
+            if not done and not self.admission.try_acquire():
+                self.metrics["hedge_skipped"] += 1
+            elif not done:
+                backup = next(candidates, None)
+                if backup is None and primary[2].allow_request():
+                    backup = primary
+                if backup is None:
+                    self.admission.release()
+                else:
+                    self.metrics["hedge_fired"] += 1
+                    print(f"⏱️ Hedging slow {primary[0]} request with {backup[0]}")
+                    backup_task = asyncio.create_task(self._attempt(*backup, *call_args))
+                    # Frees the backup's slot however the task ends (even if cancelled before it ran).
+                    backup_task.add_done_callback(lambda _: self.admission.release())
+                    tasks.add(backup_task)
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        content = task.result()
+                    except LLMError as e:
+                        errors.append(str(e))
+                        continue
+                    if task is not primary_task:
+                        self.metrics["hedge_won"] += 1
+                    return content
+            return None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _call_provider(
+        self,
+        provider: str,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        json_mode: Optional[bool] = None
+    ) -> str:
+        """Call a single provider, translating every failure into an LLMProviderError."""
         try:
-            if self.provider == "ollama":
-                return await self._ollama_chat(messages, model or self.model, temperature, max_tokens)
-            elif self.provider == "groq":
-                return await self._groq_chat(messages, model or self.model, temperature, max_tokens)
-            elif self.provider == "huggingface":
-                return await self._huggingface_chat(messages, model or self.model, temperature)
-            elif self.provider == "together":
-                return await self._together_chat(messages, model or "meta-llama/Llama-3-8b-chat-hf", temperature, max_tokens)
-            elif self.provider == "openai":
-                return await self._openai_chat(messages, model or "gpt-3.5-turbo", temperature, max_tokens)
-            elif self.provider == "openrouter":
-                return await self._openrouter_chat(messages, model or "meta-llama/llama-3.1-8b-instruct", temperature, max_tokens)
-            elif self.provider == "github":
-                return await self._github_models_chat(messages, model or "meta-llama/llama-3.1-8b-instruct", temperature, max_tokens)
-            elif self.provider == "deepseek":
-                return await self._deepseek_chat(messages, model or "deepseek-chat", temperature, max_tokens)
+            if provider == "ollama":
+                content = await self._ollama_chat(messages, model, temperature, max_tokens, json_mode)
+            elif provider == "groq":
+                content = await self._groq_chat(messages, model, temperature, max_tokens)
+            elif provider == "huggingface":
+                content = await self._huggingface_chat(messages, model, temperature)
+            elif provider == "together":
+                content = await self._together_chat(messages, model, temperature, max_tokens)
+            elif provider == "openai":
+                content = await self._openai_chat(messages, model, temperature, max_tokens)
+            elif provider == "openrouter":
+                content = await self._openrouter_chat(messages, model, temperature, max_tokens)
+            elif provider == "github":
+                content = await self._github_models_chat(messages, model, temperature, max_tokens)
+            elif provider == "deepseek":
+                content = await self._deepseek_chat(messages, model, temperature, max_tokens, json_mode)
             else:
-                raise ValueError(f"Unknown LLM provider: {self.provider}")
+                raise LLMConfigError(f"Unknown LLM provider: {provider}")
+        except LLMError:
+            raise
         except Exception as e:
-            print(f"LLM service error: {e}")
-            return "I'm having trouble connecting to the AI service. Please check your API key configuration."
+            raise self._provider_error(provider, e) from e
+        if not content:
+            raise LLMProviderError(provider, "empty response")
+        return content
+
+    @staticmethod
+    def _provider_error(provider: str, exc: Exception) -> LLMProviderError:
+        """Translate an httpx/parsing exception into a short typed error."""
+        if isinstance(exc, LLMProviderError):
+            return exc
+        if isinstance(exc, httpx.HTTPStatusError):
+            status = exc.response.status_code
+            error_class = LLMAuthError if status in (401, 403) else LLMProviderError
+            return error_class(provider, f"HTTP {status}", status_code=status)
+        if isinstance(exc, httpx.TimeoutException):
+            return LLMProviderError(provider, f"timeout ({type(exc).__name__})")
+        return LLMProviderError(provider, str(exc) or type(exc).__name__)
+
+    async def chat_completion_stream(
+        self,
+        messages: List[Dict[str, str]],
+        model: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: int = 500,
+        priority: Priority = Priority.INTERACTIVE,
+        cache: bool = True
+    ) -> AsyncIterator[str]:
+        """Stream the completion as text deltas.
+
+        Ollama and the OpenAI-compatible providers stream token by token; any other
+        provider yields the whole non-streamed response as a single chunk. Fails over
+        to the next provider only until the first chunk was yielded; a stream that
+        breaks later raises LLMProviderError. Raises LLMUnavailableError if no
+        provider produced anything. The admission slot is held for the whole stream.
+        A cache hit is yielded as a single chunk.
+        """
+        fingerprint = self._cache_fingerprint(
+            messages, temperature, max_tokens, cache, self._wants_json_format(messages)
+        )
+        if fingerprint:
+            cached = await self._cache_lookup(fingerprint, model)
+            if cached is not None:
+                yield cached
+                return
+        deadline = self.admission.deadline_for(priority)
+        async with self.admission.slot(priority, deadline):
+            errors: List[str] = []
+            for provider, chain_model, breaker in self._candidates(errors):
+                if provider not in OPENAI_COMPATIBLE_URLS and provider != "ollama":
+                    try:
+                        content = await self._attempt(
+                            provider, chain_model, breaker, messages, model, temperature, max_tokens,
+                            deadline, fingerprint
+                        )
+                    except LLMError as e:
+                        errors.append(str(e))
+                        continue
+                    yield content
+                    return
+
+                try:
+                    await self.admission.reserve_provider(provider, estimate_tokens(messages, max_tokens), deadline)
+                except LLMOverloadedError as e:
+                    breaker.release()
+                    errors.append(str(e))
+                    continue
+                resolved_model = self._resolve_model(provider, chain_model, model)
+                if provider == "ollama":
+                    stream = self._ollama_stream(messages, resolved_model, temperature, max_tokens)
+                else:
+                    stream = self._openai_compatible_stream(provider, messages, resolved_model, temperature, max_tokens)
+
+                received = []
+                try:
+                    # aclosing: a client that disconnects mid-stream also ends the provider request
+                    async with aclosing(stream):
+                        async for delta in stream:
+                            if delta:
+                                received.append(delta)
+                                yield delta
+                except Exception as e:
+                    breaker.record_failure()
+                    error = self._provider_error(provider, e)
+                    print(f"LLM streaming error: {error}")
+                    if received:
+                        raise LLMProviderError(provider, f"stream interrupted ({error})") from e
+                    errors.append(str(error))
+                    continue
+                except BaseException:
+                    breaker.release()
+                    raise
+                if not received:
+                    breaker.record_failure()
+                    errors.append(f"{provider}: empty response")
+                    continue
+                breaker.record_success()
+                if fingerprint:
+                    await self._cache_store(fingerprint, provider, resolved_model, "".join(received))
+                return
+            print(f"❌ No LLM provider available: {'; '.join(errors)}")
+            raise LLMUnavailableError(errors)
+
+    async def _ollama_stream(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float,
+        max_tokens: int
+    ) -> AsyncIterator[str]:
+        """Ollama streaming: newline-delimited JSON objects with message.content deltas"""
+        ollama_url = os.getenv("OLLAMA_URL", "http://localhost:11434")
+        payload = {
+            "model": model,
+            "messages": messages,
+            "options": {
+                "temperature": temperature,
+                "num_predict": max_tokens
+            },
+            "stream": True
+        }
+        if self._wants_json_format(messages):
+            payload["format"] = "json"
+
+        client = self._get_client("ollama")
+        async with client.stream("POST", f"{ollama_url}/api/chat", json=payload, timeout=120.0) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                content = chunk.get("message", {}).get("content")
+                if content:
+                    yield content
+                if chunk.get("done"):
+                    break
+
+    async def _openai_compatible_stream(
+        self,
+        provider: str,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float,
+        max_tokens: int
+    ) -> AsyncIterator[str]:
+        """OpenAI-style SSE streaming (`data: {...}` lines terminated by `data: [DONE]`)"""
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True
+        }
+        if provider == "deepseek" and self._wants_json_format(messages):
+            payload["response_format"] = {"type": "json_object"}
+        if provider in STREAM_USAGE_PROVIDERS:
+            # Final chunk then carries `usage` (incl. cached prompt tokens)
+            payload["stream_options"] = {"include_usage": True}
+
+        client = self._get_client(provider)
+        async with client.stream(
+            "POST",
+            OPENAI_COMPATIBLE_URLS[provider],
+            headers=self._openai_compatible_headers(provider),
+            json=payload,
+            timeout=60.0,
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                print(f"{provider} streaming error: {response.status_code} {response.text[:200]}")
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if chunk.get("usage"):
+                    self._record_usage(provider, chunk)
+                choices = chunk.get("choices") or []
+                if choices:
+                    content = (choices[0].get("delta") or {}).get("content")
+                    if content:
+                        yield content
+
+    def _record_usage(self, provider: str, data: Dict[str, Any]):
+        """Count prompt / cached prompt / completion tokens reported by the provider.
+
+        Cached prompt tokens: DeepSeek reports `prompt_cache_hit_tokens`, OpenAI-style
+        APIs `prompt_tokens_details.cached_tokens`.
+        """
+        usage = data.get("usage") if isinstance(data, dict) else None
+        if not isinstance(usage, dict):
+            return
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+        cached_tokens = usage.get("prompt_cache_hit_tokens")
+        if cached_tokens is None:
+            cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+        cached_tokens = cached_tokens or 0
+        self.metrics["prompt_tokens"] += prompt_tokens
+        self.metrics["cached_prompt_tokens"] += cached_tokens
+        self.metrics["completion_tokens"] += completion_tokens
+        self.metrics[f"{provider}.prompt_tokens"] += prompt_tokens
+        self.metrics[f"{provider}.cached_prompt_tokens"] += cached_tokens
+        print(f"🧮 {provider} usage: prompt {prompt_tokens} (cached {cached_tokens}), completion {completion_tokens}")
+
+    def _openai_compatible_headers(self, provider: str) -> Dict[str, str]:
+        headers = {
+            "Authorization": f"Bearer {self._api_key_for(provider)}",
+            "Content-Type": "application/json"
+        }
+        if provider == "openrouter":
+            headers["HTTP-Referer"] = "https://github.com/ai-goal-tracker"
+            headers["X-Title"] = "AI Goal Tracker"
+        elif provider == "github":
+            headers["Accept"] = "application/vnd.github+json"
+        return headers
+
+    @staticmethod
+    def _wants_json_format(messages: List[Dict[str, str]]) -> bool:
+        """JSON mode is requested when the system prompt describes a structured format."""
+        for msg in messages:
+            if msg.get("role") == "system":
+                content_upper = msg.get("content", "").upper()
+                if any(keyword in content_upper for keyword in ["JSON", "ФОРМАТ", "ACTIONS", "CHECKLIST"]):
+                    return True
+        return False
     
     async def _ollama_chat(
         self,
         messages: List[Dict[str, str]],
         model: str,
         temperature: float,
-        max_tokens: int
+        max_tokens: int,
+        json_mode: Optional[bool] = None
     ) -> str:
         """Ollama local LLM integration"""
         try:
-            import httpx
-            
             # Ollama runs locally on port 11434
             ollama_url = os.getenv("OLLAMA_URL", "http://localhost:11434")
             url = f"{ollama_url}/api/chat"
@@ -76,8 +668,9 @@ class LLMService:
             
             # Check if we need JSON format (for structured responses)
             # Always use JSON format if system prompt mentions JSON, actions, or structured format
-            use_json_format = False
-            for msg in messages:
+            # (unless the caller decided with json_mode)
+            use_json_format = bool(json_mode)
+            for msg in messages if json_mode is None else ():
                 content = msg.get("content", "")
                 role = msg.get("role", "")
                 content_upper = content.upper()
@@ -107,22 +700,23 @@ class LLMService:
                 payload["format"] = "json"
                 print(f"📋 Using JSON format for structured response")
             
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(url, headers=headers, json=payload)
-                response.raise_for_status()
-                data = response.json()
-                content = data.get("message", {}).get("content", "")
-                if isinstance(content, dict):
-                    import json
-                    content = json.dumps(content)
-                return str(content) if content else "I'm sorry, I didn't get a response."
+            client = self._get_client("ollama")
+            response = await client.post(url, headers=headers, json=payload, timeout=120.0)
+            response.raise_for_status()
+            data = response.json()
+            content = data.get("message", {}).get("content", "")
+            if isinstance(content, dict):
+                import json
+                content = json.dumps(content)
+            return str(content) if content else ""
         except httpx.ConnectError:
-            return "Ollama is not running. Please start Ollama with: ollama serve"
+            print("Ollama is not running. Please start Ollama with: ollama serve")
+            raise
         except Exception as e:
             print(f"Ollama API error: {e}")
             import traceback
             print(traceback.format_exc())
-            return f"I'm having trouble connecting to Ollama. Error: {str(e)}"
+            raise
     
     async def _groq_chat(
         self,
@@ -133,11 +727,9 @@ class LLMService:
     ) -> str:
         """Groq API integration"""
         try:
-            import httpx
-            
             url = "https://api.groq.com/openai/v1/chat/completions"
             headers = {
-                "Authorization": f"Bearer {self.api_key}",
+                "Authorization": f"Bearer {self._api_key_for('groq')}",
                 "Content-Type": "application/json"
             }
             
@@ -148,21 +740,22 @@ class LLMService:
                 "max_tokens": max_tokens
             }
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(url, headers=headers, json=payload)
-                response.raise_for_status()
-                data = response.json()
-                content = data["choices"][0]["message"]["content"]
-                # Ensure content is a string, not an object
-                if isinstance(content, dict):
-                    import json
-                    content = json.dumps(content)
-                return str(content) if content else "I'm sorry, I didn't get a response."
+            client = self._get_client("groq")
+            response = await client.post(url, headers=headers, json=payload, timeout=30.0)
+            response.raise_for_status()
+            data = response.json()
+            self._record_usage("groq", data)
+            content = data["choices"][0]["message"]["content"]
+            # Ensure content is a string, not an object
+            if isinstance(content, dict):
+                import json
+                content = json.dumps(content)
+            return str(content) if content else ""
         except Exception as e:
             print(f"Groq API error: {e}")
             import traceback
             print(traceback.format_exc())
-            return "I'm having trouble connecting to the AI service. Please try again later."
+            raise
     
     async def _huggingface_chat(
         self,
@@ -172,12 +765,10 @@ class LLMService:
     ) -> str:
         """Hugging Face Inference API integration"""
         try:
-            import httpx
-            
             # Try TGI API first, fallback to router if needed
             url = f"https://api-inference.huggingface.co/models/{model}"
             headers = {
-                "Authorization": f"Bearer {self.api_key}",
+                "Authorization": f"Bearer {self._api_key_for('huggingface')}",
                 "Content-Type": "application/json"
             }
             
@@ -207,49 +798,49 @@ class LLMService:
                 }
             }
             
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(url, headers=headers, json=payload)
+            client = self._get_client("huggingface")
+            response = await client.post(url, headers=headers, json=payload, timeout=60.0)
                 
-                # If old API returns 410, the model might not be available via inference API
-                # Try using a simpler model or inform user
-                if response.status_code == 410:
-                    raise Exception(f"Model {model} is not available via Inference API. Please use a model that supports Inference API or switch to Together AI.")
+            # If old API returns 410, the model might not be available via inference API
+            # Try using a simpler model or inform user
+            if response.status_code == 410:
+                raise Exception(f"Model {model} is not available via Inference API. Please use a model that supports Inference API or switch to Together AI.")
                 
-                # Handle loading state (model might be starting)
-                if response.status_code == 503:
-                    error_data = response.json()
-                    if "estimated_time" in error_data:
-                        wait_time = min(error_data.get("estimated_time", 10), 20)
-                        import asyncio
-                        await asyncio.sleep(wait_time)
-                        response = await client.post(url, headers=headers, json=payload)
-                    else:
-                        import asyncio
-                        await asyncio.sleep(10)
-                        response = await client.post(url, headers=headers, json=payload)
+            # Handle loading state (model might be starting)
+            if response.status_code == 503:
+                error_data = response.json()
+                if "estimated_time" in error_data:
+                    wait_time = min(error_data.get("estimated_time", 10), 20)
+                    import asyncio
+                    await asyncio.sleep(wait_time)
+                    response = await client.post(url, headers=headers, json=payload, timeout=60.0)
+                else:
+                    import asyncio
+                    await asyncio.sleep(10)
+                    response = await client.post(url, headers=headers, json=payload, timeout=60.0)
                 
-                response.raise_for_status()
-                data = response.json()
+            response.raise_for_status()
+            data = response.json()
                 
-                # Handle text generation format
-                if isinstance(data, list) and len(data) > 0:
-                    content = data[0].get("generated_text", "")
-                    if isinstance(content, dict):
-                        import json
-                        content = json.dumps(content)
-                    # Clean up response
-                    content = str(content).replace(prompt, "").strip()
-                    content = content.replace("<|im_end|>", "").strip()
-                    content = content.replace("<|end|>", "").strip()
-                    return content if content else "I'm sorry, I didn't get a response."
+            # Handle text generation format
+            if isinstance(data, list) and len(data) > 0:
+                content = data[0].get("generated_text", "")
+                if isinstance(content, dict):
+                    import json
+                    content = json.dumps(content)
+                # Clean up response
+                content = str(content).replace(prompt, "").strip()
+                content = content.replace("<|im_end|>", "").strip()
+                content = content.replace("<|end|>", "").strip()
+                return content if content else ""
                 
-                # Fallback: return raw data
-                return str(data) if data else "I'm sorry, I didn't get a response."
+            # Fallback: return raw data
+            return str(data) if data else ""
         except Exception as e:
             print(f"Hugging Face API error: {e}")
             import traceback
             print(traceback.format_exc())
-            return f"I'm having trouble connecting to the AI service. Error: {str(e)}"
+            raise
     
     async def _together_chat(
         self,
@@ -260,11 +851,9 @@ class LLMService:
     ) -> str:
         """Together AI API integration"""
         try:
-            import httpx
-            
             url = "https://api.together.xyz/v1/chat/completions"
             headers = {
-                "Authorization": f"Bearer {self.api_key}",
+                "Authorization": f"Bearer {self._api_key_for('together')}",
                 "Content-Type": "application/json"
             }
             
@@ -275,20 +864,21 @@ class LLMService:
                 "max_tokens": max_tokens
             }
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(url, headers=headers, json=payload)
-                response.raise_for_status()
-                data = response.json()
-                content = data["choices"][0]["message"]["content"]
-                if isinstance(content, dict):
-                    import json
-                    content = json.dumps(content)
-                return str(content) if content else "I'm sorry, I didn't get a response."
+            client = self._get_client("together")
+            response = await client.post(url, headers=headers, json=payload, timeout=30.0)
+            response.raise_for_status()
+            data = response.json()
+            self._record_usage("together", data)
+            content = data["choices"][0]["message"]["content"]
+            if isinstance(content, dict):
+                import json
+                content = json.dumps(content)
+            return str(content) if content else ""
         except Exception as e:
             print(f"Together AI API error: {e}")
             import traceback
             print(traceback.format_exc())
-            return "I'm having trouble connecting to the AI service. Please try again later."
+            raise
     
     async def _openai_chat(
         self,
@@ -299,11 +889,9 @@ class LLMService:
     ) -> str:
         """OpenAI API integration"""
         try:
-            import httpx
-            
             url = "https://api.openai.com/v1/chat/completions"
             headers = {
-                "Authorization": f"Bearer {self.api_key}",
+                "Authorization": f"Bearer {self._api_key_for('openai')}",
                 "Content-Type": "application/json"
             }
             
@@ -314,20 +902,21 @@ class LLMService:
                 "max_tokens": max_tokens
             }
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(url, headers=headers, json=payload)
-                response.raise_for_status()
-                data = response.json()
-                content = data["choices"][0]["message"]["content"]
-                if isinstance(content, dict):
-                    import json
-                    content = json.dumps(content)
-                return str(content) if content else "I'm sorry, I didn't get a response."
+            client = self._get_client("openai")
+            response = await client.post(url, headers=headers, json=payload, timeout=30.0)
+            response.raise_for_status()
+            data = response.json()
+            self._record_usage("openai", data)
+            content = data["choices"][0]["message"]["content"]
+            if isinstance(content, dict):
+                import json
+                content = json.dumps(content)
+            return str(content) if content else ""
         except Exception as e:
             print(f"OpenAI API error: {e}")
             import traceback
             print(traceback.format_exc())
-            return "I'm having trouble connecting to the AI service. Please try again later."
+            raise
     
     async def _openrouter_chat(
         self,
@@ -338,11 +927,9 @@ class LLMService:
     ) -> str:
         """OpenRouter API integration - supports many free models"""
         try:
-            import httpx
-            
             url = "https://openrouter.ai/api/v1/chat/completions"
             headers = {
-                "Authorization": f"Bearer {self.api_key}",
+                "Authorization": f"Bearer {self._api_key_for('openrouter')}",
                 "Content-Type": "application/json",
                 "HTTP-Referer": "https://github.com/ai-goal-tracker",  # Optional
                 "X-Title": "AI Goal Tracker"  # Optional
@@ -355,30 +942,27 @@ class LLMService:
                 "max_tokens": max_tokens
             }
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(url, headers=headers, json=payload)
+            client = self._get_client("openrouter")
+            response = await client.post(url, headers=headers, json=payload, timeout=30.0)
                 
-                # Log response for debugging
-                if response.status_code != 200:
-                    print(f"OpenRouter API error: {response.status_code}")
-                    print(f"Response: {response.text}")
+            # Log response for debugging
+            if response.status_code != 200:
+                print(f"OpenRouter API error: {response.status_code}")
+                print(f"Response: {response.text}")
                 
-                response.raise_for_status()
-                data = response.json()
-                content = data["choices"][0]["message"]["content"]
-                if isinstance(content, dict):
-                    import json
-                    content = json.dumps(content)
-                return str(content) if content else "I'm sorry, I didn't get a response."
+            response.raise_for_status()
+            data = response.json()
+            self._record_usage("openrouter", data)
+            content = data["choices"][0]["message"]["content"]
+            if isinstance(content, dict):
+                import json
+                content = json.dumps(content)
+            return str(content) if content else ""
         except Exception as e:
             print(f"OpenRouter API error: {e}")
             import traceback
             print(traceback.format_exc())
-            # Return more detailed error message
-            error_msg = str(e)
-            if "401" in error_msg or "No cookie" in error_msg:
-                return "OpenRouter authentication failed. Please check your API key. Make sure you're using the correct key from https://openrouter.ai/keys"
-            return f"I'm having trouble connecting to the AI service. Error: {error_msg}"
+            raise
     
     async def _github_models_chat(
         self,
@@ -389,13 +973,11 @@ class LLMService:
     ) -> str:
         """GitHub Models API integration - free, no credit card needed"""
         try:
-            import httpx
-            
             # GitHub Models uses GitHub API
             # Requires GitHub token (can be personal access token)
             url = "https://api.github.com/models/chat/completions"
             headers = {
-                "Authorization": f"Bearer {self.api_key}",
+                "Authorization": f"Bearer {self._api_key_for('github')}",
                 "Content-Type": "application/json",
                 "Accept": "application/vnd.github+json"
             }
@@ -407,50 +989,44 @@ class LLMService:
                 "max_tokens": max_tokens
             }
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(url, headers=headers, json=payload)
-                response.raise_for_status()
-                data = response.json()
-                content = data["choices"][0]["message"]["content"]
-                if isinstance(content, dict):
-                    import json
-                    content = json.dumps(content)
-                return str(content) if content else "I'm sorry, I didn't get a response."
+            client = self._get_client("github")
+            response = await client.post(url, headers=headers, json=payload, timeout=30.0)
+            response.raise_for_status()
+            data = response.json()
+            self._record_usage("github", data)
+            content = data["choices"][0]["message"]["content"]
+            if isinstance(content, dict):
+                import json
+                content = json.dumps(content)
+            return str(content) if content else ""
         except Exception as e:
             print(f"GitHub Models API error: {e}")
             import traceback
             print(traceback.format_exc())
-            return "I'm having trouble connecting to the AI service. Please try again later."
+            raise
     
     async def _deepseek_chat(
         self,
         messages: List[Dict[str, str]],
         model: str,
         temperature: float,
-        max_tokens: int
+        max_tokens: int,
+        json_mode: Optional[bool] = None
     ) -> str:
         """DeepSeek API integration - free and powerful"""
         try:
-            import httpx
-            
-            # Check API key
-            if not self.api_key:
-                error_msg = "DeepSeek API key not configured. Please set LLM_API_KEY environment variable."
-                print(f"❌ {error_msg}")
-                return error_msg
+            # Check API key (already stripped of whitespace/newlines)
+            api_key_clean = self._api_key_for("deepseek")
+            if not api_key_clean:
+                raise LLMConfigError("DeepSeek API key not configured. Please set DEEPSEEK_API_KEY or LLM_API_KEY.")
             
             # Validate API key format (should start with 'sk-')
-            if not self.api_key.startswith('sk-'):
-                print(f"⚠️ Warning: DeepSeek API key doesn't start with 'sk-'. Key preview: {self.api_key[:5]}...")
+            if not api_key_clean.startswith('sk-'):
+                print(f"⚠️ Warning: DeepSeek API key doesn't start with 'sk-'. Key preview: {api_key_clean[:5]}...")
             
             # DeepSeek API endpoint
             url = "https://api.deepseek.com/v1/chat/completions"
             
-            # Clean API key (remove whitespace, newlines)
-            api_key_clean = self.api_key.strip()
-            if api_key_clean != self.api_key:
-                print(f"⚠️ API key had whitespace, cleaned it")
-            
             headers = {
                 "Authorization": f"Bearer {api_key_clean}",
                 "Content-Type": "application/json"
@@ -460,9 +1036,9 @@ class LLMService:
             print(f"🔑 Key length: {len(api_key_clean)} chars")
             print(f"🔑 Key starts with 'sk-': {api_key_clean.startswith('sk-')}")
             
-            # Check if we need JSON format (for structured responses)
-            use_json_format = False
-            for msg in messages:
+            # Check if we need JSON format (for structured responses), unless the caller decided
+            use_json_format = bool(json_mode)
+            for msg in messages if json_mode is None else ():
                 content = msg.get("content", "")
                 role = msg.get("role", "")
                 content_upper = content.upper()
@@ -485,77 +1061,63 @@ class LLMService:
                 payload["response_format"] = {"type": "json_object"}
                 print(f"📋 Using JSON mode for DeepSeek")
             
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                # Debug: log request details (without exposing full key)
-                print(f"📤 Sending request to DeepSeek API")
-                print(f"📤 URL: {url}")
-                print(f"📤 Model: {model}")
-                print(f"📤 Headers Authorization: Bearer {api_key_clean[:10]}...{api_key_clean[-4:] if len(api_key_clean) > 14 else '***'}")
+            client = self._get_client("deepseek")
+            # Debug: log request details (without exposing full key)
+            print(f"📤 Sending request to DeepSeek API")
+            print(f"📤 URL: {url}")
+            print(f"📤 Model: {model}")
+            print(f"📤 Headers Authorization: Bearer {api_key_clean[:10]}...{api_key_clean[-4:] if len(api_key_clean) > 14 else '***'}")
                 
-                response = await client.post(url, headers=headers, json=payload)
+            response = await client.post(url, headers=headers, json=payload, timeout=60.0)
                 
-                print(f"📥 Response status: {response.status_code}")
-                
-                # Handle 401 Unauthorized specifically
-                if response.status_code == 401:
-                    # Try to get error details from response
-                    try:
-                        error_data = response.json()
-                        error_message = error_data.get("error", {}).get("message", "Unknown error")
-                        print(f"❌ DeepSeek API error details: {error_message}")
-                    except:
-                        error_message = response.text[:200] if hasattr(response, 'text') else "No error details"
-                        print(f"❌ DeepSeek API error response: {error_message}")
-                    error_msg = (
-                        "DeepSeek API authentication failed (401 Unauthorized).\n\n"
-                        "Возможные причины:\n"
-                        "1. API ключ неправильный или истёк\n"
-                        "2. Баланс аккаунта пустой (нужно пополнить для активации)\n"
-                        "3. API ключ не активирован (проверь на platform.deepseek.com)\n"
-                        "4. Ключ не имеет доступа к API\n\n"
-                        "Как исправить:\n"
-                        "1. Зайди на https://platform.deepseek.com\n"
-                        "2. Проверь баланс аккаунта\n"
-                        "3. Пополни баланс (даже минимальная сумма активирует API)\n"
-                        "4. Проверь, что ключ активен в разделе API Keys\n"
-                        "5. Создай новый ключ, если старый не работает\n\n"
-                        "Примечание: DeepSeek может требовать пополнения баланса для активации API, даже на бесплатном плане."
-                    )
-                    print(f"❌ {error_msg}")
-                    return error_msg
+            print(f"📥 Response status: {response.status_code}")
                 
-                response.raise_for_status()
-                data = response.json()
-                content = data["choices"][0]["message"]["content"]
-                if isinstance(content, dict):
-                    import json
-                    content = json.dumps(content)
-                return str(content) if content else "I'm sorry, I didn't get a response."
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code == 401:
+            # Handle 401 Unauthorized specifically
+            if response.status_code == 401:
+                # Try to get error details from response
+                try:
+                    error_data = response.json()
+                    error_message = error_data.get("error", {}).get("message", "Unknown error")
+                    print(f"❌ DeepSeek API error details: {error_message}")
+                except:
+                    error_message = response.text[:200] if hasattr(response, 'text') else "No error details"
+                    print(f"❌ DeepSeek API error response: {error_message}")
                 error_msg = (
                     "DeepSeek API authentication failed (401 Unauthorized).\n\n"
                     "Возможные причины:\n"
-                    "1. Баланс аккаунта пустой (нужно пополнить для активации)\n"
-                    "2. API ключ неправильный или истёк\n"
-                    "3. Ключ не активирован\n\n"
+                    "1. API ключ неправильный или истёк\n"
+                    "2. Баланс аккаунта пустой (нужно пополнить для активации)\n"
+                    "3. API ключ не активирован (проверь на platform.deepseek.com)\n"
+                    "4. Ключ не имеет доступа к API\n\n"
                     "Как исправить:\n"
                     "1. Зайди на https://platform.deepseek.com\n"
-                    "2. Проверь баланс и пополни его (даже минимальная сумма)\n"
-                    "3. Проверь, что ключ активен в разделе API Keys\n"
-                    "4. Создай новый ключ, если нужно\n\n"
-                    "Примечание: DeepSeek может требовать пополнения баланса для активации API."
+                    "2. Проверь баланс аккаунта\n"
+                    "3. Пополни баланс (даже минимальная сумма активирует API)\n"
+                    "4. Проверь, что ключ активен в разделе API Keys\n"
+                    "5. Создай новый ключ, если старый не работает\n\n"
+                    "Примечание: DeepSeek может требовать пополнения баланса для активации API, даже на бесплатном плане."
                 )
                 print(f"❌ {error_msg}")
-                return error_msg
-            else:
-                print(f"DeepSeek API HTTP error: {e.response.status_code} - {e}")
-                return f"DeepSeek API error: HTTP {e.response.status_code}"
+                raise LLMAuthError("deepseek", "authentication failed (401 Unauthorized)", status_code=401)
+                
+            response.raise_for_status()
+            data = response.json()
+            self._record_usage("deepseek", data)
+            content = data["choices"][0]["message"]["content"]
+            if isinstance(content, dict):
+                import json
+                content = json.dumps(content)
+            return str(content) if content else ""
+        except httpx.HTTPStatusError as e:
+            print(f"DeepSeek API HTTP error: {e.response.status_code} - {e}")
+            raise
+        except LLMError:
+            raise
         except Exception as e:
             print(f"DeepSeek API error: {e}")
             import traceback
             print(traceback.format_exc())
-            return f"I'm having trouble connecting to DeepSeek. Error: {str(e)}"
+            raise
     
     def _messages_to_prompt(self, messages: List[Dict[str, str]]) -> str:
         """Convert messages to prompt format for models that need it"""
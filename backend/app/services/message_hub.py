@@ -0,0 +1,289 @@
+"""
+Realtime fan-out of new chat messages (WebSocket / SSE, see app/api/events.py).
+
+Every place that writes a Message row — crud.chat.create_message, the chat job
+worker and proactive_service.send_proactive_message — calls publish_message()
+after its commit. The hub routes the event to the owner of the chat: each open
+connection holds a bounded asyncio.Queue registered under its user id. Long-poll
+requests (GET /chats/{id}/new-messages/?wait=) register a per-chat waiter instead
+and are woken by the same events.
+
+Backends (MESSAGE_HUB_BACKEND):
+- memory: events reach the connections of this process only (single worker).
+- postgres: publish sends NOTIFY on MESSAGE_HUB_CHANNEL; every process LISTENs
+  on its own dedicated connection (a thread, outside the SQLAlchemy pool) and
+  hands the events to its local connections. Messages too large for a NOTIFY
+  payload travel as ids and are loaded by the listener.
+
+publish_message() runs in the threadpool as well as on the event loop; queues
+are only ever touched on the loop thread (call_soon_threadsafe).
+"""
+import asyncio
+import json
+import select
+import threading
+from collections import Counter
+from typing import Any, Dict, Optional, Set
+
+from sqlalchemy import text
+
+from app.core.config import settings
+
+NOTIFY_MAX_BYTES = 7900  # PostgreSQL rejects NOTIFY payloads of 8000 bytes and more
+OWNER_CACHE_MAX = 10000
+
+
+def message_payload(message) -> Dict[str, Any]:
+    """JSON of a Message as the API returns it (schemas.Message): raw content plus its structured parts."""
+    return {
+        "id": message.id,
+        "chat_id": message.chat_id,
+        "content": message.content,
+        "sender": message.sender,
+        "created_at": message.created_at.isoformat() if message.created_at else None,
+        "text": message.text,
+        "pending_actions": message.pending_actions,
+        "checklist": message.checklist,
+        "suggestions": message.suggestions,
+    }
+
+
+class MessageHub:
+    def __init__(self):
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}  # user id -> connection queues
+        self._chat_waiters: Dict[int, Set[asyncio.Event]] = {}  # chat id -> long-poll requests
+        self._chat_owners: Dict[int, int] = {}  # chat id -> user id (a chat never changes owner)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._listener: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self.backend = "memory"
+        self.metrics: Counter = Counter()
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        backend = (settings.MESSAGE_HUB_BACKEND or "memory").lower()
+        if backend == "postgres":
+            from app.database.database import engine
+            if engine.dialect.name != "postgresql":
+                print("⚠️ MESSAGE_HUB_BACKEND=postgres needs PostgreSQL, delivering in-process only")
+                backend = "memory"
+        elif backend != "memory":
+            print(f"⚠️ Unknown MESSAGE_HUB_BACKEND={backend!r}, delivering in-process only")
+            backend = "memory"
+        self.backend = backend
+        if backend == "postgres" and self._listener is None:
+            self._stopping.clear()
+            self._listener = threading.Thread(target=self._listen_loop, name="message-hub-listener", daemon=True)
+            self._listener.start()
+        print(f"📡 Message hub started ({self.backend})")
+
+    async def stop(self):
+        self._stopping.set()
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            await asyncio.get_running_loop().run_in_executor(None, listener.join, 5)
+        # End open streams and long polls so their handlers return.
+        for queues in list(self._subscribers.values()):
+            for queue in list(queues):
+                self._put(queue, None)
+        for waiters in list(self._chat_waiters.values()):
+            for waiter in list(waiters):
+                waiter.set()
+
+    # --- connections -------------------------------------------------------
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        """Register a connection of the user (call on the event loop)."""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max(settings.MESSAGE_HUB_QUEUE_SIZE, 1))
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        self.metrics["subscribed"] += 1
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            self._subscribers.pop(user_id, None)
+
+    def connections(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def watch_chat(self, chat_id: int) -> asyncio.Event:
+        """Event set on the next message of the chat (call on the event loop, before reading the DB)."""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        waiter = asyncio.Event()
+        self._chat_waiters.setdefault(chat_id, set()).add(waiter)
+        return waiter
+
+    def unwatch_chat(self, chat_id: int, waiter: asyncio.Event):
+        waiters = self._chat_waiters.get(chat_id)
+        if waiters is None:
+            return
+        waiters.discard(waiter)
+        if not waiters:
+            self._chat_waiters.pop(chat_id, None)
+
+    def _listening(self) -> bool:
+        return bool(self._subscribers or self._chat_waiters)
+
+    # --- publishing ----------------------------------------------------------
+
+    def publish_message(self, db, message, user_id: Optional[int] = None):
+        """Announce a committed Message to its chat's owner and long polls of the chat. Never raises.
+
+        user_id: the chat's owner, when the caller already knows it (saves the lookup).
+        """
+        if self.backend == "memory" and not self._listening():
+            return  # nobody is listening in this process
+        try:
+            if user_id is None:
+                user_id = self._owner_of(db, message.chat_id)
+            if user_id is None:
+                return
+            event = {"type": "message", "user_id": user_id, "message": message_payload(message)}
+            self.metrics["published"] += 1
+            if self.backend == "postgres":
+                self._notify(db, event)
+            else:
+                self._dispatch_threadsafe(event)
+        except Exception as e:
+            self.metrics["publish_failed"] += 1
+            print(f"⚠️ Message hub publish failed for message {getattr(message, 'id', None)}: {e}")
+
+    def _owner_of(self, db, chat_id: int) -> Optional[int]:
+        user_id = self._chat_owners.get(chat_id)
+        if user_id is not None:
+            return user_id
+        from app.models.chat import Chat
+        from app.models.goal import Goal
+
+        user_id = db.query(Goal.user_id).join(Chat, Chat.goal_id == Goal.id).filter(Chat.id == chat_id).scalar()
+        if user_id is not None:
+            if len(self._chat_owners) >= OWNER_CACHE_MAX:
+                self._chat_owners.clear()
+            self._chat_owners[chat_id] = user_id
+        return user_id
+
+    def _notify(self, db, event: Dict[str, Any]):
+        payload = json.dumps(event, ensure_ascii=False)
+        if len(payload.encode("utf-8")) > NOTIFY_MAX_BYTES:
+            payload = json.dumps({
+                "type": "message_ref",
+                "user_id": event["user_id"],
+                "chat_id": event["message"]["chat_id"],
+                "message_id": event["message"]["id"],
+            })
+        # Its own transaction: NOTIFY is delivered on commit, after the message is visible.
+        db.execute(text("SELECT pg_notify(:channel, :payload)"),
+                   {"channel": settings.MESSAGE_HUB_CHANNEL, "payload": payload})
+        db.commit()
+
+    # --- delivery (event loop thread) ---------------------------------------
+
+    def _dispatch_threadsafe(self, event: Dict[str, Any]):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._dispatch(event)
+        else:
+            loop.call_soon_threadsafe(self._dispatch, event)
+
+    def _dispatch(self, event: Dict[str, Any]):
+        for waiter in self._chat_waiters.get(event["message"]["chat_id"], ()):
+            waiter.set()
+            self.metrics["long_poll_woken"] += 1
+        for queue in list(self._subscribers.get(event["user_id"], ())):
+            self._put(queue, event)
+            self.metrics["delivered"] += 1
+
+    def _put(self, queue: asyncio.Queue, event: Optional[Dict[str, Any]]):
+        if queue.full():
+            # The connection fell behind: drop its backlog and tell the client to re-fetch.
+            while not queue.empty():
+                queue.get_nowait()
+            self.metrics["resync"] += 1
+            if event is not None:
+                event = {"type": "resync"}
+        queue.put_nowait(event)
+
+    # --- postgres LISTEN ----------------------------------------------------
+
+    def _listen_loop(self):
+        import psycopg2
+        import psycopg2.extensions
+        from app.database.database import engine
+
+        dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        backoff = 1.0
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{settings.MESSAGE_HUB_CHANNEL}"')
+                print(f"📡 Message hub listening on '{settings.MESSAGE_HUB_CHANNEL}'")
+                backoff = 1.0
+                while not self._stopping.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._on_notify(conn.notifies.pop(0).payload)
+            except Exception as e:
+                # Events sent while disconnected are lost here; clients catch up by after_id.
+                print(f"⚠️ Message hub listener error: {e} (reconnecting in {backoff:.0f}s)")
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _on_notify(self, payload: str):
+        try:
+            event = json.loads(payload)
+            chat_id = event.get("chat_id") or event.get("message", {}).get("chat_id")
+            if event.get("user_id") not in self._subscribers and chat_id not in self._chat_waiters:
+                return
+            if event.get("type") == "message_ref":
+                event = self._load_ref(event)
+                if event is None:
+                    return
+            self._dispatch_threadsafe(event)
+        except Exception as e:
+            print(f"⚠️ Message hub could not handle notification: {e}")
+
+    @staticmethod
+    def _load_ref(event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        from app import crud
+        from app.database.database import session_scope
+
+        with session_scope() as db:
+            message = crud.chat.get_message(db, event["message_id"])
+            if message is None:
+                return None
+            return {"type": "message", "user_id": event["user_id"], "message": message_payload(message)}
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "connections": self.connections(),
+            "long_polls": sum(len(waiters) for waiters in self._chat_waiters.values()),
+            **self.metrics,
+        }
+
+
+message_hub = MessageHub()
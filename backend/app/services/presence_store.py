@@ -0,0 +1,187 @@
+"""
+Chat presence (heartbeats) and the proactive-message throttle, shared by all
+workers and kept across restarts.
+
+Writes — register_active_chat on every heartbeat, send_proactive_message on
+every send — only touch an in-process cache; the changed entries are written to
+chat_presence (one row per chat) every PRESENCE_FLUSH_INTERVAL seconds and on
+shutdown, so a heartbeat never waits for the DB. Reads trust a cache entry for
+PRESENCE_CACHE_SECONDS and re-read the row after that; other workers' writes
+are therefore seen a few seconds late at most. The proactive checks call
+refresh() first, which loads every recent row in one query instead of one per
+candidate chat.
+
+Rows and cache entries idle for PRESENCE_TTL are evicted: nothing older matters
+to the activity window or to the throttle intervals.
+"""
+import asyncio
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, NamedTuple, Optional, Set
+
+from fastapi.concurrency import run_in_threadpool
+
+from app import crud
+from app.core.config import settings
+from app.database.database import session_scope
+
+EVICT_INTERVAL = 3600.0  # seconds between evictions of idle rows
+
+
+class PresenceEntry(NamedTuple):
+    last_active_at: Optional[datetime]
+    last_proactive_at: Optional[datetime]
+    checked_at: float  # time.monotonic() of the last DB read or local write
+
+
+def _later(a: Optional[datetime], b: Optional[datetime]) -> Optional[datetime]:
+    if a is None or b is None:
+        return a or b
+    return max(a, b)
+
+
+def _naive(value: Optional[datetime]) -> Optional[datetime]:
+    # PostgreSQL returns aware values; everything here is naive UTC
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class PresenceStore:
+    def __init__(self):
+        self._entries: Dict[int, PresenceEntry] = {}
+        self._dirty: Set[int] = set()
+        self._snapshot_at: Optional[float] = None  # refresh(): chats missing from the cache have no row
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.metrics: Counter = Counter()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        try:
+            await run_in_threadpool(self.flush)
+        except Exception as e:
+            print(f"⚠️ Could not save chat presence on shutdown: {e}")
+
+    # --- writes (cache only) -------------------------------------------------
+
+    def touch(self, chat_id: int):
+        """The user is in the chat now (heartbeat)."""
+        self._write(chat_id, last_active_at=datetime.utcnow())
+
+    def mark_proactive(self, chat_id: int):
+        """A proactive message was just sent to the chat."""
+        self._write(chat_id, last_proactive_at=datetime.utcnow())
+
+    def _write(self, chat_id: int, **values):
+        with self._lock:
+            entry = self._entries.get(chat_id) or PresenceEntry(None, None, 0.0)
+            self._entries[chat_id] = entry._replace(**values)
+            self._dirty.add(chat_id)
+
+    # --- reads ----------------------------------------------------------------
+
+    def get(self, chat_id: int) -> PresenceEntry:
+        now = time.monotonic()
+        max_age = settings.PRESENCE_CACHE_SECONDS
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is not None and now - entry.checked_at < max_age:
+                return entry
+            if entry is None and self._snapshot_at is not None and now - self._snapshot_at < max_age:
+                return PresenceEntry(None, None, self._snapshot_at)
+        self.metrics["row_reads"] += 1
+        with session_scope() as db:
+            row = crud.chat_presence.get_presence(db, chat_id)
+            stored = (_naive(row.last_active_at), _naive(row.last_proactive_at)) if row else (None, None)
+        return self._merge(chat_id, *stored, checked_at=now)
+
+    def refresh(self):
+        """Load all recent rows at once (before checking many chats)."""
+        now = time.monotonic()
+        since = datetime.utcnow() - timedelta(seconds=settings.PRESENCE_TTL)
+        with session_scope() as db:
+            rows = [(r.chat_id, _naive(r.last_active_at), _naive(r.last_proactive_at))
+                    for r in crud.chat_presence.get_recent_presence(db, since)]
+        for chat_id, last_active_at, last_proactive_at in rows:
+            self._merge(chat_id, last_active_at, last_proactive_at, checked_at=now)
+        with self._lock:
+            self._snapshot_at = now
+        self.metrics["refreshes"] += 1
+
+    def _merge(self, chat_id: int, last_active_at, last_proactive_at, checked_at: float) -> PresenceEntry:
+        # Unflushed local writes may be newer than the row
+        with self._lock:
+            cached = self._entries.get(chat_id)
+            if cached is not None:
+                last_active_at = _later(cached.last_active_at, last_active_at)
+                last_proactive_at = _later(cached.last_proactive_at, last_proactive_at)
+            entry = PresenceEntry(last_active_at, last_proactive_at, checked_at)
+            self._entries[chat_id] = entry
+            return entry
+
+    # --- write-behind -----------------------------------------------------------
+
+    def flush(self) -> int:
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            rows = [
+                {"chat_id": chat_id, "last_active_at": entry.last_active_at,
+                 "last_proactive_at": entry.last_proactive_at}
+                for chat_id, entry in ((chat_id, self._entries.get(chat_id)) for chat_id in dirty)
+                if entry is not None
+            ]
+        if not rows:
+            return 0
+        try:
+            with session_scope() as db:
+                crud.chat_presence.upsert_presence(db, rows)
+        except Exception:
+            with self._lock:
+                self._dirty |= dirty  # retried on the next flush
+            raise
+        self.metrics["flushed"] += len(rows)
+        return len(rows)
+
+    def evict(self) -> int:
+        cutoff = datetime.utcnow() - timedelta(seconds=settings.PRESENCE_TTL)
+        with self._lock:
+            idle = [
+                chat_id for chat_id, entry in self._entries.items()
+                if chat_id not in self._dirty
+                and (entry.last_active_at is None or entry.last_active_at < cutoff)
+                and (entry.last_proactive_at is None or entry.last_proactive_at < cutoff)
+            ]
+            for chat_id in idle:
+                del self._entries[chat_id]
+        with session_scope() as db:
+            deleted = crud.chat_presence.delete_idle_presence(db, cutoff)
+        self.metrics["evicted"] += len(idle)
+        return deleted
+
+    async def _flush_loop(self):
+        next_evict = time.monotonic() + EVICT_INTERVAL
+        while True:
+            await asyncio.sleep(max(settings.PRESENCE_FLUSH_INTERVAL, 0.1))
+            try:
+                await run_in_threadpool(self.flush)
+                if time.monotonic() >= next_evict:
+                    next_evict = time.monotonic() + EVICT_INTERVAL
+                    await run_in_threadpool(self.evict)
+            except Exception as e:
+                print(f"⚠️ Chat presence flush failed: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"cached": len(self._entries), "dirty": len(self._dirty), **self.metrics}
+
+
+presence_store = PresenceStore()
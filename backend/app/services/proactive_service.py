@@ -3,54 +3,49 @@ Proactive messaging service - sends reminders and checklists based on agreements
 Настойчивый как Duolingo! 🦉
 """
 import asyncio
-import json
 import random
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict
+from typing import Any, AsyncIterator, NamedTuple, Optional, List, Dict, Tuple
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from app.database.database import SessionLocal
+from sqlalchemy import desc, func, or_, select
+from app.core.config import settings
+from app.database.database import SessionLocal, session_scope
 from app import crud, schemas
 from app.models.agreement import AgreementStatus, Agreement
 from app.models.chat import Message, Chat
 from app.models.goal import Goal
 from app.services import coach_voice
-
-# Store for tracking active chats (in production, use Redis)
-active_chats: dict = {}
-
+from app.services.presence_store import presence_store
+from app.services.service_lease import ServiceLease
 
 def _goal_tone(db: Session, goal_id: int) -> str:
     """Resolve the coach tone (strict/normal/gentle) chosen for a goal."""
     goal = db.query(Goal).filter(Goal.id == goal_id).first()
     return coach_voice.resolve_tone(getattr(goal, "coach_trainer_id", None) if goal else None)
 
-# Track last proactive message per chat to avoid spam
-last_proactive_messages: Dict[int, datetime] = {}
+# Goals per query of the periodic scans (keyset pages over Goal.id)
+SCAN_CHUNK_SIZE = 500
+
+# Only the process holding this lease runs proactive_check_loop (one per deployment)
+proactive_lease = ServiceLease("proactive")
 
-# Track last check times for different types of messages
+# Cadence of the scans in the lease holder. Losing them on restart only runs a scan early:
+# the throttle (presence_store) and "no AI message today" still hold across restarts.
 last_missed_days_check: Optional[datetime] = None
 last_morning_check: Optional[datetime] = None
 
 
 def register_active_chat(chat_id: int, goal_id: int):
-    """Register that a user is active in a chat"""
-    active_chats[chat_id] = {
-        "goal_id": goal_id,
-        "last_activity": datetime.utcnow()
-    }
-
-
-def unregister_chat(chat_id: int):
-    """Unregister a chat"""
-    active_chats.pop(chat_id, None)
+    """Register that a user is active in a chat (shared by all workers, see presence_store)"""
+    presence_store.touch(chat_id)
 
 
 def is_chat_active(chat_id: int, minutes: int = 30) -> bool:
     """Check if chat was active in the last N minutes"""
-    if chat_id not in active_chats:
+    last_activity = presence_store.get(chat_id).last_active_at
+    if last_activity is None:
         return False
-    last_activity = active_chats[chat_id]["last_activity"]
     return (datetime.utcnow() - last_activity) < timedelta(minutes=minutes)
 
 
@@ -78,138 +73,243 @@ def get_last_ai_message_time(db: Session, chat_id: int) -> Optional[datetime]:
     return None
 
 
+async def scan_active_goals(*conditions, chunk_size: int = SCAN_CHUNK_SIZE) -> AsyncIterator:
+    """Rows of active goals that have a chat, with everything the periodic checks need.
+
+    One query per chunk of `chunk_size` goals instead of 4-5 queries per goal. Columns:
+    goal_id, user_id, title, coach_trainer_id, chat_id (the goal's first chat),
+    last_user_at, last_ai_at, pending_count and the first pending agreement
+    (agreement_description, agreement_deadline). Each of `conditions` gets those
+    columns (a .c namespace) and returns a filter, so only candidates leave the DB.
+    Rows are plain tuples and each chunk is a fresh keyset query (Goal.id) run in
+    the threadpool with its own short session, so the commits the checks make
+    while iterating don't disturb the scan and the event loop never waits on it.
+    """
+    goals = (
+        select(
+            Goal.id.label("goal_id"),
+            Goal.user_id,
+            Goal.title,
+            Goal.coach_trainer_id,
+            select(func.min(Chat.id)).where(Chat.goal_id == Goal.id).scalar_subquery().label("chat_id"),
+        )
+        .where(Goal.status == "active")
+        .subquery()
+    )
+
+    def last_message_at(sender: str):
+        # Served by ix_messages_chat_sender_created
+        return (
+            select(func.max(Message.created_at))
+            .where(Message.chat_id == goals.c.chat_id, Message.sender == sender)
+            .scalar_subquery()
+        )
+
+    scan = select(
+        goals,
+        last_message_at("user").label("last_user_at"),
+        last_message_at("ai").label("last_ai_at"),
+    ).where(goals.c.chat_id.isnot(None)).subquery()
+    pending = (
+        select(
+            Agreement.goal_id,
+            func.min(Agreement.id).label("agreement_id"),
+            func.count(Agreement.id).label("pending_count"),
+        )
+        .where(Agreement.status == AgreementStatus.PENDING)
+        .group_by(Agreement.goal_id)
+        .subquery()
+    )
+    query = (
+        select(
+            scan,
+            func.coalesce(pending.c.pending_count, 0).label("pending_count"),
+            Agreement.description.label("agreement_description"),
+            Agreement.deadline.label("agreement_deadline"),
+        )
+        .outerjoin(pending, pending.c.goal_id == scan.c.goal_id)
+        .outerjoin(Agreement, Agreement.id == pending.c.agreement_id)
+        .where(*(condition(scan.c) for condition in conditions))
+        .order_by(scan.c.goal_id)
+        .limit(chunk_size)
+    )
+    def next_chunk(last_goal_id: int):
+        with session_scope() as db:
+            return db.execute(query.where(scan.c.goal_id > last_goal_id)).all()
+
+    last_goal_id = 0
+    while True:
+        rows = await run_in_threadpool(next_chunk, last_goal_id)
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+        last_goal_id = rows[-1].goal_id
+
+
 def can_send_proactive_message(chat_id: int, min_interval_minutes: int = 60) -> bool:
     """Check if we can send proactive message (avoid spam)"""
-    if chat_id not in last_proactive_messages:
+    if min_interval_minutes <= 0:
+        return True
+    last_sent = presence_store.get(chat_id).last_proactive_at
+    if last_sent is None:
         return True
     
-    last_sent = last_proactive_messages[chat_id]
     time_since = (datetime.utcnow() - last_sent).total_seconds() / 60
     return time_since >= min_interval_minutes
 
 
-async def send_proactive_message(db: Session, chat_id: int, content: str, actions: list = None, min_interval: int = 60, send_push: bool = True):
-    """Send a proactive message from the AI coach"""
-    # Check if we can send (avoid spam)
-    if not can_send_proactive_message(chat_id, min_interval):
-        return None
-    
-    message = Message(
-        chat_id=chat_id,
-        sender="ai",
-        content=content
-    )
-    db.add(message)
-    db.commit()
-    db.refresh(message)
-    
-    # Track when we sent this
-    last_proactive_messages[chat_id] = datetime.utcnow()
-    
-    print(f"📤 Proactive message sent to chat {chat_id}: {content[:50]}...")
-    
-    # Send push notification if enabled
-    if send_push:
-        try:
-            # Get user_id from chat
-            chat = db.query(Chat).filter(Chat.id == chat_id).first()
-            if chat:
-                goal = db.query(Goal).filter(Goal.id == chat.goal_id).first()
-                if goal:
-                    from app.services.push_service import send_push_to_user
-                    
-                    # Extract title and body from content (first line as title, rest as body)
-                    lines = content.split('\n')
-                    title = lines[0].strip()[:50]  # First line, max 50 chars
-                    body = '\n'.join(lines[1:]).strip()[:200]  # Rest, max 200 chars
-                    if not body:
-                        body = title[:200]
-                    
-                    # Prepare data payload
-                    data = {
-                        "type": "proactive_message",
-                        "chat_id": str(chat_id),
-                        "goal_id": str(chat.goal_id),
-                        "message_id": str(message.id)
-                    }
-                    
-                    await send_push_to_user(db, goal.user_id, title, body, data)
-                    print(f"📱 Push notification sent for chat {chat_id}")
-        except Exception as e:
-            print(f"⚠️ Error sending push notification: {e}")
-            # Don't fail the message if push fails
-    
-    return message
-
+class OutgoingMessage(NamedTuple):
+    """A proactive message a check decided to send (see send_proactive_batch)"""
+    chat_id: int
+    content: str
+    min_interval: int = 60
+    goal_id: Optional[int] = None
+    user_id: Optional[int] = None
+    payload: Optional[Dict[str, Any]] = None  # Message.payload (checklist, suggestions)
+
+
+def _push_notification(item: OutgoingMessage, message: Message):
+    from app.services.push_service import PushNotification
+
+    # Extract title and body from content (first line as title, rest as body)
+    lines = item.content.split('\n')
+    title = lines[0].strip()[:50]  # First line, max 50 chars
+    body = '\n'.join(lines[1:]).strip()[:200]  # Rest, max 200 chars
+    if not body:
+        body = title[:200]
+    data = {
+        "type": "proactive_message",
+        "chat_id": str(item.chat_id),
+        "goal_id": str(item.goal_id),
+        "message_id": str(message.id)
+    }
+    return PushNotification(item.user_id, title, body, data)
 
-async def check_and_send_reminders(db: Session):
-    """Check for upcoming agreements and send reminders (multiple times per day!)"""
-    now = datetime.utcnow()
-    
-    # Get agreements due in next 24 hours
-    upcoming = crud.agreement.get_upcoming_agreements(db, hours_ahead=24)
-    
-    for agreement in upcoming:
-        # Find the chat for this goal
-        chat = db.query(Chat).filter(Chat.goal_id == agreement.goal_id).first()
 
-        if not chat:
-            continue
+def save_proactive_batch(db: Session, outgoing: List[OutgoingMessage]) -> List[Tuple[OutgoingMessage, Message]]:
+    """Throttle, save the messages in one transaction and publish them; (item, message) of those sent.
 
-        tone = _goal_tone(db, agreement.goal_id)
-        hours_left = (agreement.deadline - now).total_seconds() / 3600
-        desc = agreement.description
+    Blocking DB work: call via run_in_threadpool. The pushes go out separately (push_proactive_batch).
+    """
+    from app.services.message_hub import message_hub
 
-        # Multiple reminders based on time left
-        # 1. First reminder: 24 hours before
-        if 20 <= hours_left <= 24 and not agreement.reminder_sent:
-            reminder_content = coach_voice.pick("remind", tone, desc=desc, hours=int(hours_left))
-            suggestions = ["Уже делаю!", "Сделаю сегодня", "Нужна помощь"]
-            reminder_content += f"\n\n<!--SUGGESTIONS:{json.dumps(suggestions, ensure_ascii=False)}-->"
+    # Check if we can send (avoid spam); one message per chat per batch
+    ready: List[OutgoingMessage] = []
+    chats = set()
+    for item in outgoing:
+        if item.chat_id in chats or not can_send_proactive_message(item.chat_id, item.min_interval):
+            continue
+        chats.add(item.chat_id)
+        ready.append(item)
+    if not ready:
+        return []
+
+    # Goal / user of the chats the caller didn't resolve (one query)
+    unresolved = [item.chat_id for item in ready if item.goal_id is None or item.user_id is None]
+    if unresolved:
+        owners = {
+            chat_id: (goal_id, user_id)
+            for chat_id, goal_id, user_id in db.query(Chat.id, Goal.id, Goal.user_id)
+            .join(Goal, Goal.id == Chat.goal_id)
+            .filter(Chat.id.in_(unresolved))
+        }
+        ready = [
+            item._replace(goal_id=owners[item.chat_id][0], user_id=owners[item.chat_id][1])
+            if item.chat_id in owners else item
+            for item in ready
+        ]
+
+    messages = [Message(chat_id=item.chat_id, sender="ai", content=item.content, payload=item.payload)
+                for item in ready]
+    db.add_all(messages)
+    db.flush()
+    ids = [message.id for message in messages]
+    db.commit()
+    # created_at comes from the DB: reload the batch in one query
+    saved = {message.id: message for message in db.query(Message).filter(Message.id.in_(ids))}
+    messages = [saved[message_id] for message_id in ids]
+
+    for item, message in zip(ready, messages):
+        # Track when we sent this, deliver to open chat screens right away (WebSocket / SSE)
+        presence_store.mark_proactive(item.chat_id)
+        message_hub.publish_message(db, message, user_id=item.user_id)
+        print(f"📤 Proactive message sent to chat {item.chat_id}: {item.content[:50]}...")
+    return list(zip(ready, messages))
+
+
+async def push_proactive_batch(db: Session, sent: List[Tuple[OutgoingMessage, Message]]):
+    """Push notifications for saved proactive messages, PROACTIVE_PUSH_CONCURRENCY requests at a time."""
+    from app.services.push_service import send_push_batch
+
+    notifications = [_push_notification(item, message) for item, message in sent if item.user_id is not None]
+    try:
+        stats = await send_push_batch(db, notifications, concurrency=settings.PROACTIVE_PUSH_CONCURRENCY)
+        print(f"📱 Push notifications for {len(notifications)} proactive messages: {stats}")
+    except Exception as e:
+        print(f"⚠️ Error sending push notifications: {e}")
+        # Don't fail the messages if push fails
+
+
+async def send_proactive_batch(db: Session, outgoing: List[OutgoingMessage], send_push: bool = True) -> List[Message]:
+    """Send proactive messages: throttle, save them all in one transaction, then fan out the pushes.
+
+    Pushes go out concurrently (PROACTIVE_PUSH_CONCURRENCY requests at a time) after
+    every message is saved and published, so one slow FCM call doesn't hold up the rest.
+    """
+    if not outgoing:
+        return []
+    sent = await run_in_threadpool(save_proactive_batch, db, outgoing)
+    # Send push notifications if enabled
+    if send_push and sent:
+        await push_proactive_batch(db, sent)
+    return [message for _, message in sent]
+
+
+async def send_proactive_message(db: Session, chat_id: int, content: str, actions: list = None, min_interval: int = 60,
+                                 send_push: bool = True, goal_id: int = None, user_id: int = None,
+                                 payload: Optional[Dict[str, Any]] = None):
+    """Send a proactive message from the AI coach (goal_id / user_id, when the caller has them, save the lookup for the push)"""
+    sent = await send_proactive_batch(
+        db, [OutgoingMessage(chat_id, content, min_interval, goal_id, user_id, payload)], send_push=send_push
+    )
+    return sent[0] if sent else None
 
-            await send_proactive_message(db, chat.id, reminder_content, min_interval=0)
-            crud.agreement.mark_reminder_sent(db, agreement.id)
-            print(f"✅ 24h reminder sent for agreement {agreement.id} (tone={tone})")
 
-        # 2. Second reminder: 12 hours before (more urgent!)
-        elif 10 <= hours_left <= 12:
-            reminder_content = coach_voice.pick("remind", tone, desc=desc, hours=int(hours_left))
-            suggestions = ["В процессе!", "Скоро начну", "Всё под контролем"]
-            reminder_content += f"\n\n<!--SUGGESTIONS:{json.dumps(suggestions, ensure_ascii=False)}-->"
+# Agreement reminders planned by deadline_scheduler: (phrase, suggestions, min_interval)
+AGREEMENT_REMINDERS = {
+    "remind_24h": ("remind", ["Уже делаю!", "Сделаю сегодня", "Нужна помощь"], 0),
+    "remind_12h": ("remind", ["В процессе!", "Скоро начну", "Всё под контролем"], 60),
+    "remind_6h": ("remind_urgent", ["Почти готово!", "Сейчас доделаю", "Нужна помощь"], 60),
+    "remind_2h": ("remind_urgent", ["Почти готово!", "Сейчас доделаю", "Нужна помощь"], 30),
+}
 
-            await send_proactive_message(db, chat.id, reminder_content, min_interval=60)
-            print(f"✅ 12h reminder sent for agreement {agreement.id} (tone={tone})")
 
-        # 3. Third reminder: 6 hours before (very urgent!)
-        elif 4 <= hours_left <= 6:
-            reminder_content = coach_voice.pick("remind_urgent", tone, desc=desc, hours=int(hours_left))
-            suggestions = ["Почти готово!", "Сейчас доделаю", "Нужна помощь"]
-            reminder_content += f"\n\n<!--SUGGESTIONS:{json.dumps(suggestions, ensure_ascii=False)}-->"
+def send_agreement_reminder(db: Session, reminder) -> List[Tuple[OutgoingMessage, Message]]:
+    """Save and publish a reminder / checklist / missed message planned for an agreement.
 
-            await send_proactive_message(db, chat.id, reminder_content, min_interval=60)
-            print(f"✅ 6h reminder sent for agreement {agreement.id} (tone={tone})")
+    Returns what was sent (empty if the reminder no longer applies); the caller
+    sends its push (push_proactive_batch). The agreement's flags are committed with
+    the message, so a failed send can simply be retried. Blocking DB work: call via
+    run_in_threadpool.
+    """
+    from app.services.deadline_scheduler import CHECKLIST, MISSED, deadline_scheduler, latest_fire_at, utc_naive
 
-        # 4. Last reminder: 2 hours before (PANIC MODE!)
-        elif 1 <= hours_left <= 2:
-            reminder_content = coach_voice.pick("remind_urgent", tone, desc=desc, hours=int(hours_left))
-            suggestions = ["Почти готово!", "Сейчас доделаю", "Нужна помощь"]
-            reminder_content += f"\n\n<!--SUGGESTIONS:{json.dumps(suggestions, ensure_ascii=False)}-->"
+    agreement = crud.agreement.get_agreement(db, reminder.agreement_id)
+    if not agreement or agreement.status != AgreementStatus.PENDING:
+        return []
+    if reminder.kind == MISSED and not agreement.checklist_sent:
+        return []
 
-            await send_proactive_message(db, chat.id, reminder_content, min_interval=30)
-            print(f"✅ 2h reminder sent for agreement {agreement.id} (tone={tone})")
+    # Find the chat for this goal
+    chat = db.query(Chat).filter(Chat.goal_id == agreement.goal_id).first()
+    if not chat:
+        return []
 
+    tone = _goal_tone(db, agreement.goal_id)
+    desc = agreement.description
 
-async def check_and_send_deadline_checklists(db: Session):
-    """Check for due agreements and send checklists"""
-    due = crud.agreement.get_due_agreements(db)
-    
-    for agreement in due:
-        # Find the chat for this goal
-        chat = db.query(Chat).filter(Chat.goal_id == agreement.goal_id).first()
-        
-        if not chat:
-            continue
-        
+    if reminder.kind == CHECKLIST:
         # Create checklist for this agreement
         checklist_data = {
             "title": f"🦉 Проверка выполнения",
@@ -219,14 +319,49 @@ async def check_and_send_deadline_checklists(db: Session):
                 {"id": 3, "label": "Что именно сделал", "type": "text"}
             ]
         }
-        
-        tone = _goal_tone(db, agreement.goal_id)
-        intro = coach_voice.pick("checklist_intro", tone, desc=agreement.description)
-        content = intro + f"\n\n<!--CHECKLIST:{json.dumps(checklist_data, ensure_ascii=False)}-->"
-        
-        await send_proactive_message(db, chat.id, content, min_interval=0)
-        crud.agreement.mark_checklist_sent(db, agreement.id)
+        content = coach_voice.pick("checklist_intro", tone, desc=desc)
+
+        agreement.checklist_sent = True  # committed together with the message
+        sent = save_proactive_batch(
+            db, [OutgoingMessage(chat.id, content, 0, agreement.goal_id, payload={"checklist": checklist_data})]
+        )
         print(f"✅ Deadline checklist sent for agreement {agreement.id}")
+        return sent
+
+    if reminder.kind == MISSED:
+        # Mark as missed (together with the message) and send "shaming" message
+        agreement.status = AgreementStatus.MISSED
+        content = coach_voice.pick("missed_agreement", tone, desc=desc)
+        suggestions = ["Извини, забыл", "Нужна помощь", "Продолжаю"]
+
+        sent = save_proactive_batch(
+            db, [OutgoingMessage(chat.id, content, 0, agreement.goal_id, payload={"suggestions": suggestions})]
+        )
+        print(f"✅ Missed agreement message sent for agreement {agreement.id}")
+        return sent
+
+    phrase, suggestions, min_interval = AGREEMENT_REMINDERS[reminder.kind]
+    if not can_send_proactive_message(chat.id, min_interval):
+        # Another message was just sent: retry once the interval is over, if still inside the window
+        retry_at = presence_store.get(chat.id).last_proactive_at + timedelta(minutes=min_interval)
+        if retry_at <= latest_fire_at(reminder.kind, agreement.deadline):
+            crud.agreement.defer_reminder(db, reminder.id, retry_at)
+            deadline_scheduler.notify()
+            print(f"⏳ {reminder.kind} reminder for agreement {agreement.id} deferred to {retry_at:%H:%M}")
+        else:
+            print(f"⏭️ {reminder.kind} reminder for agreement {agreement.id} skipped: another message was just sent")
+        return []
+
+    hours_left = (utc_naive(agreement.deadline) - datetime.utcnow()).total_seconds() / 3600
+    content = coach_voice.pick(phrase, tone, desc=desc, hours=max(round(hours_left), 1))
+
+    if reminder.kind == "remind_24h":
+        agreement.reminder_sent = True
+    sent = save_proactive_batch(
+        db, [OutgoingMessage(chat.id, content, min_interval, agreement.goal_id, payload={"suggestions": suggestions})]
+    )
+    print(f"✅ {reminder.kind} reminder sent for agreement {agreement.id} (tone={tone})")
+    return sent
 
 
 async def check_and_send_missed_days_messages(db: Session):
@@ -240,66 +375,64 @@ async def check_and_send_missed_days_messages(db: Session):
         return
     
     last_missed_days_check = now
+    # Presence and throttle of all recently active chats, one query
+    await run_in_threadpool(presence_store.refresh)
     
-    # Get all active goals with chats
-    active_goals = db.query(Goal).filter(Goal.status == "active").all()
-    
-    for goal in active_goals:
-        chat = db.query(Chat).filter(Chat.goal_id == goal.id).first()
-        if not chat:
-            continue
-        
-        # Get last user message
-        last_user_msg_time = get_last_user_message_time(db, chat.id)
-        if not last_user_msg_time:
-            # No messages yet, skip
-            continue
-        
+    # Active goals whose user has been silent for 1-3 or 7+ days (one query per chunk of goals)
+    candidates = scan_active_goals(
+        lambda c: c.last_user_at <= now - timedelta(days=1),
+        lambda c: or_(c.last_user_at > now - timedelta(days=4), c.last_user_at <= now - timedelta(days=7)),
+    )
+    outgoing: List[OutgoingMessage] = []
+    sent = 0
+    async for goal in candidates:
+        if len(outgoing) >= SCAN_CHUNK_SIZE:
+            sent += len(await send_proactive_batch(db, outgoing))
+            outgoing = []
+
         # Calculate days since last activity
-        days_since = (now - last_user_msg_time).days
+        days_since = (now - goal.last_user_at).days
         
         # Skip if chat is currently active
-        if is_chat_active(chat.id, minutes=60):
+        if is_chat_active(goal.chat_id, minutes=60):
             continue
         
-        tone = _goal_tone(db, goal.id)
+        tone = coach_voice.resolve_tone(goal.coach_trainer_id)
 
         # Different messages based on days missed
         if days_since == 1:
             content = coach_voice.pick("miss1", tone)
             suggestions = ["Вернулся!", "Был занят", "Продолжаю"]
-            content += f"\n\n<!--SUGGESTIONS:{json.dumps(suggestions, ensure_ascii=False)}-->"
-
-            await send_proactive_message(db, chat.id, content, min_interval=120)
-            print(f"✅ 1-day missed message sent for chat {chat.id} (tone={tone})")
+            outgoing.append(OutgoingMessage(goal.chat_id, content, 120, goal.goal_id, goal.user_id,
+                                            payload={"suggestions": suggestions}))
 
         elif days_since == 2:
             content = coach_voice.pick("miss2", tone)
             suggestions = ["Вернулся!", "Был занят", "Нужна помощь"]
-            content += f"\n\n<!--SUGGESTIONS:{json.dumps(suggestions, ensure_ascii=False)}-->"
-
-            await send_proactive_message(db, chat.id, content, min_interval=120)
-            print(f"✅ 2-day missed message sent for chat {chat.id} (tone={tone})")
+            outgoing.append(OutgoingMessage(goal.chat_id, content, 120, goal.goal_id, goal.user_id,
+                                            payload={"suggestions": suggestions}))
 
         elif days_since == 3:
             content = coach_voice.pick("miss3", tone)
             suggestions = ["Вернулся!", "Извини", "Продолжаю"]
-            content += f"\n\n<!--SUGGESTIONS:{json.dumps(suggestions, ensure_ascii=False)}-->"
-
-            await send_proactive_message(db, chat.id, content, min_interval=120)
-            print(f"✅ 3-day missed message sent for chat {chat.id} (tone={tone})")
+            outgoing.append(OutgoingMessage(goal.chat_id, content, 120, goal.goal_id, goal.user_id,
+                                            payload={"suggestions": suggestions}))
 
         elif days_since >= 7:
             content = coach_voice.pick("miss_week", tone, days=days_since)
             suggestions = ["Вернулся!", "Начну заново", "Нужна помощь"]
-            content += f"\n\n<!--SUGGESTIONS:{json.dumps(suggestions, ensure_ascii=False)}-->"
+            outgoing.append(OutgoingMessage(goal.chat_id, content, 180, goal.goal_id, goal.user_id,
+                                            payload={"suggestions": suggestions}))
 
-            await send_proactive_message(db, chat.id, content, min_interval=180)
-            print(f"✅ {days_since}-day missed message sent for chat {chat.id} (tone={tone})")
+    sent += len(await send_proactive_batch(db, outgoing))
+    if sent:
+        print(f"✅ Missed-day messages sent: {sent}")
 
 
 async def check_and_send_morning_motivations(db: Session):
     """Send motivational morning messages (like Duolingo!)"""
+    from app.services.deadline_scheduler import utc_naive
+
     global last_morning_check
     
     now = datetime.utcnow()
@@ -315,88 +448,54 @@ async def check_and_send_morning_motivations(db: Session):
     
     last_morning_check = now
     
-    # Get all active goals with chats
-    active_goals = db.query(Goal).filter(Goal.status == "active").all()
-    
-    for goal in active_goals:
-        chat = db.query(Chat).filter(Chat.goal_id == goal.id).first()
-        if not chat:
-            continue
-        
-        # Check if we already sent a message today
-        last_ai_msg = get_last_ai_message_time(db, chat.id)
-        if last_ai_msg and last_ai_msg.date() == now.date():
-            # Already sent today
-            continue
-        
-        # Check if user was active recently (don't wake them up!)
-        last_user_msg = get_last_user_message_time(db, chat.id)
-        if last_user_msg and (now - last_user_msg).total_seconds() < 3600:
-            # User was active in last hour, skip
-            continue
-        
-        # Get pending agreements
-        pending_agreements = crud.agreement.get_pending_agreements(db, goal.id)
-        tone = _goal_tone(db, goal.id)
+    # Active goals without an AI message today whose user wasn't active in the last hour
+    # (don't wake them up!), in one query per chunk of goals
+    today = datetime(now.year, now.month, now.day)
+    candidates = scan_active_goals(
+        lambda c: or_(c.last_ai_at.is_(None), c.last_ai_at < today),
+        lambda c: or_(c.last_user_at.is_(None), c.last_user_at <= now - timedelta(hours=1)),
+    )
+    outgoing: List[OutgoingMessage] = []
+    sent = 0
+    async for goal in candidates:
+        if len(outgoing) >= SCAN_CHUNK_SIZE:
+            sent += len(await send_proactive_batch(db, outgoing))
+            outgoing = []
+
+        tone = coach_voice.resolve_tone(goal.coach_trainer_id)
 
         content = coach_voice.pick("morning", tone, goal=goal.title)
 
-        if pending_agreements:
-            agreement = pending_agreements[0]
-            hours_left = (agreement.deadline - now).total_seconds() / 3600
+        if goal.pending_count:
+            hours_left = (utc_naive(goal.agreement_deadline) - now).total_seconds() / 3600
             if hours_left <= 24:
                 content = coach_voice.pick(
                     "morning_deadline", tone,
-                    desc=agreement.description, hours=int(hours_left),
+                    desc=goal.agreement_description, hours=int(hours_left),
                 )
 
         suggestions = ["Доброе утро!", "Начну сейчас", "Позже"]
-        content += f"\n\n<!--SUGGESTIONS:{json.dumps(suggestions, ensure_ascii=False)}-->"
-        
-        await send_proactive_message(db, chat.id, content, min_interval=0)
-        print(f"✅ Morning motivation sent for chat {chat.id}")
+        outgoing.append(OutgoingMessage(goal.chat_id, content, 0, goal.goal_id, goal.user_id,
+                                        payload={"suggestions": suggestions}))
 
-
-async def check_and_mark_missed_agreements(db: Session):
-    """Mark agreements as missed if deadline passed and no response"""
-    now = datetime.utcnow()
-    
-    # Get agreements that are overdue by more than 24 hours
-    overdue = db.query(Agreement).filter(
-        Agreement.status == AgreementStatus.PENDING,
-        Agreement.deadline < now - timedelta(hours=24),
-        Agreement.checklist_sent == True
-    ).all()
-    
-    for agreement in overdue:
-        # Mark as missed
-        crud.agreement.miss_agreement(db, agreement.id)
-        
-        # Send "shaming" message
-        chat = db.query(Chat).filter(Chat.goal_id == agreement.goal_id).first()
-        if chat:
-            tone = _goal_tone(db, agreement.goal_id)
-            content = coach_voice.pick("missed_agreement", tone, desc=agreement.description)
-            suggestions = ["Извини, забыл", "Нужна помощь", "Продолжаю"]
-            content += f"\n\n<!--SUGGESTIONS:{json.dumps(suggestions, ensure_ascii=False)}-->"
-            
-            await send_proactive_message(db, chat.id, content, min_interval=0)
-            print(f"✅ Missed agreement message sent for agreement {agreement.id}")
+    sent += len(await send_proactive_batch(db, outgoing))
+    if sent:
+        print(f"✅ Morning motivations sent: {sent}")
 
 
 async def proactive_check_loop():
-    """Background loop that checks for reminders and deadlines - Duolingo style!"""
+    """Background loop for missed days and morning motivations - Duolingo style!
+
+    Agreement reminders and checklists are not polled: deadline_scheduler sends them on time.
+    Runs in the one process that holds proactive_lease, however many workers are started.
+    """
     print("🚀 Proactive service started (Duolingo mode: ON 🦉)")
     
     while True:
+        await proactive_lease.wait()
         try:
             db = SessionLocal()
             try:
-                # Check every 5 minutes for urgent stuff
-                await check_and_send_reminders(db)
-                await check_and_send_deadline_checklists(db)
-                await check_and_mark_missed_agreements(db)
-                
                 # Check every 30 minutes for missed days
                 await check_and_send_missed_days_messages(db)
                 
@@ -416,5 +515,10 @@ async def proactive_check_loop():
 
 def start_proactive_service():
     """Start the proactive service in background"""
+    from app.services.deadline_scheduler import deadline_scheduler
+
+    presence_store.start()
+    proactive_lease.start()
     asyncio.create_task(proactive_check_loop())
+    deadline_scheduler.start()
 
@@ -1,10 +1,13 @@
 """
 Push notification service using Firebase Cloud Messaging (FCM)
 """
+import asyncio
 import os
 import json
 import httpx
-from typing import List, Optional, Dict, Any
+from fastapi.concurrency import run_in_threadpool
+from collections import Counter
+from typing import List, NamedTuple, Optional, Dict, Any
 from app.models.device_token import DeviceToken
 
 # FCM Server Key from environment
@@ -17,7 +20,8 @@ async def send_push_notification(
     title: str,
     body: str,
     data: Optional[Dict[str, Any]] = None,
-    priority: str = "high"
+    priority: str = "high",
+    client: Optional[httpx.AsyncClient] = None
 ) -> Dict[str, Any]:
     """
     Send push notification to multiple devices via FCM
@@ -28,6 +32,7 @@ async def send_push_notification(
         body: Notification body
         data: Optional data payload
         priority: 'high' or 'normal'
+        client: Shared HTTP client (keep-alive across many sends); a new one otherwise
     
     Returns:
         Dict with success/failure counts
@@ -60,38 +65,41 @@ async def send_push_notification(
     }
     
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
+        if client is None:
+            async with httpx.AsyncClient(timeout=10.0) as own_client:
+                response = await own_client.post(FCM_API_URL, json=payload, headers=headers)
+        else:
             response = await client.post(FCM_API_URL, json=payload, headers=headers)
-            response.raise_for_status()
-            
-            result = response.json()
-            
-            # Parse results
-            success_count = result.get("success", 0)
-            failure_count = result.get("failure", 0)
-            
-            # Check for invalid tokens
-            if "results" in result:
-                invalid_tokens = []
-                for i, res in enumerate(result["results"]):
-                    if "error" in res:
-                        error = res["error"]
-                        # Common errors: InvalidRegistration, NotRegistered
-                        if error in ["InvalidRegistration", "NotRegistered"]:
-                            invalid_tokens.append(tokens[i])
-                
-                return {
-                    "success": success_count,
-                    "failure": failure_count,
-                    "invalid_tokens": invalid_tokens,
-                    "errors": []
-                }
+        response.raise_for_status()
+        
+        result = response.json()
+        
+        # Parse results
+        success_count = result.get("success", 0)
+        failure_count = result.get("failure", 0)
+        
+        # Check for invalid tokens
+        if "results" in result:
+            invalid_tokens = []
+            for i, res in enumerate(result["results"]):
+                if "error" in res:
+                    error = res["error"]
+                    # Common errors: InvalidRegistration, NotRegistered
+                    if error in ["InvalidRegistration", "NotRegistered"]:
+                        invalid_tokens.append(tokens[i])
             
             return {
                 "success": success_count,
                 "failure": failure_count,
+                "invalid_tokens": invalid_tokens,
                 "errors": []
             }
+        
+        return {
+            "success": success_count,
+            "failure": failure_count,
+            "errors": []
+        }
     
     except Exception as e:
         print(f"❌ Error sending push notification: {e}")
@@ -144,3 +152,65 @@ async def send_push_to_user(
     
     return result
 
+
+class PushNotification(NamedTuple):
+    user_id: int
+    title: str
+    body: str
+    data: Optional[Dict[str, Any]] = None
+
+
+async def send_push_batch(db, notifications: List[PushNotification], concurrency: int = 20) -> Dict[str, int]:
+    """
+    Send many notifications (one per item) with at most `concurrency` FCM requests in flight.
+
+    Tokens are loaded in one query before the fan-out and their bookkeeping
+    (last_used_at, invalid tokens) is written in one transaction after it, so the
+    concurrent sends never touch the session; both run in the threadpool. All
+    requests share one HTTP client.
+    """
+    from app import crud
+
+    stats: Counter = Counter()
+    if not notifications:
+        return dict(stats)
+    if not FCM_SERVER_KEY:
+        print(f"⚠️ FCM_SERVER_KEY not set, skipping {len(notifications)} push notifications")
+        return {"skipped": len(notifications)}
+
+    tokens_by_user = await run_in_threadpool(
+        crud.device_token.get_tokens_by_users, db, [n.user_id for n in notifications]
+    )
+    used: set = set()
+    invalid: set = set()
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def send_one(client: httpx.AsyncClient, notification: PushNotification):
+        tokens = tokens_by_user.get(notification.user_id)
+        if not tokens:
+            stats["no_tokens"] += 1
+            return
+        async with semaphore:
+            result = await send_push_notification(
+                [token.token for token in tokens], notification.title, notification.body, notification.data,
+                client=client,
+            )
+        used.update(token.id for token in tokens)
+        invalid.update(result.get("invalid_tokens") or [])
+        stats["success"] += result.get("success", 0)
+        stats["failure"] += result.get("failure", 0)
+
+    limits = httpx.Limits(max_connections=max(concurrency, 1), max_keepalive_connections=max(concurrency, 1))
+    async with httpx.AsyncClient(timeout=10.0, limits=limits) as client:
+        await asyncio.gather(*(send_one(client, n) for n in notifications))
+
+    def update_tokens():
+        crud.device_token.mark_tokens_used(db, used)
+        if invalid:
+            print(f"✅ Deactivated {crud.device_token.deactivate_tokens(db, invalid)} invalid tokens")
+
+    try:
+        await run_in_threadpool(update_tokens)
+    except Exception as e:
+        print(f"⚠️ Error updating device tokens: {e}")
+    return dict(stats)
@@ -0,0 +1,90 @@
+"""
+Leader lease for background loops that must run once per deployment.
+
+Every uvicorn worker (and every instance) runs the same startup, so a loop like
+proactive_check_loop would otherwise do its work — and send its messages — once
+per process. A ServiceLease keeps a row in service_leases: the process holding
+it renews it every ttl/3 seconds and the guarded loop only runs there; when the
+holder dies another process takes over once the row expires, and a clean
+shutdown releases it right away.
+
+The lease is a row taken with a conditional UPDATE (as chat job claims are), so
+it behaves the same on PostgreSQL and SQLite and holds no connection between
+renewals. Work that is already claimed per row (chat jobs, agreement reminders)
+doesn't need it.
+"""
+import asyncio
+import os
+import socket
+from typing import Any, Dict, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from app import crud
+from app.core.config import settings
+from app.database.database import session_scope
+
+
+class ServiceLease:
+    def __init__(self, name: str):
+        self.name = name
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self._task: Optional[asyncio.Task] = None
+        self._leading: Optional[asyncio.Event] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._leading is not None and self._leading.is_set()
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._leading = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._renew_loop())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        if self.is_leader:
+            self._leading.clear()
+            try:
+                await run_in_threadpool(self._release)
+            except Exception as e:
+                print(f"⚠️ Could not release the '{self.name}' lease: {e}")
+
+    async def wait(self):
+        """Return once this process holds the lease (right away while it does)."""
+        if self._leading is None:
+            self.start()
+        await self._leading.wait()
+
+    async def _renew_loop(self):
+        ttl = max(settings.SERVICE_LEASE_TTL, 3.0)
+        while True:
+            try:
+                held = await run_in_threadpool(self._acquire, ttl)
+            except Exception as e:
+                # Can't reach the DB: stop leading, another process may take over once the row expires.
+                held = False
+                print(f"⚠️ '{self.name}' lease renewal failed: {e}")
+            if held and not self.is_leader:
+                print(f"👑 '{self.name}' lease taken by {self.holder}")
+                self._leading.set()
+            elif not held and self.is_leader:
+                print(f"⏸️ '{self.name}' lease lost by {self.holder}")
+                self._leading.clear()
+            await asyncio.sleep(ttl / 3)
+
+    def _acquire(self, ttl: float) -> bool:
+        with session_scope() as db:
+            return crud.service_lease.acquire_lease(db, self.name, self.holder, ttl)
+
+    def _release(self):
+        with session_scope() as db:
+            crud.service_lease.release_lease(db, self.name, self.holder)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"name": self.name, "holder": self.holder, "leader": self.is_leader}
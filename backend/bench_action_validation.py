@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк проверки ответов коуча (validate_response + реестр действий).
+
+Корпус — примеры ответов из промпта коуча (app/services/coach_prompt.py),
+те же ответы с ошибками, которые модель делает на практике, и ответы из
+JSON-файла (по одному envelope на строку), если он передан аргументом.
+
+    python bench_action_validation.py [responses.jsonl] [--rounds 2000] [--repeat 5]
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+# Добавляем путь к приложению
+sys.path.insert(0, os.path.dirname(__file__))
+
+
+def prompt_examples():
+    from app.services.coach_prompt import LEGACY_PROMPT_TEMPLATE
+
+    examples = []
+    for line in LEGACY_PROMPT_TEMPLATE.splitlines():
+        line = line.strip()
+        if not line.startswith('{{"message"'):
+            continue
+        line = line.split("}} —")[0] + ("}}" if "}} —" in line else "")
+        text = line.replace("{{", "{").replace("}}", "}").replace("\\\\", "\\")
+        try:
+            examples.append(json.loads(text))
+        except json.JSONDecodeError:
+            continue
+    return examples
+
+
+def broken_variants(examples):
+    """Ошибки, на которые validate_response должен ответить текстом для повторного запроса."""
+    variants = [
+        {"message": "План готов", "actions": [{"data": {"title": "Без типа"}}]},
+        {"message": "План готов", "actions": [{"type": "create_milestones", "data": {"title": "Опечатка"}}]},
+        {"message": "План готов", "actions": [{"type": "create_milestone", "data": {}}]},
+        {"message": "Удаляю", "actions": [{"type": "delete_milestone", "data": {}}]},
+        {"message": "Чек-лист", "actions": [{"type": "checklist", "data": {
+            "title": "Итоги дня", "items": [{"id": 1, "label": "Сделал зарядку", "type": "checkbox"}]}}]},
+        {"message": 'create_milestone: {"type":"create_milestone","data":{"title":"Шаг в тексте"}}'},
+        {"message": "Один объект", "action": {"type": "complete_milestone", "data": {"milestone_id": "12"}}},
+    ]
+    checklist = {"message": "Заполни чек-лист за сегодня 📝", "actions": [{"type": "checklist", "data": {
+        "title": "Итоги дня",
+        "items": [
+            {"id": "sport", "label": "Тренировка", "type": "boolean"},
+            {"id": "words", "label": "Новые слова", "type": "number", "unit": "шт"},
+            {"id": "note", "label": "Что помешало?", "type": "text"},
+        ]}}]}
+    return variants + [checklist]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("corpus", nargs="?", help="JSONL с ответами модели (по одному JSON на строку)")
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5, help="берётся лучший из повторов")
+    args = parser.parse_args()
+
+    from app.api.chats import validate_response
+
+    corpus = prompt_examples()
+    corpus += broken_variants(corpus)
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            corpus += [json.loads(line) for line in f if line.strip()]
+
+    actions = sum(len(parsed.get("actions") or []) for parsed in corpus)
+    valid_corpus = [p for p in corpus if validate_response(copy.deepcopy(p))[1] is None]
+    broken_corpus = [p for p in corpus if validate_response(copy.deepcopy(p))[1] is not None]
+    print(f"📋 Корпус: {len(corpus)} ответов, {actions} действий ({len(valid_corpus)} валидных)")
+
+    for name, responses in (("все", corpus), ("валидные", valid_corpus), ("с ошибкой", broken_corpus)):
+        best = None
+        for _ in range(args.repeat):
+            # validate_response может дописать поля: каждый раунд — на свежих копиях
+            rounds = [copy.deepcopy(responses) for _ in range(args.rounds)]
+            started = time.perf_counter()
+            for batch in rounds:
+                for parsed in batch:
+                    validate_response(parsed)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"⏱ validate_response, {name}: {best / (len(responses) * args.rounds) * 1e6:.1f} мкс/ответ")
+
+
+if __name__ == "__main__":
+    main()
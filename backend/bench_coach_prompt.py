@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк сборки системного промпта коуча (build_system_prompt).
+
+Цели — пустая, типичная (6 подцелей + договорённость) и большая (30 подцелей,
+10 договорённостей); тренеры — все сочетания тона и пола плюс выбор по
+умолчанию; раскладка промпта — обычная и с кэшируемым префиксом
+(LLM_PROMPT_CACHE_LAYOUT).
+
+    python bench_coach_prompt.py [--calls 2000] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+# Добавляем путь к приложению
+sys.path.insert(0, os.path.dirname(__file__))
+
+
+def goals():
+    """(название, goal, milestones, agreements) — объекты с теми же атрибутами, что у моделей."""
+    deadline = datetime.now() + timedelta(days=3)
+
+    def milestones(count):
+        return [SimpleNamespace(title=f"Шаг {i + 1}", is_completed=i % 2 == 0) for i in range(count)]
+
+    def agreements(count):
+        return [
+            SimpleNamespace(status="pending", description=f"Пробежать {5 + i} км до пятницы", deadline=deadline)
+            for i in range(count)
+        ]
+
+    goal = SimpleNamespace(title="Пробежать марафон")
+    return [
+        ("пустая цель", goal, [], None),
+        ("6 подцелей + 1 договорённость", goal, milestones(6), agreements(1)),
+        ("30 подцелей + 10 договорённостей", goal, milestones(30), agreements(10)),
+    ]
+
+
+def trainers():
+    from app.services.coach_prompt import VALID_TRAINER_GENDERS, VALID_TRAINER_TONES
+
+    return [None] + [f"{tone}_{gender}" for tone in sorted(VALID_TRAINER_TONES) for gender in sorted(VALID_TRAINER_GENDERS)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=2000, help="вызовов на каждую цель и раскладку")
+    parser.add_argument("--repeat", type=int, default=5, help="берётся лучший из повторов")
+    args = parser.parse_args()
+
+    from app.services.coach_prompt import build_system_prompt
+
+    trainer_ids = trainers()
+    for cache_layout in (False, True):
+        layout = "кэшируемый префикс" if cache_layout else "обычная раскладка"
+        for name, goal, milestones, agreements in goals():
+            sizes = {len(build_system_prompt(goal, milestones, agreements, tid, cache_layout=cache_layout))
+                     for tid in trainer_ids}
+            best = None
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                for i in range(args.calls):
+                    build_system_prompt(goal, milestones, agreements, trainer_ids[i % len(trainer_ids)],
+                                        cache_layout=cache_layout)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"⏱ {layout}, {name}: {best / args.calls * 1e6:.1f} мкс/вызов "
+                  f"({min(sizes)}–{max(sizes)} символов)")
+
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,11 @@ interface Message {
     action: string;
     data?: any;
   }>;
+  // Set by the backend; without it (older backends) the data is parsed from markers in content
+  text?: string | null;
+  pending_actions?: PendingAction[] | null;
+  checklist?: ChecklistData | null;
+  suggestions?: string[] | null;
 }
 
 interface ChatInterfaceProps {
@@ -105,6 +110,30 @@ const parseSuggestions = (content: string): { cleanContent: string; suggestions:
   return { cleanContent: content, suggestions: [] };
 };
 
+// Text, pending actions, checklist and suggestions of a message
+const messageParts = (message: Message): {
+  cleanContent: string;
+  pendingActions: PendingAction[];
+  checklist: ChecklistData | null;
+  suggestions: string[];
+} => {
+  if (message.sender !== 'ai') {
+    return { cleanContent: message.content, pendingActions: [], checklist: null, suggestions: [] };
+  }
+  if (message.text != null) {
+    return {
+      cleanContent: message.text,
+      pendingActions: message.pending_actions || [],
+      checklist: message.checklist || null,
+      suggestions: message.suggestions || [],
+    };
+  }
+  const { cleanContent: contentAfterActions, pendingActions } = parsePendingActions(message.content);
+  const { cleanContent: contentAfterChecklist, checklist } = parseChecklist(contentAfterActions);
+  const { cleanContent, suggestions } = parseSuggestions(contentAfterChecklist);
+  return { cleanContent, pendingActions, checklist, suggestions };
+};
+
 const ChatInterface: React.FC<ChatInterfaceProps> = ({ 
   goalId, 
   chatId,
@@ -180,19 +209,8 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
     <div className="chat-container">
       <div className="chat-messages">
         {messages.map((message, msgIndex) => {
-          // Parse pending actions and checklist from AI messages
-          const { cleanContent: contentAfterActions, pendingActions } = message.sender === 'ai' 
-            ? parsePendingActions(message.content)
-            : { cleanContent: message.content, pendingActions: [] };
-          
-          const { cleanContent: contentAfterChecklist, checklist } = message.sender === 'ai'
-            ? parseChecklist(contentAfterActions)
-            : { cleanContent: contentAfterActions, checklist: null };
-          
-          // Also parse suggestions (but don't display them inline - they go above input)
-          const { cleanContent } = message.sender === 'ai'
-            ? parseSuggestions(contentAfterChecklist)
-            : { cleanContent: contentAfterChecklist };
+          // Pending actions and checklist of AI messages (suggestions go above the input, not inline)
+          const { cleanContent, pendingActions, checklist } = messageParts(message);
           
           // Check if this is the last AI message with pending actions or checklist
           const isLastMessage = msgIndex === messages.length - 1;
@@ -311,7 +329,7 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
         // Get suggestions from the last AI message
         const lastAiMessage = [...messages].reverse().find(m => m.sender === 'ai');
         if (lastAiMessage && !disabled) {
-          const { suggestions } = parseSuggestions(lastAiMessage.content);
+          const { suggestions } = messageParts(lastAiMessage);
           if (suggestions.length > 0) {
             return (
               <div className="suggestions-container">
@@ -1,10 +1,11 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useI18n } from '../i18n';
 import ChatInterface from '../components/ChatInterface';
 import ProgressBar from '../components/ProgressBar';
 import GoalDetailModal from '../components/GoalDetailModal';
 import { milestonesAPI, tasksAPI, Milestone, Task, Goal as ApiGoal } from '../services/api';
 import { DebugSettings } from '../components/DebugMenu';
+import { openMessageStream, StreamMessage } from '../services/messageStream';
 import './ChatView.css';
 
 interface Message {
@@ -12,8 +13,20 @@ interface Message {
   content: string;
   sender: 'user' | 'ai';
   timestamp: Date;
+  text?: string | null;
+  pending_actions?: Array<{ type: string; data: Record<string, any> }> | null;
+  checklist?: any | null;
+  suggestions?: string[] | null;
 }
 
+// Structured parts of a backend message (text + the data stored with it)
+const structuredFields = (m: Pick<StreamMessage, 'text' | 'pending_actions' | 'checklist' | 'suggestions'>) => ({
+  text: m.text,
+  pending_actions: m.pending_actions,
+  checklist: m.checklist,
+  suggestions: m.suggestions,
+});
+
 interface Goal {
   id: number;
   title: string;
@@ -46,6 +59,11 @@ const ChatView: React.FC<ChatViewProps> = ({ goal, onBack, onDeleteGoal, onGoalC
   const [loadingAI, setLoadingAI] = useState(false);
   const [processedGoalIds, setProcessedGoalIds] = useState<Set<number>>(new Set());
   const [lastMessageId, setLastMessageId] = useState<number>(0);
+  const [streamLive, setStreamLive] = useState(false);
+  const lastMessageIdRef = useRef(0);
+  const loadingAIRef = useRef(false);
+  lastMessageIdRef.current = lastMessageId;
+  loadingAIRef.current = loadingAI;
 
   const loadMilestones = async (showLoading = false) => {
     if (!goal) return;
@@ -212,52 +230,89 @@ const ChatView: React.FC<ChatViewProps> = ({ goal, onBack, onDeleteGoal, onGoalC
     return () => clearInterval(interval);
   }, [chatId]);
 
-  // Poll for proactive messages from AI
+  // Add messages that arrived outside the send flow (proactive messages, other devices)
+  const appendNewMessages = (newMessages: StreamMessage[]) => {
+    if (newMessages.length === 0) return;
+    const formattedNewMessages = newMessages.map((m) => ({
+      id: m.id,
+      content: m.content,
+      sender: m.sender as 'user' | 'ai',
+      timestamp: new Date(m.created_at || Date.now()),
+      ...structuredFields(m)
+    }));
+    
+    setMessages(prev => {
+      const existingIds = new Set(prev.map(m => m.id));
+      const uniqueNew = formattedNewMessages.filter((m: Message) => !existingIds.has(m.id));
+      if (uniqueNew.length > 0) {
+        console.log('📥 Received proactive messages:', uniqueNew.length);
+        return [...prev, ...uniqueNew];
+      }
+      return prev;
+    });
+    
+    // Update last message ID
+    const maxId = Math.max(...newMessages.map((m) => m.id));
+    lastMessageIdRef.current = Math.max(lastMessageIdRef.current, maxId); // next (long) poll starts after it
+    setLastMessageId(prev => Math.max(prev, maxId));
+    
+    // Reload milestones in case of updates (silent)
+    loadMilestones(false);
+  };
+
+  // wait > 0: long poll — the server answers as soon as a message arrives (or after `wait` seconds)
+  const fetchNewMessages = async (wait = 0, signal?: AbortSignal) => {
+    const { getApiUrl } = await import('../config/api');
+    const response = await fetch(
+      getApiUrl(`/api/chats/${chatId}/new-messages/?after_id=${lastMessageIdRef.current}&wait=${wait}`),
+      { signal }
+    );
+    if (!response.ok) throw new Error(`new-messages: ${response.status}`);
+    const newMessages = await response.json();
+    if (!loadingAIRef.current) appendNewMessages(newMessages);
+  };
+
+  // Realtime channel for new messages (WebSocket, SSE fallback)
   useEffect(() => {
-    if (!chatId || loadingAI) return;
+    if (!chatId) return;
     
-    const checkNewMessages = async () => {
-      try {
-        const { getApiUrl } = await import('../config/api');
-        const response = await fetch(getApiUrl(`/api/chats/${chatId}/new-messages/?after_id=${lastMessageId}`));
-        if (response.ok) {
-          const newMessages = await response.json();
-          if (newMessages.length > 0) {
-            // Add new proactive messages
-            const formattedNewMessages = newMessages.map((m: any) => ({
-              id: m.id,
-              content: m.content,
-              sender: m.sender as 'user' | 'ai',
-              timestamp: new Date(m.created_at || Date.now())
-            }));
-            
-            setMessages(prev => {
-              const existingIds = new Set(prev.map(m => m.id));
-              const uniqueNew = formattedNewMessages.filter((m: Message) => !existingIds.has(m.id));
-              if (uniqueNew.length > 0) {
-                console.log('📥 Received proactive messages:', uniqueNew.length);
-                return [...prev, ...uniqueNew];
-              }
-              return prev;
-            });
-            
-            // Update last message ID
-            const maxId = Math.max(...newMessages.map((m: any) => m.id));
-            setLastMessageId(maxId);
-            
-            // Reload milestones in case of updates (silent)
-            loadMilestones(false);
-          }
+    const close = openMessageStream({
+      chatId,
+      getAfterId: () => lastMessageIdRef.current,
+      onMessage: (message) => {
+        // While a reply is loading the send flow reloads the whole chat itself
+        if (!loadingAIRef.current) appendNewMessages([message]);
+      },
+      onResync: () => { fetchNewMessages().catch(() => {}); },
+      onStatus: setStreamLive
+    });
+    return () => {
+      setStreamLive(false);
+      if (close) close();
+    };
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [chatId]);
+
+  // Long-poll for proactive messages from AI (only while the realtime channel is down)
+  useEffect(() => {
+    if (!chatId || loadingAI || streamLive) return;
+    
+    const controller = new AbortController();
+    const poll = async () => {
+      while (!controller.signal.aborted) {
+        try {
+          await fetchNewMessages(25, controller.signal); // held open by the server up to 25 s
+        } catch (err) {
+          // Ignore polling errors, retry a bit later
+          if (controller.signal.aborted) return;
+          await new Promise(resolve => setTimeout(resolve, 10000));
         }
-      } catch (err) {
-        // Ignore polling errors
       }
     };
-    
-    const interval = setInterval(checkNewMessages, 10000); // Every 10 seconds
-    return () => clearInterval(interval);
+    poll();
+    return () => controller.abort();
     // eslint-disable-next-line react-hooks/exhaustive-deps
-  }, [chatId, lastMessageId, loadingAI]);
+  }, [chatId, loadingAI, streamLive]);
 
   const initializeChat = async () => {
     if (!goal) return;
@@ -284,7 +339,8 @@ const ChatView: React.FC<ChatViewProps> = ({ goal, onBack, onDeleteGoal, onGoalC
           id: m.id,
           content: m.content,
           sender: m.sender as 'user' | 'ai',
-          timestamp: new Date(m.created_at || m.timestamp || Date.now())
+          timestamp: new Date(m.created_at || m.timestamp || Date.now()),
+          ...structuredFields(m)
         })));
         // Track last message ID for proactive polling
         if (messages.length > 0) {
@@ -414,7 +470,8 @@ const ChatView: React.FC<ChatViewProps> = ({ goal, onBack, onDeleteGoal, onGoalC
                 id: m.id,
                 content: content,
                 sender: m.sender as 'user' | 'ai',
-                timestamp: new Date(m.created_at || m.timestamp || Date.now())
+                timestamp: new Date(m.created_at || m.timestamp || Date.now()),
+                ...structuredFields(m)
               };
             });
             setMessages(formattedMessages);
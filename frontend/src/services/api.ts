@@ -50,6 +50,11 @@ export interface Message {
   sender: 'user' | 'ai';
   timestamp?: string; // Legacy field
   created_at?: string; // Backend field
+  // text as the LLM sees it + the data the backend stores with the message (payload)
+  text?: string | null;
+  pending_actions?: Array<{ type: string; data: Record<string, any> }> | null;
+  checklist?: any | null;
+  suggestions?: string[] | null;
 }
 
 export interface Chat {
@@ -0,0 +1,117 @@
+/**
+ * Realtime chat messages (backend: /api/events/ws, SSE fallback /api/events/stream).
+ * Replaces polling GET /api/chats/{id}/new-messages/ while the connection is up.
+ */
+import { getApiUrl } from '../config/api';
+
+export interface StreamMessage {
+  id: number;
+  chat_id: number;
+  content: string;
+  sender: string;
+  created_at?: string | null;
+  text?: string | null;
+  pending_actions?: Array<{ type: string; data: Record<string, any> }> | null;
+  checklist?: any | null;
+  suggestions?: string[] | null;
+}
+
+export interface MessageStreamOptions {
+  chatId: number;
+  getAfterId: () => number; // last message id the screen already has (catch-up on (re)connect)
+  onMessage: (message: StreamMessage) => void;
+  onResync?: () => void; // the server dropped events for this connection: re-fetch new-messages
+  onStatus?: (live: boolean) => void;
+}
+
+const RECONNECT_DELAY_MS = 3000;
+
+const buildUrl = (path: string, params: Record<string, string | number>): string => {
+  const query = Object.entries(params)
+    .map(([key, value]) => `${encodeURIComponent(key)}=${encodeURIComponent(String(value))}`)
+    .join('&');
+  return `${getApiUrl(path)}?${query}`;
+};
+
+/**
+ * Open the channel: WebSocket first, EventSource if the WebSocket can't connect.
+ * Returns a function that closes it, or null when there is no auth token (keep polling).
+ */
+export function openMessageStream(options: MessageStreamOptions): (() => void) | null {
+  const token = localStorage.getItem('auth_token');
+  if (!token) return null;
+
+  let closed = false;
+  let socket: WebSocket | null = null;
+  let source: EventSource | null = null;
+  let reconnectTimer: ReturnType<typeof setTimeout> | null = null;
+
+  const params = () => ({ token, chat_id: options.chatId, after_id: options.getAfterId() });
+
+  const handleFrame = (frame: any) => {
+    if (frame?.type === 'message' && frame.message) {
+      options.onMessage(frame.message);
+    } else if (frame?.type === 'resync') {
+      options.onResync?.();
+    }
+  };
+
+  const openEventSource = () => {
+    if (closed || typeof EventSource === 'undefined') {
+      options.onStatus?.(false);
+      return;
+    }
+    source = new EventSource(buildUrl('/api/events/stream', params()));
+    source.onopen = () => options.onStatus?.(true);
+    source.onerror = () => options.onStatus?.(false); // EventSource reconnects by itself (Last-Event-ID)
+    source.addEventListener('message', (event: MessageEvent) => {
+      try {
+        handleFrame({ type: 'message', message: JSON.parse(event.data) });
+      } catch {
+        // Ignore malformed frames
+      }
+    });
+    source.addEventListener('resync', () => handleFrame({ type: 'resync' }));
+  };
+
+  const openWebSocket = () => {
+    if (closed) return;
+    if (typeof WebSocket === 'undefined') {
+      openEventSource();
+      return;
+    }
+    let opened = false;
+    socket = new WebSocket(buildUrl('/api/events/ws', params()).replace(/^http/, 'ws'));
+    socket.onopen = () => {
+      opened = true;
+      options.onStatus?.(true);
+    };
+    socket.onmessage = (event: MessageEvent) => {
+      try {
+        handleFrame(JSON.parse(event.data));
+      } catch {
+        // Ignore malformed frames
+      }
+    };
+    socket.onclose = () => {
+      socket = null;
+      if (closed) return;
+      options.onStatus?.(false);
+      if (!opened) {
+        // WebSockets are blocked on this network/proxy: use SSE instead.
+        openEventSource();
+        return;
+      }
+      reconnectTimer = setTimeout(openWebSocket, RECONNECT_DELAY_MS);
+    };
+  };
+
+  openWebSocket();
+
+  return () => {
+    closed = true;
+    if (reconnectTimer) clearTimeout(reconnectTimer);
+    socket?.close();
+    source?.close();
+  };
+}